@@ -1,11 +1,16 @@
 from sqladmin import Admin, ModelView
 
-from app.database import engine
+from app.database import engine, session_maker
+from app.products.cache import ProductCacheService
+from app.products.dao import CategoryDao, ProductDao
 from app.orders.models import (Basket, Order, OrderDeliveryDetail,
                                OrderPickUpDetail, OrderType, Purchase)
 from app.products.models import (Category, FavoriteProduct, HistoryQueryUser,
                                  Product, Review)
+from app.redis.cache import category_tag, invalidate_cache_tags
+from app.redis.client import redis_async_client
 from app.stores.models import Store, StoreQuantityInfo
+from app.tasks.tasks import refresh_recommendation_candidates
 from app.users.models import RefreshTokenBL, User
 
 
@@ -85,6 +90,54 @@ class ProductAdmin(ModelView, model=Product):
     column_sortable_list = [Product.price, Product.rating]
     page_size = 20
 
+    async def on_model_change(self, data, model, is_created, request):
+        # Категория до изменения: при переносе товара обновляется и старая категория
+        request.state.previous_category_id = None if is_created else model.category_id
+
+    async def after_model_change(self, data, model, is_created, request):
+        await ProductCacheService(redis_async_client).invalidate(model.product_id)
+        previous_category_id = getattr(request.state, "previous_category_id", None)
+        category_ids = {model.category_id, previous_category_id}
+        category_ids.discard(None)
+        for category_id in category_ids:
+            await self._invalidate_category(category_id)
+        # При переносе товара меняются любимые категории пользователей, у которых он в избранном
+        user_ids = []
+        if previous_category_id is not None and previous_category_id != model.category_id:
+            user_ids = await self._favorited_user_ids(model.product_id)
+        if category_ids or user_ids:
+            refresh_recommendation_candidates.delay(
+                category_ids=sorted(category_ids), user_ids=user_ids
+            )
+
+    async def on_model_delete(self, model, request):
+        # Избранное удаляется вместе с товаром, поэтому пользователи берутся до удаления
+        request.state.favorited_user_ids = await self._favorited_user_ids(model.product_id)
+
+    async def after_model_delete(self, model, request):
+        await ProductCacheService(redis_async_client).invalidate(model.product_id)
+        await self._invalidate_category(model.category_id)
+        user_ids = getattr(request.state, "favorited_user_ids", [])
+        if model.category_id is not None or user_ids:
+            refresh_recommendation_candidates.delay(
+                category_ids=[model.category_id] if model.category_id is not None else [],
+                user_ids=user_ids,
+            )
+
+    async def _favorited_user_ids(self, product_id: int) -> list[int]:
+        """id пользователей, у которых товар в избранном"""
+        async with session_maker() as session:
+            return await ProductDao(session).get_favorited_user_ids(product_id)
+
+    async def _invalidate_category(self, category_id: int):
+        """Сброс кэша страниц каталога и фильтров категории товара"""
+        async with session_maker() as session:
+            category = await CategoryDao(session).find_by_filter_one(
+                category_id=category_id
+            )
+        if category is not None:
+            await invalidate_cache_tags(category_tag(category.title))
+
 
 class ReviewAdmin(ModelView, model=Review):
     name = "Review"
@@ -101,6 +154,18 @@ class FavoriteProductAdmin(ModelView, model=FavoriteProduct):
     column_list = [c.name for c in FavoriteProduct.__table__.c]\
         # + [FavoriteProduct.relationship_user, FavoriteProduct.relationship_product]
 
+    async def on_model_change(self, data, model, is_created, request):
+        # Пользователь до изменения: при переносе избранного обновляется и он
+        request.state.previous_user_id = None if is_created else model.user_id
+
+    async def after_model_change(self, data, model, is_created, request):
+        user_ids = {model.user_id, getattr(request.state, "previous_user_id", None)}
+        user_ids.discard(None)
+        refresh_recommendation_candidates.delay(user_ids=sorted(user_ids))
+
+    async def after_model_delete(self, model, request):
+        refresh_recommendation_candidates.delay(user_ids=[model.user_id])
+
 
 class HistoryQueryUserAdmin(ModelView, model=HistoryQueryUser):
     name = "Search History"
@@ -67,6 +67,10 @@ class Settings(BaseSettings):
     ELASTIC_PORT: int
 
     INDEX_PRODUCTS: str
+    # Поисковый движок: elasticsearch или trigram (индекс в памяти процесса, без elasticsearch)
+    SEARCH_BACKEND: Literal["elasticsearch", "trigram"] = "elasticsearch"
+    # Порт http сервера метрик prometheus воркеров celery, None - метрики не отдаются
+    CELERY_METRICS_PORT: int | None = 9100
 
     LIMIT_SECONDS_GET_CODE: int
 
@@ -84,6 +84,22 @@ class BaseDao:
                 detail=f"Ошибка при поиске строки по фильтру в {self.model}",
             )
 
+    async def stream_all(self, batch_size: int = 1000):
+        """
+        Чтение всей таблицы серверным курсором
+
+        Отдает строки пачками по batch_size, в памяти держится только текущая пачка
+        """
+        query = select(self.model).execution_options(yield_per=batch_size)
+        try:
+            result = await self.session.stream_scalars(query)
+            async for rows in result.partitions():
+                yield rows
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, f"Failed stream rows of {self.model}")
+            logger.error(msg, extra={"batch_size": batch_size}, exc_info=True)
+            raise
+
 
 # Синхронный вариант для celery
 class BaseSyncDao:
@@ -96,3 +112,17 @@ class BaseSyncDao:
         query = select(self.model)
         obj = self.session.execute(query)
         return obj.scalars().all()
+
+    def stream_all(self, batch_size: int = 1000):
+        """
+        Чтение всей таблицы серверным курсором (sync)
+
+        Отдает строки пачками по batch_size, в памяти держится только текущая пачка
+        """
+        query = select(self.model).execution_options(yield_per=batch_size)
+        try:
+            yield from self.session.execute(query).scalars().partitions()
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, f"Failed stream rows of {self.model} (sync)")
+            logger.error(msg, extra={"batch_size": batch_size}, exc_info=True)
+            raise
@@ -1,10 +1,60 @@
+import asyncio
+import queue
+import threading
+from collections.abc import AsyncIterable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+
 from elasticsearch import AsyncElasticsearch, Elasticsearch
-from elasticsearch.exceptions import ElasticsearchWarning
-from elasticsearch.helpers import BulkIndexError, async_bulk, bulk
+from elasticsearch.exceptions import ElasticsearchWarning, NotFoundError
+from elasticsearch.helpers import (BulkIndexError, async_bulk,
+                                   async_streaming_bulk, bulk, streaming_bulk)
 from fastapi import HTTPException, status
 
 from app.logger import logger
 
+BULK_CHUNK_SIZE = 500
+BULK_MAX_CHUNK_BYTES = 10 * 1024 * 1024
+BULK_CONCURRENCY = 4
+# Повторы документов, отклоненных перегруженным кластером (429), с экспоненциальной паузой
+BULK_MAX_RETRIES = 3
+# Как часто потоки sync загрузки проверяют, не закончились ли документы
+BULK_QUEUE_POLL_SEC = 0.5
+# Сколько ошибок отдельных документов попадает в лог за одну массовую загрузку
+BULK_LOGGED_ERRORS = 10
+
+
+class BulkStats:
+    """Счетчики массовой загрузки с логированием результата каждого bulk запроса"""
+
+    def __init__(self, index_name: str, sync: bool = False):
+        self.index_name = index_name
+        self.suffix = ' (sync)' if sync else ''
+        self.success = 0
+        self.failed = 0
+        self.errors: list[dict] = []
+        # Чанки сдают несколько потоков (sync) или задач
+        self._lock = threading.Lock()
+
+    def add_chunk(self, results: list[tuple[bool, dict]]) -> None:
+        """Результат одного bulk запроса (с его повторами): пары (ok, item) по документам"""
+        chunk_success = sum(1 for ok, _ in results if ok)
+        chunk_failed = len(results) - chunk_success
+        with self._lock:
+            self.success += chunk_success
+            self.failed += chunk_failed
+            for ok, item in results:
+                if not ok and len(self.errors) < BULK_LOGGED_ERRORS:
+                    self.errors.append(item)
+            total_success, total_failed = self.success, self.failed
+        log = logger.warning if chunk_failed else logger.debug
+        log('Bulk chunk processed' + self.suffix, extra={
+            'index': self.index_name,
+            'success': chunk_success,
+            'failed': chunk_failed,
+            'total_success': total_success,
+            'total_failed': total_failed
+        })
+
 
 class ElasticsearchDao:
     def __init__(self, el_cl: AsyncElasticsearch):
@@ -54,6 +104,81 @@ class ElasticsearchDao:
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail='Ошибка при массовом добавлении документов'
             )
+
+    async def add_documents_streaming(
+        self,
+        index_name: str,
+        actions: AsyncIterable[dict],
+        chunk_size: int = BULK_CHUNK_SIZE,
+        max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES,
+        concurrency: int = BULK_CONCURRENCY,
+    ) -> int:
+        """
+        Массовая загрузка документов из асинхронного генератора
+
+        Документы идут через ограниченную очередь в concurrency задач, каждая собирает
+        чанк и отправляет его одним bulk запросом, поэтому в памяти не больше нескольких чанков.
+        Отклоненные кластером (429) документы повторяются до BULK_MAX_RETRIES раз.
+        Возвращает количество загруженных документов, если часть документов не загрузилась -
+        HTTPException после обработки всех документов
+        """
+        stats = BulkStats(index_name)
+        actions_queue: asyncio.Queue = asyncio.Queue(maxsize=chunk_size * concurrency)
+
+        async def produce():
+            async for action in actions:
+                await actions_queue.put(action)
+            for _ in range(concurrency):
+                await actions_queue.put(None)
+
+        async def consume():
+            done = False
+            while not done:
+                chunk = []
+                while len(chunk) < chunk_size:
+                    action = await actions_queue.get()
+                    if action is None:
+                        done = True
+                        break
+                    chunk.append(action)
+                if chunk:
+                    stats.add_chunk([
+                        result
+                        async for result in async_streaming_bulk(
+                            self.el_cl,
+                            chunk,
+                            chunk_size=chunk_size,
+                            max_chunk_bytes=max_chunk_bytes,
+                            max_retries=BULK_MAX_RETRIES,
+                            raise_on_error=False,
+                        )
+                    ])
+
+        try:
+            async with asyncio.TaskGroup() as task_group:
+                task_group.create_task(produce())
+                for _ in range(concurrency):
+                    task_group.create_task(consume())
+        except* ElasticsearchWarning:
+            logger.error('Failed to stream documents', extra={'index': index_name, 'success': stats.success}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail='Ошибка при массовом добавлении документов'
+            )
+
+        if stats.failed:
+            logger.warning('Some documents failed to index', extra={
+                'index': index_name,
+                'success': stats.success,
+                'failed': stats.failed,
+                'errors': stats.errors
+            })
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f'Не все документы были добавлены. Успешно: {stats.success}, Ошибок: {stats.failed}'
+            )
+        logger.info('Documents streamed successfully', extra={'index': index_name, 'count': stats.success})
+        return stats.success
            
     async def delete_index(self, index_name: str):
         try:
@@ -66,6 +191,44 @@ class ElasticsearchDao:
                 detail=f'Ошибка при удалении индекса {index_name}'
             )
 
+    async def get_indices(self, pattern: str) -> list[str]:
+        """Имена индексов по шаблону (например, index_products_v*)"""
+        result = await self.el_cl.indices.get(index=pattern, expand_wildcards='open,closed')
+        return list(result.keys())
+
+    async def get_alias_indices(self, alias: str) -> list[str]:
+        """Индексы, на которые указывает алиас"""
+        try:
+            result = await self.el_cl.indices.get_alias(name=alias)
+        except NotFoundError:
+            return []
+        return list(result.keys())
+
+    async def swap_alias(self, alias: str, index_name: str, old_indices: list[str], remove_index: str | None = None):
+        """
+        Атомарное переключение алиаса на index_name
+
+        remove_index - обычный индекс с именем алиаса, который удаляется в том же запросе
+        """
+        actions = [{'remove': {'index': old_index, 'alias': alias}} for old_index in old_indices]
+        if remove_index is not None:
+            actions.append({'remove_index': {'index': remove_index}})
+        actions.append({'add': {'index': index_name, 'alias': alias}})
+        try:
+            await self.el_cl.indices.update_aliases(actions=actions)
+            logger.info('Alias swapped', extra={'alias': alias, 'index': index_name, 'old_indices': old_indices})
+        except ElasticsearchWarning as e:
+            logger.error('Failed to swap alias', extra={'alias': alias, 'index': index_name}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f'Ошибка при переключении алиаса {alias}'
+            )
+
+    async def finish_bulk_load(self, index_name: str, index_settings: dict):
+        """Возврат настроек индекса после массовой загрузки и refresh, чтобы документы были видны поиску"""
+        await self.el_cl.indices.put_settings(index=index_name, settings=index_settings)
+        await self.el_cl.indices.refresh(index=index_name)
+
 
 # Синхронный вариант для celery
 class ElasticsearchSyncDao:
@@ -105,6 +268,107 @@ class ElasticsearchSyncDao:
             logger.error('Failed to add documents (sync)', extra={'index': index_name, 'count': len(documents)}, exc_info=True)
             raise
            
+    def apply_changes(self, index_name: str, actions: list[dict]):
+        """Массовые index/delete документов, удаление уже отсутствующего документа не считается ошибкой"""
+        try:
+            result = bulk(self.el_cl, actions, ignore_status=404)
+            logger.info('Documents changes applied (sync)', extra={'index': index_name, 'count': len(actions)})
+            return result
+        except BulkIndexError as e:
+            logger.warning('Some documents changes failed (sync)', extra={
+                'index': index_name,
+                'total': len(actions),
+                'failed': len(e.errors)
+            })
+            raise
+        except ElasticsearchWarning as e:
+            logger.error('Failed to apply documents changes (sync)', extra={'index': index_name, 'count': len(actions)}, exc_info=True)
+            raise
+
+    def add_documents_streaming(
+        self,
+        index_name: str,
+        actions: Iterable[dict],
+        chunk_size: int = BULK_CHUNK_SIZE,
+        max_chunk_bytes: int = BULK_MAX_CHUNK_BYTES,
+        concurrency: int = BULK_CONCURRENCY,
+    ) -> int:
+        """
+        Массовая загрузка документов из генератора в concurrency потоков
+
+        Генератор читается в текущем потоке (сессия бд не потокобезопасна) в ограниченную
+        очередь, потоки собирают из нее чанки и отправляют каждый одним bulk запросом
+        (streaming_bulk), в памяти не больше нескольких чанков. Отклоненные кластером (429)
+        документы повторяются до BULK_MAX_RETRIES раз, как и в асинхронном варианте.
+        Возвращает количество загруженных документов, если часть документов не загрузилась -
+        BulkIndexError после обработки всех документов
+        """
+        stats = BulkStats(index_name, sync=True)
+        actions_queue: queue.Queue = queue.Queue(maxsize=chunk_size * concurrency)
+        # produced - документы кончились, failed - поток упал и читать генератор дальше незачем
+        produced = threading.Event()
+        failed = threading.Event()
+
+        def next_action():
+            while True:
+                try:
+                    return actions_queue.get(timeout=BULK_QUEUE_POLL_SEC)
+                except queue.Empty:
+                    if produced.is_set() or failed.is_set():
+                        return None
+
+        def consume():
+            try:
+                while True:
+                    chunk = []
+                    while len(chunk) < chunk_size and (action := next_action()) is not None:
+                        chunk.append(action)
+                    if not chunk:
+                        return
+                    stats.add_chunk(list(streaming_bulk(
+                        self.el_cl,
+                        chunk,
+                        chunk_size=chunk_size,
+                        max_chunk_bytes=max_chunk_bytes,
+                        max_retries=BULK_MAX_RETRIES,
+                        raise_on_error=False,
+                    )))
+            except Exception:
+                failed.set()
+                raise
+
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                consumers = [executor.submit(consume) for _ in range(concurrency)]
+                try:
+                    for action in actions:
+                        while not failed.is_set():
+                            try:
+                                actions_queue.put(action, timeout=BULK_QUEUE_POLL_SEC)
+                                break
+                            except queue.Full:
+                                continue
+                        if failed.is_set():
+                            break
+                finally:
+                    produced.set()
+                for consumer in consumers:
+                    consumer.result()
+        except ElasticsearchWarning as e:
+            logger.error('Failed to stream documents (sync)', extra={'index': index_name, 'success': stats.success}, exc_info=True)
+            raise
+
+        if stats.failed:
+            logger.warning('Some documents failed to index (sync)', extra={
+                'index': index_name,
+                'success': stats.success,
+                'failed': stats.failed,
+                'errors': stats.errors
+            })
+            raise BulkIndexError(f'{stats.failed} document(s) failed to index', stats.errors)
+        logger.info('Documents streamed successfully (sync)', extra={'index': index_name, 'count': stats.success})
+        return stats.success
+
     def delete_index(self, index_name: str):
         try:
             self.el_cl.indices.delete(index=index_name)
@@ -114,4 +378,39 @@ class ElasticsearchSyncDao:
             raise
         
     def index_exists(self, index):
-        return self.el_cl.indices.exists(index=index)
\ No newline at end of file
+        return self.el_cl.indices.exists(index=index)
+
+    def get_indices(self, pattern: str) -> list[str]:
+        """Имена индексов по шаблону (например, index_products_v*)"""
+        result = self.el_cl.indices.get(index=pattern, expand_wildcards='open,closed')
+        return list(result.keys())
+
+    def get_alias_indices(self, alias: str) -> list[str]:
+        """Индексы, на которые указывает алиас"""
+        try:
+            result = self.el_cl.indices.get_alias(name=alias)
+        except NotFoundError:
+            return []
+        return list(result.keys())
+
+    def swap_alias(self, alias: str, index_name: str, old_indices: list[str], remove_index: str | None = None):
+        """
+        Атомарное переключение алиаса на index_name
+
+        remove_index - обычный индекс с именем алиаса, который удаляется в том же запросе
+        """
+        actions = [{'remove': {'index': old_index, 'alias': alias}} for old_index in old_indices]
+        if remove_index is not None:
+            actions.append({'remove_index': {'index': remove_index}})
+        actions.append({'add': {'index': index_name, 'alias': alias}})
+        try:
+            self.el_cl.indices.update_aliases(actions=actions)
+            logger.info('Alias swapped (sync)', extra={'alias': alias, 'index': index_name, 'old_indices': old_indices})
+        except ElasticsearchWarning as e:
+            logger.error('Failed to swap alias (sync)', extra={'alias': alias, 'index': index_name}, exc_info=True)
+            raise
+
+    def finish_bulk_load(self, index_name: str, index_settings: dict):
+        """Возврат настроек индекса после массовой загрузки и refresh, чтобы документы были видны поиску"""
+        self.el_cl.indices.put_settings(index=index_name, settings=index_settings)
+        self.el_cl.indices.refresh(index=index_name)
@@ -1,4 +1,7 @@
-from elasticsearch.exceptions import ConnectionError, ElasticsearchWarning
+import re
+
+from elasticsearch.exceptions import (ConnectionError, ConnectionTimeout,
+                                      ElasticsearchWarning)
 from fastapi import HTTPException, status
 from sqlalchemy.orm import Session
 
@@ -6,114 +9,308 @@ from app.config import settings
 from app.elasticsearch.elasticsearch_dao import (ElasticsearchDao,
                                                  ElasticsearchSyncDao)
 from app.logger import logger
-from app.products.dao import ProductDao, ProductSyncDao
-from app.products.schema import ProductReturnSchema
-
+from app.products.dao import (ProductDao, ProductIndexOutboxSyncDao,
+                              ProductSyncDao)
+from app.products.cache import LocalTTLCache
+from app.products.pagination import (SEARCH_PAGE_SIZE, decode_search_cursor,
+                                     encode_search_cursor)
+from app.products.schema import ProductResponseSchema, ProductReturnSchema
+from app.redis.cache import normalize_search_text
+from app.search.backend import SearchBackend
 
-class ElasticsearchService:
-    def __init__(self, el_dao: ElasticsearchDao):
-        self.el_dao = el_dao
+# Сколько записей очереди изменений товаров обрабатывается за один bulk запрос
+PRODUCT_INDEX_SYNC_BATCH_SIZE = 500
+# Размер пачки товаров, читаемой серверным курсором при полной перестройке индекса
+PRODUCT_INDEX_DB_BATCH_SIZE = 1000
+# Сколько последних версий индекса товаров хранится (текущая и предыдущая для отката)
+PRODUCT_INDEX_KEEP_VERSIONS = 2
+# Таймауты запросов поиска и подсказок (сек) без повторов: медленный elasticsearch
+# быстрее отдает ошибку, и поиск переключается на postgres (см. app.search.fallback)
+SEARCH_REQUEST_TIMEOUT = 1.0
+SUGGEST_REQUEST_TIMEOUT = 0.3
 
-    async def create_index_products(self):
-        body = {
-            "settings": {
-                "index": {"max_ngram_diff": 12},
-                "analysis": {
-                    "analyzer": {
-                        "ngram_analyzer": {
-                            "tokenizer": "ngram_tokenizer",
-                            "filter": ["lowercase"]
-                        }
-                    },
-                    "tokenizer": {
-                        "ngram_tokenizer": {
-                            "type": "ngram",
-                            "min_gram": 3,
-                            "max_gram": 15,
-                            "token_chars": ["letter", "digit"]
-                        }
-                    }
+PRODUCTS_INDEX_BODY = {
+    "settings": {
+        "index": {"max_ngram_diff": 12},
+        "analysis": {
+            "analyzer": {
+                "ngram_analyzer": {
+                    "tokenizer": "ngram_tokenizer",
+                    "filter": ["lowercase"]
                 }
             },
-            "mappings": {
-                "dynamic": "false",
-                "properties": {
-                    "title": {
-                        "type": "text",
-                        "analyzer": "ngram_analyzer",
-                        "search_analyzer": "standard"
-                    },
-                    "description": {
-                        "type": "text",
-                        "analyzer": "ngram_analyzer",
-                        "search_analyzer": "standard"
-                    }
+            "tokenizer": {
+                "ngram_tokenizer": {
+                    "type": "ngram",
+                    "min_gram": 3,
+                    "max_gram": 15,
+                    "token_chars": ["letter", "digit"]
                 }
             }
         }
-        
+    },
+    "mappings": {
+        "dynamic": "false",
+        "properties": {
+            # Второй ключ сортировки поиска, чтобы search_after был однозначным при равном _score
+            "product_id": {"type": "integer"},
+            "title": {
+                "type": "text",
+                "analyzer": "ngram_analyzer",
+                "search_analyzer": "standard",
+                "fields": {
+                    # Легкое поле для подсказок: edge-ngram по словам названия и их парам/тройкам
+                    "suggest": {"type": "search_as_you_type"}
+                }
+            },
+            "description": {
+                "type": "text",
+                "analyzer": "ngram_analyzer",
+                "search_analyzer": "standard"
+            }
+        }
+    }
+}
+
+# Во время массовой загрузки новой версии индекса refresh выключен, после - возвращается по умолчанию
+PRODUCTS_BULK_LOAD_SETTINGS = {"index": {"refresh_interval": "-1"}}
+PRODUCTS_SEARCH_SETTINGS = {"index": {"refresh_interval": None}}
+
+
+def products_index_body(bulk_load: bool = False) -> dict:
+    """Тело создания индекса товаров, bulk_load=True - с настройками для массовой загрузки"""
+    if not bulk_load:
+        return PRODUCTS_INDEX_BODY
+    index_settings = {**PRODUCTS_INDEX_BODY["settings"]["index"], **PRODUCTS_BULK_LOAD_SETTINGS["index"]}
+    return {
+        **PRODUCTS_INDEX_BODY,
+        "settings": {**PRODUCTS_INDEX_BODY["settings"], "index": index_settings},
+    }
+
+
+# Метка движка в курсоре поиска (см. app.products.pagination)
+SEARCH_CURSOR_ENGINE = "es"
+
+# Поля документа, которые отдаются в ответе поиска
+SEARCH_SOURCE_FIELDS = list(ProductResponseSchema.model_fields)
+
+
+def search_products_body(
+    query_text: str, limit: int = SEARCH_PAGE_SIZE, cursor: str | None = None, with_total: bool = False
+) -> dict:
+    """
+    Тело запроса поиска товаров
+
+    Запрашивается limit + 1 документ, чтобы понять, есть ли следующая страница.
+    Следующая страница ищется через search_after по (_score, product_id), поэтому
+    ее стоимость не зависит от глубины. Общее количество найденных считается только по запросу
+    """
+    body = {
+        "query": {
+            "multi_match": {
+                "query": query_text,
+                "fields": ["title^2", "description"],
+                "type": "best_fields"
+            }
+        },
+        "size": limit + 1,
+        "sort": [
+            "_score",
+            # unmapped_type - для индексов, построенных до появления product_id в маппинге
+            {"product_id": {"order": "asc", "unmapped_type": "integer"}}
+        ],
+        "_source": SEARCH_SOURCE_FIELDS,
+        "track_total_hits": with_total
+    }
+    if cursor is not None:
+        body["search_after"] = decode_search_cursor(cursor, SEARCH_CURSOR_ENGINE)
+    return body
+
+
+SUGGEST_SIZE = 8
+SUGGEST_CACHE_SIZE = 4096
+SUGGEST_CACHE_TTL = 60
+
+# Подсказки по самым частым префиксам в памяти процесса, чтобы набор текста не стоил запроса на каждый символ
+product_suggest_cache = LocalTTLCache(SUGGEST_CACHE_SIZE, SUGGEST_CACHE_TTL)
+
+
+def suggest_products_body(prefix: str, size: int = SUGGEST_SIZE) -> dict:
+    """Тело запроса подсказок: bool_prefix по полю title.suggest, в ответе только id и название"""
+    return {
+        "query": {
+            "multi_match": {
+                "query": prefix,
+                "type": "bool_prefix",
+                "fields": ["title.suggest", "title.suggest._2gram", "title.suggest._3gram"]
+            }
+        },
+        "size": size,
+        "_source": ["product_id", "title"],
+        "track_total_hits": False
+    }
+
+
+def product_document(product, index_name: str | None = None) -> dict:
+    """Документ товара для bulk запроса, _id = product_id, чтобы повторная индексация заменяла документ"""
+    return {
+        "_index": index_name or settings.INDEX_PRODUCTS,
+        "_id": product.product_id,
+        "_source": ProductReturnSchema.model_validate(product, from_attributes=True).model_dump_json()
+    }
+
+
+def products_index_pattern() -> str:
+    """Шаблон имен версий индекса товаров, settings.INDEX_PRODUCTS - алиас на текущую версию"""
+    return f"{settings.INDEX_PRODUCTS}_v*"
+
+
+def products_index_versions(indices: list[str]) -> list[tuple[int, str]]:
+    """Версии индекса товаров из списка имен индексов, по возрастанию"""
+    version_re = re.compile(rf"^{re.escape(settings.INDEX_PRODUCTS)}_v(\d+)$")
+    versions = []
+    for index in indices:
+        match = version_re.match(index)
+        if match:
+            versions.append((int(match.group(1)), index))
+    return sorted(versions)
+
+
+def next_products_index(indices: list[str]) -> str:
+    """Имя следующей версии индекса товаров"""
+    versions = products_index_versions(indices)
+    version = versions[-1][0] + 1 if versions else 1
+    return f"{settings.INDEX_PRODUCTS}_v{version}"
+
+
+def stale_products_indices(indices: list[str], alias_indices: list[str]) -> list[str]:
+    """Старые версии индекса товаров на удаление (кроме последних и тех, на которые указывает алиас)"""
+    versions = [index for _, index in products_index_versions(indices)]
+    keep = set(versions[-PRODUCT_INDEX_KEEP_VERSIONS:]) | set(alias_indices)
+    return [index for index in versions if index not in keep]
+
+
+class ElasticsearchService(SearchBackend):
+    def __init__(self, el_dao: ElasticsearchDao):
+        self.el_dao = el_dao
+
+    async def create_index_products(self, index_name: str | None = None) -> str:
+        """Создание новой версии индекса товаров (без алиаса), возвращает имя индекса"""
         try:
-            await self.el_dao.create_index_with_body(index_name=settings.INDEX_PRODUCTS, body=body)
-            logger.info('Products index created', extra={'index': settings.INDEX_PRODUCTS})
+            if index_name is None:
+                index_name = next_products_index(await self.el_dao.get_indices(products_index_pattern()))
+            body = products_index_body(bulk_load=True)
+            await self.el_dao.create_index_with_body(index_name=index_name, body=body)
+            logger.info('Products index created', extra={'index': index_name})
+            return index_name
         except HTTPException:
             raise
         except Exception as e:
-            logger.error('Unexpected error creating products index', extra={'index': settings.INDEX_PRODUCTS}, exc_info=True)
+            logger.error('Unexpected error creating products index', extra={'index': index_name}, exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail='Ошибка при создании индекса продуктов'
             )
     
     async def add_all_products(self, session):
+        """
+        Полная перестройка индекса товаров без простоя поиска
+
+        Товары загружаются в новую версию индекса, после успешной загрузки алиас
+        settings.INDEX_PRODUCTS атомарно переключается на нее, старые версии удаляются.
+        На время перестройки инкрементальная синхронизация индекса заблокирована
+        """
+        index_name = None
         try:
             product_dao = ProductDao(session)
+            await product_dao.lock_product_index()
             
-            logger.debug('Checking if products index exists', extra={'index': settings.INDEX_PRODUCTS})
-            if await self.el_dao.el_cl.indices.exists(index=settings.INDEX_PRODUCTS):
-                logger.info('Deleting existing products index', extra={'index': settings.INDEX_PRODUCTS})
-                await self.el_dao.delete_index(settings.INDEX_PRODUCTS)
-                
-            await self.create_index_products()
-            
-            rows = await product_dao.all()
-            logger.info('Retrieved products for indexing', extra={'count': len(rows)})
+            index_name = await self.create_index_products()
             
-            processed_docs = []
-            for document in rows:
-                document_json = ProductReturnSchema.model_validate(document, from_attributes=True).model_dump_json()
-                processed_docs.append({
-                    "_index": settings.INDEX_PRODUCTS,
-                    "_source": document_json
-                })
+            documents = self._product_documents(product_dao, index_name)
+            count = await self.el_dao.add_documents_streaming(index_name=index_name, actions=documents)
+            await self.el_dao.finish_bulk_load(index_name, PRODUCTS_SEARCH_SETTINGS)
+            await self._swap_alias(index_name)
+            index_name = None
+            await session.commit()
+            logger.info('All products indexed successfully', extra={'count': count})
             
-            await self.el_dao.add_documents(index_name=settings.INDEX_PRODUCTS, documents=processed_docs)
-            logger.info('All products indexed successfully', extra={'count': len(processed_docs)})
+            await self._delete_stale_indices()
             
         except HTTPException:
+            await self._drop_unfinished_index(index_name)
             raise
         except Exception as e:
             logger.error('Failed to add all products to index', exc_info=True)
+            await self._drop_unfinished_index(index_name)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail='Ошибка при индексации всех продуктов'
             )
+
+    @staticmethod
+    async def _product_documents(product_dao: ProductDao, index_name: str):
+        """Документы товаров, читаемые из бд серверным курсором пачками по PRODUCT_INDEX_DB_BATCH_SIZE"""
+        async for products in product_dao.stream_all(PRODUCT_INDEX_DB_BATCH_SIZE):
+            for product in products:
+                yield product_document(product, index_name)
+
+    async def _swap_alias(self, index_name: str):
+        alias = settings.INDEX_PRODUCTS
+        old_indices = await self.el_dao.get_alias_indices(alias)
+        # Индекс, созданный до перехода на версии, называется так же, как алиас, и удаляется при переключении
+        legacy_index = alias if not old_indices and await self.el_dao.el_cl.indices.exists(index=alias) else None
+        await self.el_dao.swap_alias(alias, index_name, old_indices, remove_index=legacy_index)
+
+    async def _delete_stale_indices(self):
+        """Удаление старых версий индекса товаров, ошибка удаления не мешает перестройке"""
+        try:
+            indices = await self.el_dao.get_indices(products_index_pattern())
+            alias_indices = await self.el_dao.get_alias_indices(settings.INDEX_PRODUCTS)
+            for index in stale_products_indices(indices, alias_indices):
+                await self.el_dao.delete_index(index)
+        except Exception:
+            logger.warning('Failed to delete stale products indices', exc_info=True)
+
+    async def _drop_unfinished_index(self, index_name: str | None):
+        """Удаление версии индекса, загрузка которой не завершилась (алиас на нее не переключался)"""
+        if index_name is None:
+            return
+        try:
+            await self.el_dao.delete_index(index_name)
+        except Exception:
+            logger.warning('Failed to delete unfinished products index', extra={'index': index_name}, exc_info=True)
         
-    async def search_products(self, query_text):
-        body = {
-            "query": {
-                "multi_match": {
-                    "query": query_text,
-                    "fields": ["title^2", "description"],
-                    "type": "best_fields"
-                }
-            }
-        }
+    async def search_products(
+        self, query_text, limit: int = SEARCH_PAGE_SIZE, cursor: str | None = None, with_total: bool = False
+    ) -> dict:
+        """
+        Поиск товаров по тексту, страница по limit товаров
+
+        Возвращает словарь items, next_cursor (None на последней странице)
+        и total (только при with_total=True)
+        """
         try:
-            logger.debug('Searching products', extra={'query': query_text})
-            result = await self.el_dao.el_cl.search(index=settings.INDEX_PRODUCTS, body=body)
+            body = search_products_body(query_text, limit, cursor, with_total)
+            logger.debug('Searching products', extra={'query': query_text, 'limit': limit, 'has_cursor': cursor is not None})
+            result = await self.el_dao.el_cl.options(
+                request_timeout=SEARCH_REQUEST_TIMEOUT, max_retries=0
+            ).search(index=settings.INDEX_PRODUCTS, body=body)
             hits_count = len(result.get('hits', {}).get('hits', []))
             logger.info('Products search completed', extra={'query': query_text, 'hits': hits_count})
-            return self._prepare_products(result)
+            return self._prepare_products(result, limit)
+        except ValueError as e:
+            logger.warning('Invalid search cursor', extra={'query': query_text}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=str(e)
+            )
+        except ConnectionTimeout as e:
+            logger.error('Elasticsearch search timed out', extra={'query': query_text, 'timeout': SEARCH_REQUEST_TIMEOUT})
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='ElasticSearch не ответил вовремя'
+            )
         except ConnectionError as e:
             logger.error('Elasticsearch connection error', extra={'query': query_text}, exc_info=True)
             raise HTTPException(
@@ -133,11 +330,58 @@ class ElasticsearchService:
                 detail='Непредвиденная ошибка при поиске продуктов'
             )
             
-    def _prepare_products(self, el_response: dict):
-        result = []
-        for el in el_response.get('hits', dict).get('hits', False):
-            result.append(el['_source'])
-        return result
+    async def suggest_products(self, prefix: str) -> list[dict]:
+        """
+        Подсказки товаров по началу запроса (id и название)
+
+        Ответы кэшируются в памяти процесса по нормализованному префиксу
+        """
+        prefix = normalize_search_text(prefix)
+        if not prefix:
+            return []
+        suggestions = product_suggest_cache.get(prefix)
+        if suggestions is not None:
+            return suggestions
+        try:
+            result = await self.el_dao.el_cl.options(
+                request_timeout=SUGGEST_REQUEST_TIMEOUT, max_retries=0
+            ).search(index=settings.INDEX_PRODUCTS, body=suggest_products_body(prefix))
+            suggestions = [hit['_source'] for hit in result.get('hits', {}).get('hits', [])]
+            logger.debug('Products suggest completed', extra={'prefix': prefix, 'hits': len(suggestions)})
+        except ConnectionTimeout as e:
+            logger.error('Elasticsearch suggest timed out', extra={'prefix': prefix, 'timeout': SUGGEST_REQUEST_TIMEOUT})
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='ElasticSearch не ответил вовремя'
+            )
+        except ConnectionError as e:
+            logger.error('Elasticsearch connection error', extra={'prefix': prefix}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail='Проблемы с подключением к ElasticSearch'
+            )
+        except Exception as e:
+            logger.error('Unexpected error during product suggest', extra={'prefix': prefix}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail='Непредвиденная ошибка при получении подсказок'
+            )
+        product_suggest_cache.set(prefix, suggestions)
+        return suggestions
+
+    def _prepare_products(self, el_response: dict, limit: int) -> dict:
+        hits = el_response.get('hits', {})
+        documents = hits.get('hits', [])
+        next_cursor = None
+        if len(documents) > limit:
+            documents = documents[:limit]
+            next_cursor = encode_search_cursor(SEARCH_CURSOR_ENGINE, documents[-1]['sort'])
+        total = hits.get('total')
+        return {
+            'items': [document['_source'] for document in documents],
+            'next_cursor': next_cursor,
+            'total': total['value'] if total else None
+        }
     
     
 # Синхронный вариант для celery
@@ -145,90 +389,140 @@ class ElasticsearchSyncService:
     def __init__(self, el_cl):
         self.el_dao = ElasticsearchSyncDao(el_cl)
 
-    def create_index_products(self):
-        body = {
-            "settings": {
-                "index": {"max_ngram_diff": 12},
-                "analysis": {
-                    "analyzer": {
-                        "ngram_analyzer": {
-                            "tokenizer": "ngram_tokenizer",
-                            "filter": ["lowercase"]
-                        }
-                    },
-                    "tokenizer": {
-                        "ngram_tokenizer": {
-                            "type": "ngram",
-                            "min_gram": 3,
-                            "max_gram": 15,
-                            "token_chars": ["letter", "digit"]
-                        }
-                    }
-                }
-            },
-            "mappings": {
-                "dynamic": "false",
-                "properties": {
-                    "title": {
-                        "type": "text",
-                        "analyzer": "ngram_analyzer",
-                        "search_analyzer": "standard"
-                    },
-                    "description": {
-                        "type": "text",
-                        "analyzer": "ngram_analyzer",
-                        "search_analyzer": "standard"
-                    }
-                }
-            }
-        }
-        
+    def create_index_products(self, index_name: str | None = None) -> str:
+        """Создание новой версии индекса товаров (без алиаса), возвращает имя индекса"""
         try:
-            self.el_dao.create_index_with_body(index_name=settings.INDEX_PRODUCTS, body=body)
-            logger.info('Products index created (sync)', extra={'index': settings.INDEX_PRODUCTS})
+            if index_name is None:
+                index_name = next_products_index(self.el_dao.get_indices(products_index_pattern()))
+            body = products_index_body(bulk_load=True)
+            self.el_dao.create_index_with_body(index_name=index_name, body=body)
+            logger.info('Products index created (sync)', extra={'index': index_name})
+            return index_name
         except Exception as e:
-            logger.error('Failed to create products index (sync)', extra={'index': settings.INDEX_PRODUCTS}, exc_info=True)
+            logger.error('Failed to create products index (sync)', extra={'index': index_name}, exc_info=True)
             raise
     
     def add_all_products(self, session: Session):
+        """
+        Полная перестройка индекса товаров без простоя поиска
+
+        Явная операция (ручка /el/add_all_products_sync, задача rebuild_product_index),
+        регулярно индекс обновляется через sync_changes. Товары загружаются в новую версию
+        индекса, после успешной загрузки алиас settings.INDEX_PRODUCTS атомарно
+        переключается на нее, старые версии удаляются. Изменения, попавшие в очередь
+        до чтения товаров, уже учтены в индексе и удаляются из нее.
+        Возвращает количество проиндексированных товаров
+        """
+        index_name = None
         try:
             product_dao = ProductSyncDao(session)
-            
-            logger.debug('Checking if products index exists (sync)', extra={'index': settings.INDEX_PRODUCTS})
-            if self.el_dao.index_exists(index=settings.INDEX_PRODUCTS):
-                logger.info('Deleting existing products index (sync)', extra={'index': settings.INDEX_PRODUCTS})
-                self.el_dao.delete_index(settings.INDEX_PRODUCTS)
+            outbox_dao = ProductIndexOutboxSyncDao(session)
+            outbox_dao.lock()
+            # Только записи, закоммиченные до чтения товаров: их изменения точно попадут
+            # в индекс. Удаление по диапазону id потеряло бы записи транзакций, которые взяли
+            # меньший id, но закоммитились уже после чтения товаров
+            outbox_ids = outbox_dao.get_ids()
                 
-            self.create_index_products()
+            index_name = self.create_index_products()
             
-            rows = product_dao.all()
-            logger.info('Retrieved products for indexing (sync)', extra={'count': len(rows)})
-            
-            processed_docs = []
-            for document in rows:
-                document_json = ProductReturnSchema.model_validate(document, from_attributes=True).model_dump_json()
-                processed_docs.append({
-                    "_index": settings.INDEX_PRODUCTS,
-                    "_source": document_json
-                })
+            documents = (
+                product_document(product, index_name)
+                for products in product_dao.stream_all(PRODUCT_INDEX_DB_BATCH_SIZE)
+                for product in products
+            )
+            count = self.el_dao.add_documents_streaming(index_name=index_name, actions=documents)
+            self.el_dao.finish_bulk_load(index_name, PRODUCTS_SEARCH_SETTINGS)
+            self._swap_alias(index_name)
+            index_name = None
+            if outbox_ids:
+                outbox_dao.delete(outbox_ids)
+            session.commit()
+            logger.info('All products indexed successfully (sync)', extra={'count': count})
             
-            self.el_dao.add_documents(index_name=settings.INDEX_PRODUCTS, documents=processed_docs)
-            logger.info('All products indexed successfully (sync)', extra={'count': len(processed_docs)})
+            self._delete_stale_indices()
+            return count
             
         except Exception as e:
             logger.error('Failed to add all products to index (sync)', exc_info=True)
+            self._drop_unfinished_index(index_name)
+            raise
+
+    def _swap_alias(self, index_name: str):
+        alias = settings.INDEX_PRODUCTS
+        old_indices = self.el_dao.get_alias_indices(alias)
+        # Индекс, созданный до перехода на версии, называется так же, как алиас, и удаляется при переключении
+        legacy_index = alias if not old_indices and self.el_dao.index_exists(index=alias) else None
+        self.el_dao.swap_alias(alias, index_name, old_indices, remove_index=legacy_index)
+
+    def _delete_stale_indices(self):
+        """Удаление старых версий индекса товаров, ошибка удаления не мешает перестройке"""
+        try:
+            indices = self.el_dao.get_indices(products_index_pattern())
+            alias_indices = self.el_dao.get_alias_indices(settings.INDEX_PRODUCTS)
+            for index in stale_products_indices(indices, alias_indices):
+                self.el_dao.delete_index(index)
+        except Exception:
+            logger.warning('Failed to delete stale products indices (sync)', exc_info=True)
+
+    def _drop_unfinished_index(self, index_name: str | None):
+        """Удаление версии индекса, загрузка которой не завершилась (алиас на нее не переключался)"""
+        if index_name is None:
+            return
+        try:
+            self.el_dao.delete_index(index_name)
+        except Exception:
+            logger.warning('Failed to delete unfinished products index (sync)', extra={'index': index_name}, exc_info=True)
+
+    def sync_changes(self, session: Session, batch_size: int = PRODUCT_INDEX_SYNC_BATCH_SIZE) -> int:
+        """
+        Инкрементальное обновление индекса товаров по очереди изменений product_index_outbox
+
+        Измененные товары переиндексируются, удаленные - удаляются из индекса. Записи очереди
+        удаляются только после успешного bulk запроса, поэтому при ошибке изменения
+        обработаются в следующий запуск. Если идет полная перестройка, синхронизация
+        пропускается, если индекса нет - он строится полностью.
+        Возвращает количество обработанных товаров
+        """
+        try:
+            product_dao = ProductSyncDao(session)
+            outbox_dao = ProductIndexOutboxSyncDao(session)
+            synced_count = 0
+            while True:
+                if not outbox_dao.lock(wait=False):
+                    logger.info('Products index is being synced by another worker (sync)')
+                    break
+                if not self.el_dao.index_exists(index=settings.INDEX_PRODUCTS):
+                    logger.info('Products index not found, running full rebuild (sync)', extra={'index': settings.INDEX_PRODUCTS})
+                    return self.add_all_products(session)
+
+                outbox_ids, product_ids = outbox_dao.get_changes(batch_size)
+                if not outbox_ids:
+                    session.commit()
+                    break
+                products = product_dao.get_by_ids(product_ids)
+                existing_ids = {product.product_id for product in products}
+                actions = [product_document(product) for product in products]
+                actions.extend(
+                    {"_op_type": "delete", "_index": settings.INDEX_PRODUCTS, "_id": product_id}
+                    for product_id in product_ids
+                    if product_id not in existing_ids
+                )
+                self.el_dao.apply_changes(index_name=settings.INDEX_PRODUCTS, actions=actions)
+                outbox_dao.delete(outbox_ids)
+                session.commit()
+                synced_count += len(product_ids)
+
+            logger.info('Products index synced (sync)', extra={'count': synced_count})
+            return synced_count
+        except Exception as e:
+            session.rollback()
+            logger.error('Failed to sync products index (sync)', exc_info=True)
             raise
         
-    def search_products(self, query_text):
-        body = {
-            "query": {
-                "multi_match": {
-                    "query": query_text,
-                    "fields": ["title^2", "description"],
-                    "type": "best_fields"
-                }
-            }
-        }
+    def search_products(
+        self, query_text, limit: int = SEARCH_PAGE_SIZE, cursor: str | None = None, with_total: bool = False
+    ):
+        body = search_products_body(query_text, limit, cursor, with_total)
         try:
             logger.debug('Searching products (sync)', extra={'query': query_text})
             results = self.el_dao.el_cl.search(index=settings.INDEX_PRODUCTS, body=body)
@@ -0,0 +1,120 @@
+"""
+Пул SMTP соединений процесса воркера celery.
+
+Соединение открывается (SSL + login) один раз и переиспользуется всеми задачами отправки
+писем в процессе. Перед выдачей простаивавшее соединение проверяется командой NOOP,
+соединения, простаивавшие дольше idle_timeout, закрываются, сломанные соединения выбрасываются из пула.
+После fork (prefork пул celery) соединения родителя не используются.
+"""
+
+import os
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from app.logger import logger
+from app.metrics import SMTP_CONNECTIONS, SMTP_SEND_SECONDS
+
+SMTP_POOL_SIZE = 4
+SMTP_IDLE_TIMEOUT_SEC = 60.0
+# Соединение, вернувшееся в пул недавно, отдается без проверки NOOP
+SMTP_HEALTH_CHECK_AFTER_SEC = 5.0
+
+SMTP_REJECTED_ERRORS = (
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError,
+)
+
+
+class SMTPConnectionPool:
+    def __init__(self, connect, max_size: int = SMTP_POOL_SIZE, idle_timeout: float = SMTP_IDLE_TIMEOUT_SEC):
+        self.connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle: list[tuple[smtplib.SMTP, float]] = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @contextmanager
+    def connection(self):
+        """Соединение из пула, при ошибке во время использования оно закрывается, а не возвращается"""
+        server = self._acquire()
+        try:
+            yield server
+        except SMTP_REJECTED_ERRORS:
+            # Сервер отклонил письмо, но соединение рабочее
+            self._release(server)
+            raise
+        except Exception:
+            self._close(server, "broken")
+            raise
+        self._release(server)
+
+    def send_message(self, msg_email) -> None:
+        """Отправка письма через соединение из пула, при разрыве соединения - один повтор на новом"""
+        started = time.perf_counter()
+        try:
+            with self.connection() as server:
+                server.send_message(msg_email)
+        except smtplib.SMTPServerDisconnected:
+            logger.warning("SMTP connection lost, reconnecting", extra={"recipient": msg_email.get("To")})
+            with self.connection() as server:
+                server.send_message(msg_email)
+        SMTP_SEND_SECONDS.observe(time.perf_counter() - started)
+
+    def close_all(self) -> None:
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            self._close(server, "closed")
+
+    def _acquire(self) -> smtplib.SMTP:
+        self._check_fork()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                server, released_at = self._idle.pop()
+            idle = time.monotonic() - released_at
+            if idle > self.idle_timeout:
+                self._close(server, "idle_timeout")
+            elif idle < SMTP_HEALTH_CHECK_AFTER_SEC or self._is_alive(server):
+                SMTP_CONNECTIONS.labels(event="reused").inc()
+                return server
+            else:
+                self._close(server, "health_check_failed")
+        server = self.connect()
+        SMTP_CONNECTIONS.labels(event="opened").inc()
+        logger.debug("SMTP connection opened")
+        return server
+
+    def _release(self, server: smtplib.SMTP) -> None:
+        with self._lock:
+            if os.getpid() == self._pid and len(self._idle) < self.max_size:
+                self._idle.append((server, time.monotonic()))
+                return
+        self._close(server, "closed")
+
+    def _check_fork(self) -> None:
+        """Соединения, унаследованные от родительского процесса, просто забываются"""
+        if os.getpid() != self._pid:
+            with self._lock:
+                self._idle = []
+                self._pid = os.getpid()
+
+    @staticmethod
+    def _is_alive(server: smtplib.SMTP) -> bool:
+        try:
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    @staticmethod
+    def _close(server: smtplib.SMTP, event: str) -> None:
+        SMTP_CONNECTIONS.labels(event=event).inc()
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
@@ -4,6 +4,7 @@ from aiosmtplib import SMTPException, send
 from fastapi import HTTPException, status
 
 from app.config import settings
+from app.email.pool import SMTP_REJECTED_ERRORS, SMTPConnectionPool
 from app.logger import logger
 
 
@@ -34,14 +35,21 @@ async def async_send_email(msg_email):
         )
 
     
-def send_email(msg_email):
-    """Синхронная отправка email (для Celery)"""
-    server = None
+def connect_smtp() -> smtplib.SMTP:
+    """Открытие SMTP соединения с авторизацией (для Celery)"""
+    server = smtplib.SMTP_SSL(settings.SMTP_HOST, settings.SMTP_PORT)
+    server.login(settings.SMTP_USER, settings.SMTP_PASS)
+    return server
+
+
+smtp_pool = SMTPConnectionPool(connect_smtp)
+
+
+def send_email(msg_email, pool: SMTPConnectionPool = smtp_pool):
+    """Синхронная отправка email через пул соединений процесса (для Celery)"""
     recipient = msg_email.get('To', 'unknown')
     try:
-        server = smtplib.SMTP_SSL(settings.SMTP_HOST, settings.SMTP_PORT)
-        server.login(settings.SMTP_USER, settings.SMTP_PASS)
-        server.send_message(msg_email)
+        pool.send_message(msg_email)
         logger.info('Email sent successfully (sync)', extra={'recipient': recipient})
     except smtplib.SMTPException as e:
         logger.error('SMTP error sending email (sync)', extra={'recipient': recipient}, exc_info=True)
@@ -49,10 +57,29 @@ def send_email(msg_email):
     except Exception as e:
         logger.error('Unexpected error sending email (sync)', extra={'recipient': recipient}, exc_info=True)
         raise
-    finally:
-        if server:
+
+
+def send_emails(msgs_email, pool: SMTPConnectionPool = smtp_pool) -> int:
+    """
+    Синхронная отправка пачки email через пул соединений процесса (для Celery)
+
+    Письмо, которое сервер отклонил, пропускается. Возвращает количество отправленных писем
+    """
+    sent = 0
+    try:
+        for msg_email in msgs_email:
             try:
-                server.quit()
-                logger.debug('SMTP connection closed')
-            except Exception as e:
-                logger.warning('Failed to close SMTP connection', exc_info=True)
\ No newline at end of file
+                pool.send_message(msg_email)
+            except SMTP_REJECTED_ERRORS:
+                logger.warning(
+                    'Email rejected by SMTP server',
+                    extra={'recipient': msg_email.get('To', 'unknown')},
+                    exc_info=True,
+                )
+                continue
+            sent += 1
+        logger.info('Emails sent successfully (sync)', extra={'sent': sent})
+        return sent
+    except smtplib.SMTPException as e:
+        logger.error('SMTP error sending emails (sync)', extra={'sent': sent}, exc_info=True)
+        raise
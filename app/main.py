@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from elasticsearch import AsyncElasticsearch, Elasticsearch
@@ -18,8 +19,11 @@ from app.elasticsearch.router import router as el_router
 from app.logger import logger
 from app.middleware import check_time
 from app.orders.router import router as orders_router
+from app.products.cache import listen_product_invalidations
+from app.products.popular import keep_popular_products_fresh, popular_products
 from app.products.router import router as products_router
 from app.redis.router import router as redis_router
+from app.search.trigram import TrigramSearchBackend, keep_trigram_index_fresh
 from app.stores.router import router as store_router
 from app.users.router import router as users_router
 
@@ -32,7 +36,20 @@ async def lifespan(app: FastAPI):
     redis = aioredis.from_url(settings.REDIS_URL)
     app.state.redis_client = redis
     FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
+    product_invalidations = asyncio.create_task(listen_product_invalidations(redis))
+    await popular_products.load()
+    popular_products_refresh = asyncio.create_task(keep_popular_products_fresh(redis))
+    background_tasks = [product_invalidations, popular_products_refresh]
+    if settings.SEARCH_BACKEND == "trigram":
+        search_backend = TrigramSearchBackend()
+        await search_backend.load()
+        app.state.search_backend = search_backend
+        background_tasks.append(
+            asyncio.create_task(keep_trigram_index_fresh(redis, search_backend))
+        )
     yield
+    for task in background_tasks:
+        task.cancel()
     el_cl: AsyncElasticsearch = app.state.el_cl
     await el_cl.close()
     logger.debug("App close")
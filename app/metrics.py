@@ -0,0 +1,43 @@
+"""
+Метрики приложения для prometheus.
+
+Метрики регистрируются в реестре по умолчанию и отдаются вместе с метриками
+Instrumentator на /metrics.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+CACHE_REQUESTS = Counter(
+    "app_cache_requests_total",
+    "Обращения к кэшу ответов ручек (hit, miss, coalesced - дождался чужого вычисления, stale - получил старое значение во время обновления, bypass - без кэша, redis недоступен)",
+    ["route", "result"],
+)
+
+SMTP_CONNECTIONS = Counter(
+    "app_smtp_connections_total",
+    "События пула SMTP соединений (opened, reused, idle_timeout, health_check_failed, broken, closed)",
+    ["event"],
+)
+
+SMTP_SEND_SECONDS = Histogram(
+    "app_smtp_send_seconds",
+    "Время отправки одного письма через пул SMTP соединений",
+)
+
+SEARCH_REQUESTS = Counter(
+    "app_search_requests_total",
+    "Запросы поиска и подсказок товаров по движку, который их обслужил (elasticsearch, postgres)",
+    ["operation", "backend"],
+)
+
+SEARCH_FALLBACKS = Counter(
+    "app_search_fallbacks_total",
+    "Переключения поиска на резервный движок (open - автомат разомкнут, error - ошибка или таймаут основного)",
+    ["operation", "reason"],
+)
+
+SEARCH_BREAKER_STATE = Gauge(
+    "app_search_circuit_breaker_state",
+    "Состояние автомата поискового движка (0 - closed, 1 - open, 2 - half_open)",
+    ["breaker"],
+)
@@ -12,6 +12,8 @@ sys.path.insert(0, dirname(dirname(dirname(abspath(__file__)))))
 from app.orders.models import (Basket, Order, OrderDeliveryDetail,
                                OrderPickUpDetail, OrderType, Purchase)
 from app.products.models import Category, FavoriteProduct, Product, Review
+# индексы по числовым ключам характеристик объявляются вместе со схемами
+from app.products import schema_specifications
 from app.stores.models import Store, StoreQuantityInfo
 from app.users.models import RefreshTokenBL, User
 
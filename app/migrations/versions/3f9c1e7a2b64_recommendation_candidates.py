@@ -0,0 +1,80 @@
+"""recommendation candidates
+
+Revision ID: 3f9c1e7a2b64
+Revises: 8d41a6c2e9f3
+Create Date: 2026-10-17 21:02:18.630417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c1e7a2b64'
+down_revision: Union[str, Sequence[str], None] = '8d41a6c2e9f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('category_top_products',
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('rating', sa.Float(), nullable=True),
+    sa.Column('views', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.category_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['product_id'], ['products.product_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('category_id', 'position')
+    )
+    op.create_table('user_favorite_categories',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('favorites_count', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['categories.category_id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.user_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'category_id')
+    )
+    op.create_index('idx_user_favorite_categories_position', 'user_favorite_categories', ['user_id', 'position'], unique=False)
+
+    # Начальное заполнение, дальше таблицы пересчитывает celery
+    op.execute(
+        """
+        INSERT INTO category_top_products (category_id, position, product_id, rating, views)
+        SELECT category_id, position, product_id, rating, views
+        FROM (
+            SELECT category_id, product_id, rating, views,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY category_id
+                       ORDER BY rating DESC NULLS LAST, views DESC NULLS LAST, product_id
+                   ) AS position
+            FROM products
+            WHERE category_id IS NOT NULL
+        ) ranked
+        WHERE position <= 60
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO user_favorite_categories (user_id, category_id, favorites_count, position)
+        SELECT user_id, category_id, favorites_count,
+               ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY favorites_count DESC, category_id)
+        FROM (
+            SELECT user_id, category_id, COUNT(*) AS favorites_count
+            FROM favorite_products JOIN products USING (product_id)
+            WHERE category_id IS NOT NULL
+            GROUP BY user_id, category_id
+        ) counts
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_user_favorite_categories_position', table_name='user_favorite_categories')
+    op.drop_table('user_favorite_categories')
+    op.drop_table('category_top_products')
@@ -0,0 +1,34 @@
+"""catalog keyset indexes
+
+Revision ID: 5b2e8f41c7d0
+Revises: c31e093a969b
+Create Date: 2026-10-17 12:10:41.512094
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e8f41c7d0'
+down_revision: Union[str, Sequence[str], None] = 'c31e093a969b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('idx_products_category_product', 'products', ['category_id', 'product_id'], unique=False)
+    op.create_index('idx_products_category_price', 'products', ['category_id', 'price', 'product_id'], unique=False)
+    op.create_index('idx_products_category_rating', 'products', ['category_id', sa.text('rating DESC NULLS LAST'), sa.text('product_id DESC')], unique=False)
+    op.create_index('idx_products_category_views', 'products', ['category_id', sa.text('views DESC NULLS LAST'), sa.text('product_id DESC')], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_products_category_views', table_name='products')
+    op.drop_index('idx_products_category_rating', table_name='products')
+    op.drop_index('idx_products_category_price', table_name='products')
+    op.drop_index('idx_products_category_product', table_name='products')
@@ -0,0 +1,34 @@
+"""specification range indexes
+
+Revision ID: 8d41a6c2e9f3
+Revises: 5b2e8f41c7d0
+Create Date: 2026-10-17 20:31:07.204518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d41a6c2e9f3'
+down_revision: Union[str, Sequence[str], None] = '5b2e8f41c7d0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('idx_products_spec_hdmi_ports', 'products', ['category_id', sa.text("(specification -> 'hdmi_ports')")], unique=False)
+    op.create_index('idx_products_spec_refresh_rate', 'products', ['category_id', sa.text("(specification -> 'refresh_rate')")], unique=False)
+    op.create_index('idx_products_spec_screen_size', 'products', ['category_id', sa.text("(specification -> 'screen_size')")], unique=False)
+    op.create_index('idx_products_spec_year', 'products', ['category_id', sa.text("(specification -> 'year')")], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_products_spec_year', table_name='products')
+    op.drop_index('idx_products_spec_screen_size', table_name='products')
+    op.drop_index('idx_products_spec_refresh_rate', table_name='products')
+    op.drop_index('idx_products_spec_hdmi_ports', table_name='products')
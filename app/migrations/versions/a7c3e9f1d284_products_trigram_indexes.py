@@ -0,0 +1,31 @@
+"""products trigram indexes
+
+Revision ID: a7c3e9f1d284
+Revises: f5a2d8c4b1e7
+Create Date: 2026-10-17 23:58:12.417305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3e9f1d284'
+down_revision: Union[str, Sequence[str], None] = 'f5a2d8c4b1e7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('idx_products_title_trgm', 'products', ['title'], unique=False, postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
+    op.create_index('idx_products_description_trgm', 'products', ['description'], unique=False, postgresql_using='gin', postgresql_ops={'description': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_products_description_trgm', table_name='products', postgresql_using='gin', postgresql_ops={'description': 'gin_trgm_ops'})
+    op.drop_index('idx_products_title_trgm', table_name='products', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'})
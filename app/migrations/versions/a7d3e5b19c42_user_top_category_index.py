@@ -0,0 +1,28 @@
+"""user top category index
+
+Revision ID: a7d3e5b19c42
+Revises: 3f9c1e7a2b64
+Create Date: 2026-10-17 21:40:52.118094
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d3e5b19c42'
+down_revision: Union[str, Sequence[str], None] = '3f9c1e7a2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('idx_user_favorite_categories_top', 'user_favorite_categories', ['category_id'], unique=False, postgresql_where=sa.text('position = 1'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_user_favorite_categories_top', table_name='user_favorite_categories', postgresql_where=sa.text('position = 1'))
@@ -0,0 +1,50 @@
+"""product index outbox search columns
+
+Revision ID: b2d9f4a6c8e1
+Revises: a7c3e9f1d284
+Create Date: 2026-10-18 10:12:37.903214
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b2d9f4a6c8e1'
+down_revision: Union[str, Sequence[str], None] = 'a7c3e9f1d284'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute('DROP TRIGGER IF EXISTS products_index_outbox_update ON products')
+    op.execute(
+        """
+        CREATE TRIGGER products_index_outbox_update
+        AFTER UPDATE ON products
+        FOR EACH ROW WHEN (
+            (OLD.title, OLD.description, OLD.category_id, OLD.specification, OLD.price,
+             OLD.rating, OLD.months_warranty, OLD.country_origin, OLD.sale_percent)
+            IS DISTINCT FROM
+            (NEW.title, NEW.description, NEW.category_id, NEW.specification, NEW.price,
+             NEW.rating, NEW.months_warranty, NEW.country_origin, NEW.sale_percent)
+        )
+        EXECUTE FUNCTION products_index_outbox()
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DROP TRIGGER IF EXISTS products_index_outbox_update ON products')
+    op.execute(
+        """
+        CREATE TRIGGER products_index_outbox_update
+        AFTER UPDATE ON products
+        FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+        EXECUTE FUNCTION products_index_outbox()
+        """
+    )
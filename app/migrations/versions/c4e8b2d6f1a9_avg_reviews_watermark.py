@@ -0,0 +1,34 @@
+"""avg reviews watermark
+
+Revision ID: c4e8b2d6f1a9
+Revises: a7d3e5b19c42
+Create Date: 2026-10-17 22:14:36.904517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e8b2d6f1a9'
+down_revision: Union[str, Sequence[str], None] = 'a7d3e5b19c42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sync_watermarks',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.create_index(op.f('ix_reviews_date_updated'), 'reviews', ['date_updated'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_reviews_date_updated'), table_name='reviews')
+    op.drop_table('sync_watermarks')
@@ -0,0 +1,34 @@
+"""product views flushes
+
+Revision ID: d6a1f3b8c2e5
+Revises: b2d9f4a6c8e1
+Create Date: 2026-10-18 11:04:52.417306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd6a1f3b8c2e5'
+down_revision: Union[str, Sequence[str], None] = 'b2d9f4a6c8e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_views_flushes',
+    sa.Column('flush_id', sa.String(length=32), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('flush_id')
+    )
+    op.create_index(op.f('ix_product_views_flushes_created_at'), 'product_views_flushes', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_product_views_flushes_created_at'), table_name='product_views_flushes')
+    op.drop_table('product_views_flushes')
@@ -0,0 +1,44 @@
+"""product rating aggregates
+
+Revision ID: e1b7c3a9d502
+Revises: c4e8b2d6f1a9
+Create Date: 2026-10-17 23:02:18.417305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1b7c3a9d502'
+down_revision: Union[str, Sequence[str], None] = 'c4e8b2d6f1a9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('products', sa.Column('rating_sum', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('products', sa.Column('rating_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        """
+        UPDATE products p
+        SET rating_sum = agg.rating_sum,
+            rating_count = agg.rating_count
+        FROM (
+            SELECT product_id, SUM(rating) AS rating_sum, COUNT(rating) AS rating_count
+            FROM reviews
+            WHERE rating IS NOT NULL
+            GROUP BY product_id
+        ) agg
+        WHERE p.product_id = agg.product_id
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('products', 'rating_count')
+    op.drop_column('products', 'rating_sum')
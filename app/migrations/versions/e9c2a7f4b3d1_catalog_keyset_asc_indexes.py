@@ -0,0 +1,30 @@
+"""catalog keyset asc indexes
+
+Revision ID: e9c2a7f4b3d1
+Revises: d6a1f3b8c2e5
+Create Date: 2026-10-18 11:37:15.082946
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9c2a7f4b3d1'
+down_revision: Union[str, Sequence[str], None] = 'd6a1f3b8c2e5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('idx_products_category_rating_asc', 'products', ['category_id', 'rating', 'product_id'], unique=False)
+    op.create_index('idx_products_category_views_asc', 'products', ['category_id', 'views', 'product_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_products_category_views_asc', table_name='products')
+    op.drop_index('idx_products_category_rating_asc', table_name='products')
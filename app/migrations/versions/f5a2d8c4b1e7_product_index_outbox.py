@@ -0,0 +1,65 @@
+"""product index outbox
+
+Revision ID: f5a2d8c4b1e7
+Revises: e1b7c3a9d502
+Create Date: 2026-10-17 23:41:05.228614
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f5a2d8c4b1e7'
+down_revision: Union[str, Sequence[str], None] = 'e1b7c3a9d502'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('product_index_outbox',
+    sa.Column('outbox_id', sa.BigInteger(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('outbox_id')
+    )
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION products_index_outbox() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                INSERT INTO product_index_outbox (product_id) VALUES (OLD.product_id);
+                RETURN OLD;
+            END IF;
+            INSERT INTO product_index_outbox (product_id) VALUES (NEW.product_id);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER products_index_outbox_insert_delete
+        AFTER INSERT OR DELETE ON products
+        FOR EACH ROW EXECUTE FUNCTION products_index_outbox()
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER products_index_outbox_update
+        AFTER UPDATE ON products
+        FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+        EXECUTE FUNCTION products_index_outbox()
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute('DROP TRIGGER IF EXISTS products_index_outbox_update ON products')
+    op.execute('DROP TRIGGER IF EXISTS products_index_outbox_insert_delete ON products')
+    op.execute('DROP FUNCTION IF EXISTS products_index_outbox()')
+    op.drop_table('product_index_outbox')
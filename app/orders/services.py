@@ -11,6 +11,7 @@ from app.orders.dao import (BasketDao, OrderDao, OrderDeliveryDetailDao,
 from app.orders.models import Order
 from app.orders.schema import OrderPickUpDetailSchema
 from app.products.dao import ProductDao
+from app.redis.cache import invalidate_cache_tags, user_tag
 from app.stores.dao import StoreQuantityInfoDao
 from app.tasks.tasks_rbmq import send_courier_notification
 from app.users.models import User
@@ -229,6 +230,8 @@ class OrderPickUpService:
             await self.basket_dao.delete_basket_of_user(user_id)
 
             await self.session.commit()
+            # Рекомендации зависят от средней цены покупок пользователя
+            await invalidate_cache_tags(user_tag(user_id))
             logger.info(
                 "Pickup order created",
                 extra={
@@ -313,6 +316,8 @@ class OrderDeliveryService:
             await self.basket_dao.delete_basket_of_user(user_id)
 
             await self.session.commit()
+            # Рекомендации зависят от средней цены покупок пользователя
+            await invalidate_cache_tags(user_tag(user_id))
             logger.info(
                 "Delivery order created",
                 extra={
@@ -0,0 +1,234 @@
+"""
+Двухуровневый кэш карточек товаров.
+
+Первый уровень - ограниченный LRU с TTL в памяти процесса, второй - redis, общий для всех воркеров.
+При изменении товара ключ удаляется из redis, а в канал PRODUCT_INVALIDATION_CHANNEL
+публикуется product_id, по которому каждый воркер чистит свой локальный уровень.
+
+Инвалидация также увеличивает версию товара в redis. Читатель запоминает версию до запроса
+в бд и записывает товар в кэш, только если версия не изменилась: иначе строка, прочитанная
+до коммита изменения, попала бы в кэш уже после его инвалидации и жила бы весь TTL.
+"""
+
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+from redis import Redis as SyncRedis
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.logger import logger
+
+PRODUCT_CACHE_KEY = "product_cache:{product_id}"
+PRODUCT_CACHE_TTL = 600
+PRODUCT_CACHE_VERSION_KEY = "product_cache_version:{product_id}"
+# Версия живет дольше записи кэша, чтобы не пропасть, пока читатель идет в бд
+PRODUCT_CACHE_VERSION_TTL = PRODUCT_CACHE_TTL * 2
+PRODUCT_LOCAL_CACHE_TTL = 60
+PRODUCT_LOCAL_CACHE_SIZE = 2048
+PRODUCT_INVALIDATION_CHANNEL = "product_invalidation"
+
+# Записывает товар, только если его версия не изменилась с момента чтения (нет версии - "")
+_SET_IF_VERSION_LUA = """
+if (redis.call('GET', KEYS[2]) or '') == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+class LocalTTLCache:
+    """LRU кэш в памяти процесса с ограничением по размеру и времени жизни записей"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+product_local_cache = LocalTTLCache(PRODUCT_LOCAL_CACHE_SIZE, PRODUCT_LOCAL_CACHE_TTL)
+
+
+class ProductCacheService:
+    def __init__(self, redis_client: Redis, local_cache: LocalTTLCache = product_local_cache):
+        self.redis_client = redis_client
+        self.local_cache = local_cache
+
+    async def get(self, product_id: int) -> dict | None:
+        """Получение товара сначала из памяти процесса, затем из redis"""
+        product = self.local_cache.get(product_id)
+        if product is not None:
+            return product
+        try:
+            data = await self.redis_client.get(PRODUCT_CACHE_KEY.format(product_id=product_id))
+        except RedisError:
+            logger.warning(
+                "Failed to get product from redis cache",
+                extra={"product_id": product_id},
+                exc_info=True,
+            )
+            return None
+        if data is None:
+            return None
+        product = json.loads(data)
+        self.local_cache.set(product_id, product)
+        return product
+
+    async def get_version(self, product_id: int) -> str | None:
+        """
+        Версия товара в кэше, берется до запроса товара в бд и передается в set
+
+        None - redis недоступен, тогда товар не кэшируется
+        """
+        try:
+            version = await self.redis_client.get(
+                PRODUCT_CACHE_VERSION_KEY.format(product_id=product_id)
+            )
+        except RedisError:
+            logger.warning(
+                "Failed to get product cache version",
+                extra={"product_id": product_id},
+                exc_info=True,
+            )
+            return None
+        if isinstance(version, bytes):
+            version = version.decode()
+        return version or ""
+
+    async def set(self, product_id: int, product: dict, version: str | None) -> None:
+        """
+        Сохранение товара в оба уровня кэша
+
+        Товар записывается, только если с get_version его не инвалидировали
+        """
+        if version is None:
+            return
+        try:
+            stored = await self.redis_client.eval(
+                _SET_IF_VERSION_LUA,
+                2,
+                PRODUCT_CACHE_KEY.format(product_id=product_id),
+                PRODUCT_CACHE_VERSION_KEY.format(product_id=product_id),
+                version,
+                json.dumps(product),
+                PRODUCT_CACHE_TTL,
+            )
+        except RedisError:
+            logger.warning(
+                "Failed to set product to redis cache",
+                extra={"product_id": product_id},
+                exc_info=True,
+            )
+            return
+        if not stored:
+            logger.debug(
+                "Product changed while loading, not cached", extra={"product_id": product_id}
+            )
+            return
+        self.local_cache.set(product_id, product)
+
+    async def invalidate(self, *product_ids: int) -> None:
+        """Удаление товаров из кэша всех воркеров"""
+        if not product_ids:
+            return
+        for product_id in product_ids:
+            self.local_cache.delete(product_id)
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for product_id in product_ids:
+                    version_key = PRODUCT_CACHE_VERSION_KEY.format(product_id=product_id)
+                    pipe.incr(version_key)
+                    pipe.expire(version_key, PRODUCT_CACHE_VERSION_TTL)
+                pipe.delete(*(PRODUCT_CACHE_KEY.format(product_id=p) for p in product_ids))
+                for product_id in product_ids:
+                    pipe.publish(PRODUCT_INVALIDATION_CHANNEL, product_id)
+                await pipe.execute()
+            logger.debug("Product cache invalidated", extra={"count": len(product_ids)})
+        except RedisError:
+            logger.error(
+                "Failed to invalidate product cache",
+                extra={"product_ids": product_ids},
+                exc_info=True,
+            )
+
+
+# Синхронный вариант для celery
+class ProductCacheSyncService:
+    def __init__(self, redis_client: SyncRedis):
+        self.redis_client = redis_client
+
+    def invalidate(self, *product_ids: int) -> None:
+        """Удаление товаров из кэша всех воркеров (sync)"""
+        if not product_ids:
+            return
+        try:
+            with self.redis_client.pipeline(transaction=False) as pipe:
+                for product_id in product_ids:
+                    version_key = PRODUCT_CACHE_VERSION_KEY.format(product_id=product_id)
+                    pipe.incr(version_key)
+                    pipe.expire(version_key, PRODUCT_CACHE_VERSION_TTL)
+                pipe.delete(*(PRODUCT_CACHE_KEY.format(product_id=p) for p in product_ids))
+                for product_id in product_ids:
+                    pipe.publish(PRODUCT_INVALIDATION_CHANNEL, product_id)
+                pipe.execute()
+            logger.debug(
+                "Product cache invalidated (sync)", extra={"count": len(product_ids)}
+            )
+        except RedisError:
+            logger.error(
+                "Failed to invalidate product cache (sync)",
+                extra={"count": len(product_ids)},
+                exc_info=True,
+            )
+
+
+async def listen_product_invalidations(
+    redis_client: Redis, local_cache: LocalTTLCache = product_local_cache
+):
+    """
+    Подписка воркера на инвалидации товаров
+
+    Запускается фоновой задачей в lifespan. При потере соединения с redis локальный
+    уровень полностью очищается, тк сообщения за время разрыва могли быть пропущены
+    """
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(PRODUCT_INVALIDATION_CHANNEL)
+                logger.debug("Subscribed to product invalidations")
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        local_cache.delete(int(message["data"]))
+        except RedisError:
+            logger.warning("Product invalidation subscription lost", exc_info=True)
+            local_cache.clear()
+            await asyncio.sleep(1)
@@ -1,53 +1,115 @@
+import json
+import math
+import re
+from datetime import datetime
+from decimal import Decimal
+
 from fastapi import HTTPException, status
-from sqlalchemy import between, select, text
+from sqlalchemy import (Float, and_, between, bindparam, case, cast, delete,
+                        func, insert, or_, select, text, tuple_, update)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import aliased
 
 from app.dao import BaseDao, BaseSyncDao
 from app.logger import create_msg_db_error, logger
-from app.products.models import Category, HistoryQueryUser, Product
+from app.products.models import (Category, FavoriteProduct,
+                                 HistoryQueryUser, Product, ProductIndexOutbox,
+                                 ProductViewsFlush, Review, SyncWatermark)
+from app.products.pagination import (CATALOG_PAGE_SIZE, decode_cursor,
+                                     encode_cursor)
 from app.products.schema import ProductSchema
+from app.products.schema_specifications import SPECIFICATION_RANGE_KEYS
+from app.redis.cache import PRICE_NUMBER_RE
+
+FACET_PRICE_STEP = 10000
+# Цены хранятся с точностью до копейки (Numeric(10, 2)), поэтому диапазон цен
+# фильтра price с концом на копейку меньше начала следующего диапазона их не пересекает
+PRICE_STEP_CENT = Decimal("0.01")
+
+# Сколько популярных товаров каждой категории хранится в category_top_products
+RECOMMENDATION_TOP_SIZE = 60
+# Ключ advisory-блокировки синхронизации индекса товаров в elasticsearch
+PRODUCT_INDEX_LOCK_KEY = 7_340_001
+# Ключ advisory-блокировки пересчета кандидатов в рекомендации (category_top_products,
+# user_favorite_categories)
+RECOMMENDATION_CANDIDATES_LOCK_KEY = 7_340_002
+# Ключ advisory-блокировки переноса просмотров товаров из redis
+PRODUCT_VIEWS_FLUSH_LOCK_KEY = 7_340_003
+
+# Кандидаты в рекомендации: до 60 популярных товаров из 5 любимых категорий пользователя
+# и до 30 из остальных (у пользователя без избранного - 30 самых популярных).
+# Читаются из таблиц, которые пересчитывает celery
+RECOMMENDATION_CANDIDATES_CTE = """
+    WITH favorite_cats AS (
+        SELECT category_id FROM user_favorite_categories
+        WHERE user_id = :user_id AND position <= 5
+    ),
+    candidates AS (
+        (SELECT product_id FROM category_top_products
+         WHERE category_id NOT IN (SELECT category_id FROM favorite_cats) AND position <= 30
+         ORDER BY rating DESC NULLS LAST, views DESC NULLS LAST
+         LIMIT 30)
+        UNION
+        (SELECT product_id FROM category_top_products
+         WHERE category_id IN (SELECT category_id FROM favorite_cats)
+         ORDER BY rating DESC NULLS LAST, views DESC NULLS LAST
+         LIMIT 60)
+    )
+"""
+
+SPECIFICATION_RANGE_RE = re.compile(r"(\d+(?:\.\d+)?)?-(\d+(?:\.\d+)?)?")
+
+
+def _strip_filter_value(value):
+    return value.strip() if isinstance(value, str) else value
 
 
 class ProductDao(BaseDao):
     model = Product
 
-    async def get_with_filters(self, **filters):
-        """Получение товара по фильтрам"""
-        try:
-            query = select(self.model, Category)
-            filter_methods = {
-                "category": self._category_filter,
-                "price": self._price_filter,
-                "rating": self._rating_filter,
-                "months_warranty": self._months_warranty_filter,
-                "country_origin": self._country_origin_filter,
-                "sale_percent": self._sale_percent_filter,
-            }
-            filters_not_none = {
-                k: el
-                for k, el in filters.items()
-                if el is not None and k in filter_methods
-            }
+    async def get_with_filters(
+        self,
+        sort_by: str = "product_id",
+        order: str = "asc",
+        cursor: str | None = None,
+        limit: int = CATALOG_PAGE_SIZE,
+        **filters,
+    ) -> tuple[list[Product], str | None]:
+        """
+        Получение страницы товаров по фильтрам
 
-            for filter_name, value in filters_not_none.items():
-                query = filter_methods[filter_name](query, value)
-
-            specification_filters: dict = filters.get("specification_filters", {})
+        Товары сортируются по (sort_by, product_id) и отдаются страницами по limit штук.
+        Возвращает товары страницы и курсор следующей страницы (None, если страница последняя)
+        """
+        try:
+            query = self._filtered_query(**filters)
+            query = self._keyset_page(query, sort_by, order, cursor, limit)
 
-            for key, val in specification_filters.items():
-                query = self._specification_filter_eq(query, key, val)
+            results = list((await self.session.execute(query)).scalars().all())
 
-            results = [el.Product for el in (await self.session.execute(query)).all()]
+            next_cursor = None
+            if len(results) > limit:
+                results = results[:limit]
+                last = results[-1]
+                next_cursor = encode_cursor(getattr(last, sort_by), last.product_id)
 
             logger.debug(
                 "Products filtered successfully",
                 extra={
-                    "filters_count": len(filters_not_none),
-                    "spec_filters_count": len(specification_filters),
+                    "filters_count": sum(
+                        el is not None
+                        for k, el in filters.items()
+                        if k != "specification_filters"
+                    ),
+                    "spec_filters_count": len(filters.get("specification_filters") or {}),
                     "results_count": len(results),
+                    "sort_by": sort_by,
+                    "has_next_page": next_cursor is not None,
                 },
             )
-            return results
+            return results, next_cursor
 
         except ValueError as e:
             logger.warning(
@@ -102,6 +164,336 @@ class ProductDao(BaseDao):
                 detail="Непредвиденная ошибка при поиске товара",
             )
 
+    async def add_and_return_id(self, **data) -> int:
+        """Добавление товара с возвратом id"""
+        query = insert(self.model).values(**data).returning(Product.product_id)
+        try:
+            product_id = (await self.session.execute(query)).scalar()
+            logger.debug("Product created successfully", extra={"product_id": product_id})
+            return product_id
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Cannot add_and_return_id for Product")
+            logger.error(msg, extra={"title": data.get("title")}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при добавлении товара",
+            )
+
+    def _keyset_page(self, query, sort_by: str, order: str, cursor: str | None, limit: int):
+        """
+        Добавляет к запросу сортировку по (sort_by, product_id), условие начала страницы
+        после курсора и LIMIT. Берется на одну строку больше, чтобы понять, есть ли следующая страница.
+        Товары с пустым значением ключа сортировки (NULL) всегда идут в конце
+        """
+        column = getattr(Product, sort_by)
+        nullable = Product.__table__.c[sort_by].nullable
+        desc = order == "desc"
+        logger.debug(
+            "Applying keyset pagination",
+            extra={"sort_by": sort_by, "order": order, "limit": limit},
+        )
+
+        if cursor is not None:
+            value, last_id = decode_cursor(cursor, sort_by)
+            after_id = Product.product_id < last_id if desc else Product.product_id > last_id
+            if sort_by == "product_id":
+                query = query.where(after_id)
+            elif not nullable:
+                # Сравнение строк (col, product_id) > (:value, :id) целиком идет по составному индексу
+                row, last_row = tuple_(column, Product.product_id), tuple_(value, last_id)
+                query = query.where(row < last_row if desc else row > last_row)
+            elif value is None:
+                query = query.where(column.is_(None), after_id)
+            else:
+                after_value = column < value if desc else column > value
+                query = query.where(
+                    or_(after_value, and_(column == value, after_id), column.is_(None))
+                )
+
+        order_by = [Product.product_id.desc() if desc else Product.product_id.asc()]
+        if sort_by != "product_id":
+            column_order = column.desc() if desc else column.asc()
+            order_by.insert(0, column_order.nulls_last() if nullable else column_order)
+        return query.order_by(*order_by).limit(limit + 1)
+
+    async def apply_rating_delta(self, product_id: int, sum_delta: int, count_delta: int):
+        """
+        Изменение суммы и количества оценок товара с пересчетом рейтинга
+
+        Выполняется в транзакции записи отзыва и блокирует строку товара до ее конца.
+        Возвращает строку (product_id, category_title) или None, если товара нет
+        """
+        try:
+            query = text(
+                """
+                UPDATE products
+                SET rating_sum = rating_sum + :sum_delta,
+                    rating_count = rating_count + :count_delta,
+                    rating = CASE
+                        WHEN rating_count + :count_delta > 0
+                        THEN ROUND((rating_sum + :sum_delta)::numeric / (rating_count + :count_delta), 1)::float
+                    END
+                WHERE product_id = :product_id
+                RETURNING (
+                    SELECT title FROM categories WHERE categories.category_id = products.category_id
+                ) AS category_title, product_id
+                """
+            )
+            params = {
+                "product_id": product_id,
+                "sum_delta": sum_delta,
+                "count_delta": count_delta,
+            }
+            row = (await self.session.execute(query, params)).one_or_none()
+            logger.debug(
+                "Product rating delta applied",
+                extra={"product_id": product_id, "sum_delta": sum_delta, "count_delta": count_delta},
+            )
+            return row
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to apply product rating delta")
+            logger.error(msg, extra={"product_id": product_id}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при обновлении рейтинга товара",
+            )
+
+    async def get_by_ids(self, product_ids: list[int]) -> list[Product]:
+        """Получение товаров по id (удаленных товаров в ответе нет)"""
+        try:
+            query = select(Product).where(Product.product_id.in_(product_ids))
+            return (await self.session.execute(query)).scalars().all()
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to get products by ids")
+            logger.error(msg, extra={"count": len(product_ids)}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при получении товаров",
+            )
+
+    async def lock_product_index(self) -> None:
+        """Блокировка синхронизации индекса товаров до конца транзакции (см. ProductIndexOutboxSyncDao.lock)"""
+        try:
+            await self.session.execute(select(func.pg_advisory_xact_lock(PRODUCT_INDEX_LOCK_KEY)))
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to lock product index sync")
+            logger.error(msg, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при блокировке синхронизации индекса товаров",
+            )
+
+    async def search_by_words(
+        self,
+        words: list[str],
+        limit: int,
+        after: tuple[float, int] | None = None,
+        with_total: bool = False,
+    ) -> tuple[list[tuple[Product, float]], int | None]:
+        """
+        Поиск товаров по вхождению слов в title и description (резервный поиск без elasticsearch)
+
+        Оценка как у поиска elasticsearch, но без idf: max(2 * число слов в названии, число слов
+        в описании). Возвращает до limit + 1 пар (товар, оценка) после позиции after в порядке
+        (оценка по убыванию, product_id) и количество найденных (только при with_total=True).
+        ILIKE '%слово%' идет по триграммным индексам, слова состоят только из букв и цифр
+        (split_words), поэтому % и _ в них не экранируются
+        """
+        try:
+            title_score = sum(case((Product.title.ilike(f"%{word}%"), 1), else_=0) for word in words)
+            description_score = sum(
+                case((Product.description.ilike(f"%{word}%"), 1), else_=0) for word in words
+            )
+            matched = or_(
+                *(
+                    column.ilike(f"%{word}%")
+                    for column in (Product.title, Product.description)
+                    for word in words
+                )
+            )
+            score = cast(func.greatest(2 * title_score, description_score), Float).label("score")
+            scored = select(Product, score).where(matched).subquery()
+            scored_product = aliased(Product, scored)
+
+            query = select(scored_product, scored.c.score)
+            if after is not None:
+                after_score, after_id = after
+                query = query.where(
+                    or_(
+                        scored.c.score < after_score,
+                        and_(scored.c.score == after_score, scored.c.product_id > after_id),
+                    )
+                )
+            query = query.order_by(scored.c.score.desc(), scored.c.product_id).limit(limit + 1)
+            rows = [tuple(row) for row in (await self.session.execute(query)).all()]
+
+            total = None
+            if with_total:
+                total = await self.session.scalar(
+                    select(func.count()).select_from(Product).where(matched)
+                )
+            logger.debug("Products searched by words", extra={"words": words, "hits": len(rows)})
+            return rows, total
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to search products by words")
+            logger.error(msg, extra={"words": words}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при поиске товаров",
+            )
+
+    async def suggest_by_words(self, words: list[str], size: int) -> list[dict]:
+        """
+        Подсказки товаров (product_id и title): в названии есть все слова, последнее - как начало слова
+
+        Сначала короткие названия, как у подсказок elasticsearch
+        """
+        *complete, last = words
+        try:
+            query = (
+                select(Product.product_id, Product.title)
+                .where(
+                    *(Product.title.ilike(f"%{word}%") for word in complete),
+                    or_(Product.title.ilike(f"{last}%"), Product.title.ilike(f"% {last}%")),
+                )
+                .order_by(func.length(Product.title), Product.product_id)
+                .limit(size)
+            )
+            return [dict(row) for row in (await self.session.execute(query)).mappings().all()]
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to suggest products by words")
+            logger.error(msg, extra={"words": words}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при получении подсказок",
+            )
+
+    async def get_facets(self, category: str, price_step: int = FACET_PRICE_STEP) -> dict:
+        """
+        Количество товаров категории по значениям фильтров каталога
+
+        Все счетчики считаются одним запросом с GROUPING SETS. Ключи rating - значения
+        фильтра rating каталога (1: от 4 и выше и т.д.), ключи price - диапазоны start-end
+        шириной price_step с концом на копейку меньше начала следующего диапазона
+        (ключ можно передать в фильтр price как есть), specification - количество
+        товаров по ключу и значению характеристики
+        """
+        try:
+            query = text(
+                """
+                WITH category_products AS (
+                    SELECT products.product_id, products.country_origin, products.months_warranty,
+                           floor(products.rating)::int AS rating_bucket,
+                           (floor(products.price / :price_step) * :price_step)::int AS price_bucket,
+                           products.specification
+                    FROM products
+                    JOIN categories USING (category_id)
+                    WHERE categories.title = :category
+                )
+                SELECT
+                    CASE
+                        WHEN GROUPING(cp.country_origin) = 0 THEN 'country_origin'
+                        WHEN GROUPING(cp.months_warranty) = 0 THEN 'months_warranty'
+                        WHEN GROUPING(cp.rating_bucket) = 0 THEN 'rating'
+                        WHEN GROUPING(cp.price_bucket) = 0 THEN 'price'
+                        ELSE 'specification'
+                    END AS facet,
+                    cp.country_origin, cp.months_warranty, cp.rating_bucket, cp.price_bucket,
+                    spec.key AS spec_key, spec.value #>> '{}' AS spec_value,
+                    count(DISTINCT cp.product_id) AS count
+                FROM category_products cp
+                LEFT JOIN LATERAL jsonb_each(cp.specification) AS spec ON true
+                GROUP BY GROUPING SETS (
+                    (cp.country_origin), (cp.months_warranty), (cp.rating_bucket),
+                    (cp.price_bucket), (spec.key, spec.value)
+                )
+                """
+            )
+            rows = (
+                await self.session.execute(
+                    query, params={"category": category, "price_step": price_step}
+                )
+            ).all()
+
+            facets = {
+                "country_origin": {},
+                "months_warranty": {},
+                "rating": {},
+                "price": {},
+                "specification": {},
+            }
+            rating_buckets = {}
+            for row in rows:
+                if row.facet == "country_origin" and row.country_origin is not None:
+                    facets["country_origin"][row.country_origin] = row.count
+                elif row.facet == "months_warranty" and row.months_warranty is not None:
+                    facets["months_warranty"][row.months_warranty] = row.count
+                elif row.facet == "rating" and row.rating_bucket is not None:
+                    rating_buckets[row.rating_bucket] = row.count
+                elif row.facet == "price" and row.price_bucket is not None:
+                    price_end = row.price_bucket + price_step - PRICE_STEP_CENT
+                    price_range = f"{row.price_bucket}-{price_end}"
+                    facets["price"][price_range] = row.count
+                elif row.facet == "specification" and row.spec_key is not None:
+                    facets["specification"].setdefault(row.spec_key, {})[row.spec_value] = row.count
+
+            for rating in range(1, 5):
+                facets["rating"][rating] = sum(
+                    count for bucket, count in rating_buckets.items() if bucket >= 5 - rating
+                )
+
+            logger.debug(
+                "Catalog facets calculated",
+                extra={"category": category, "rows_count": len(rows)},
+            )
+            return facets
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to calculate catalog facets")
+            logger.error(msg, extra={"category": category}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при подсчете фильтров каталога",
+            )
+
+    def _filtered_query(self, **filters):
+        """Запрос товаров с фильтрами каталога (без сортировки и пагинации)"""
+        query = select(self.model)
+        filter_methods = {
+            "category": self._category_filter,
+            "price": self._price_filter,
+            "rating": self._rating_filter,
+            "months_warranty": self._months_warranty_filter,
+            "country_origin": self._country_origin_filter,
+            "sale_percent": self._sale_percent_filter,
+        }
+        # Значения приводятся так же, как в ключе кэша (canonical_params): пробелы по краям
+        # отбрасываются, пустые фильтры не применяются. Иначе запросы с одним ключом кэша
+        # давали бы разный ответ при промахе
+        filters_not_none = {
+            k: _strip_filter_value(el)
+            for k, el in filters.items()
+            if k in filter_methods and _strip_filter_value(el) not in (None, "")
+        }
+
+        for filter_name, value in filters_not_none.items():
+            query = filter_methods[filter_name](query, value)
+
+        specification_filters: dict = {
+            key.strip(): value.strip()
+            for key, value in (filters.get("specification_filters") or {}).items()
+            if value.strip()
+        }
+        equal_filters = {}
+        for key, value in specification_filters.items():
+            bounds = self._parse_specification_range(key, value)
+            if bounds is None:
+                equal_filters[key] = value
+            else:
+                query = self._specification_filter_range(query, key, *bounds)
+        if equal_filters:
+            query = self._specification_filter_eq(query, equal_filters)
+        return query
+
     def _category_filter(self, query, category):
         """Добавляет к текущему запросу фильтр по категории"""
         logger.debug("Applying category filter", extra={"category": category})
@@ -118,16 +510,17 @@ class ProductDao(BaseDao):
     @staticmethod
     def _parse_price_filter(price):
         """Парсинг фильтра по цене и валидирует его"""
-        numbers = price.split("-")
+        # Пробелы внутри допускаются, как в normalize_price_range ключа кэша
+        numbers = price.replace(" ", "").split("-")
         if (
             len(numbers) != 2
-            or (not numbers[0].isdigit() or not numbers[1].isdigit())
-            or int(numbers[0]) > int(numbers[1])
+            or not all(PRICE_NUMBER_RE.fullmatch(number) for number in numbers)
+            or Decimal(numbers[0]) > Decimal(numbers[1])
         ):
             raise ValueError(
                 "Неправильное поле price. Формат: start-end, где start <= end"
             )
-        return (int(numbers[0]), int(numbers[1]))
+        return (Decimal(numbers[0]), Decimal(numbers[1]))
 
     def _rating_filter(self, query, rating):
         """Добавляет к текущему запросу фильтр по рейтингу (1: от 4 и выше, 2: от 3 и выше и т.д.)"""
@@ -150,186 +543,174 @@ class ProductDao(BaseDao):
         logger.debug("Applying sale filter", extra={"percent": percent})
         return query.where(Product.sale_percent >= percent)
 
-    def _specification_filter_eq(self, query, key: str, value: str):
-        """Фильтр для характеристик товара по равенству значения по ключу с полем"""
+    def _specification_filter_eq(self, query, specification_filters: dict):
+        """
+        Фильтр для характеристик товара по равенству значений по ключам
+
+        Все фильтры объединяются в одно условие specification @> {...}, которое
+        использует GIN индекс idx_specification_gin
+        """
+        containment = {
+            key: self._parse_specification_value(value)
+            for key, value in specification_filters.items()
+        }
+        logger.debug("Applying specification filter", extra={"filters": containment})
+        return query.where(Product.specification.contains(containment))
+
+    @staticmethod
+    def _parse_specification_range(key: str, value: str) -> tuple | None:
+        """
+        Парсинг фильтра по диапазону для числовых ключей характеристик
+
+        Формат start-end, start- или -end. Для остальных ключей и значений возвращает None,
+        такой фильтр считается фильтром по равенству
+        """
+        if key not in SPECIFICATION_RANGE_KEYS:
+            return None
+        match = SPECIFICATION_RANGE_RE.fullmatch(value.replace(" ", ""))
+        if match is None or match.group(1, 2) == (None, None):
+            return None
+        start, end = (
+            None if bound is None else json.loads(bound) for bound in match.group(1, 2)
+        )
+        if start is not None and end is not None and start > end:
+            raise ValueError(
+                f"Неправильный фильтр {key}. Формат: start-end, где start <= end"
+            )
+        return start, end
+
+    def _specification_filter_range(self, query, key: str, start, end):
+        """
+        Фильтр для числовой характеристики товара по диапазону значений
+
+        Ключ подставляется в запрос литералом, чтобы выражение совпадало
+        с индексом idx_products_spec_<key> и в подготовленных запросах
+        """
         logger.debug(
-            "Applying specification filter", extra={"key": key, "value": value}
+            "Applying specification range filter",
+            extra={"key": key, "start": start, "end": end},
         )
-        return query.where(Product.specification[key].astext == value)
+        value = Product.specification[bindparam(None, key, literal_execute=True)]
+        # Без проверки типа открытый диапазон по порядку типов jsonb находит и нечисловые значения
+        query = query.where(func.jsonb_typeof(value) == "number")
+        if start is not None:
+            query = query.where(value >= bindparam(None, start, type_=JSONB))
+        if end is not None:
+            query = query.where(value <= bindparam(None, end, type_=JSONB))
+        return query
 
-    async def avg_price(self, user_id: int) -> float:
-        """Получение средней цены товара купленного пользователем"""
+    @staticmethod
+    def _parse_specification_value(value: str):
+        """
+        Приводит значение фильтра из query к типу json (true -> bool, 55 -> int, 4K -> str)
+
+        Сравнение в jsonb типизированное, поэтому значение должно совпадать по типу
+        с тем, что хранится в характеристиках. Строку из цифр можно передать в кавычках ("55")
+        """
         try:
-            params = {"user_id": user_id}
-            query = text(
-                """
-                SELECT AVG(products.price) AS avg_price FROM public.purchases
-                JOIN orders USING(order_id)
-                JOIN products USING (product_id)
-                WHERE user_id = :user_id
-                """
-            )
-            result = (
-                (await self.session.execute(query, params=params))
-                .scalars()
-                .one_or_none()
-            )
-            logger.debug(
-                "Average price calculated",
-                extra={"user_id": user_id, "avg_price": result},
-            )
-            return result
-        except SQLAlchemyError as e:
-            msg = create_msg_db_error("Failed to calculate average price")
-            logger.error(msg, extra={"user_id": user_id}, exc_info=True)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Ошибка при расчете средней цены",
-            )
-        except Exception as e:
-            logger.error(
-                "Unexpected error calculating average price",
-                extra={"user_id": user_id},
-                exc_info=True,
-            )
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Непредвиденная ошибка при расчете средней цены",
-            )
+            parsed = json.loads(value)
+        except ValueError:
+            return value
+        # NaN, Infinity и 1e999 json.loads разбирает в float, но в jsonb их нет - это строки
+        if isinstance(parsed, float) and not math.isfinite(parsed):
+            return value
+        if isinstance(parsed, (bool, int, float, str)):
+            return parsed
+        return value
+
+    async def get_recommendations(self, user_id: int) -> list[Product]:
+        """
+        Рекомендации для пользователя одним запросом
 
-    async def get_recomentation_with_avg_price(
-        self, user_id: int, avg_price: float
-    ) -> list[Product]:
-        """Рекомендации с фильтрацией по средней цене"""
+        Стратегия выбирается в SQL: у пользователя без избранного - просто популярные товары,
+        с избранным и покупками - кандидаты по близости к средней цене покупок,
+        с избранным без покупок - кандидаты по рейтингу
+        """
         try:
-            params = {"user_id": user_id, "avg_price": avg_price}
+            params = {"user_id": user_id}
             query = text(
-                """
-                WITH 
-                favorite_cats AS (
-                    SELECT category_id FROM public.favorite_products
-                    JOIN products USING (product_id)
-                    WHERE user_id = :user_id
-                    GROUP BY (user_id, category_id)
-                    ORDER BY COUNT(category_id) DESC
-                    LIMIT 5),
-                popular_not_in_fav_cats AS (
-                    SELECT product_id, title, category_id, specification, price, rating, description, months_warranty, country_origin, sale_percent, views
-                    FROM products
-                    WHERE category_id not in (SELECT category_id FROM favorite_cats)
-                    ORDER BY rating DESC, views DESC
-                    LIMIT 30
-                ),
-                popular_in_fav_cats AS (
-                    SELECT product_id, title, category_id, specification, price, rating, description, months_warranty, country_origin, sale_percent, views
-                    FROM products
-                    WHERE category_id in (SELECT category_id FROM favorite_cats)
-                    ORDER BY rating DESC, views DESC
-                    LIMIT 60
-                ),
-                union_tables AS (
-                    SELECT product_id, title, category_id, specification, price, rating, description, months_warranty, country_origin, sale_percent, views
-                    FROM popular_not_in_fav_cats
-                    UNION 
-                    SELECT product_id, title, category_id, specification, price, rating, description, months_warranty, country_origin, sale_percent, views
-                    FROM popular_in_fav_cats
+                RECOMMENDATION_CANDIDATES_CTE
+                + """,
+                user_stats AS (
+                    SELECT
+                        EXISTS (
+                            SELECT 1 FROM favorite_products WHERE user_id = :user_id
+                        ) AS has_favorites,
+                        (
+                            SELECT AVG(products.price) FROM purchases
+                            JOIN orders USING (order_id)
+                            JOIN products USING (product_id)
+                            WHERE user_id = :user_id
+                        ) AS avg_price
                 )
-                SELECT *
-                FROM union_tables
-                ORDER BY ABS(price - :avg_price) ASC"""
+                SELECT products.product_id, title, category_id, specification, price, rating,
+                       description, months_warranty, country_origin, sale_percent, views
+                FROM candidates
+                JOIN products USING (product_id)
+                CROSS JOIN user_stats
+                ORDER BY
+                    CASE WHEN user_stats.has_favorites THEN ABS(price - user_stats.avg_price) END,
+                    rating DESC NULLS LAST,
+                    views DESC NULLS LAST"""
             )
             results = (await self.session.execute(query, params=params)).mappings().all()
             logger.info(
-                "Recommendations with avg price retrieved",
-                extra={
-                    "user_id": user_id,
-                    "avg_price": avg_price,
-                    "count": len(results),
-                },
+                "Recommendations retrieved",
+                extra={"user_id": user_id, "count": len(results)},
             )
             return results
         except SQLAlchemyError as e:
-            msg = create_msg_db_error("Failed to get recommendations with avg price")
-            logger.error(msg, extra={"user_id": user_id, "avg_price": avg_price}, exc_info=True)
+            msg = create_msg_db_error(e, "Failed to get recommendations")
+            logger.error(msg, extra={"user_id": user_id}, exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Ошибка при получении рекомендаций",
             ) from e
-        except Exception as e:
-            logger.error(
-                "Unexpected error getting recommendations with avg price",
-                extra={"user_id": user_id},
-                exc_info=True,
-            )
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Непредвиденная ошибка при получении рекомендаций",
-            ) from e
 
-    async def get_recomentation(self, user_id: int) -> list[Product]:
-        """Получение рекомендаций для пользователя с любимыми товарами без средней цены товара"""
+    async def has_favorites(self, user_id: int) -> bool:
+        """Есть ли у пользователя избранные товары (как has_favorites в get_recommendations)"""
         try:
-            params = {"user_id": user_id}
-            query = text(
-                """
-                WITH favorite_cats AS (
-                SELECT category_id FROM public.favorite_products
-                JOIN products USING (product_id)
-                WHERE user_id = :user_id
-                GROUP BY (user_id, category_id)
-                ORDER BY COUNT(category_id) DESC
-                LIMIT 5),
-                popular_not_in_fav_cats AS (
-                SELECT product_id, title, category_id, specification, price, rating, description, months_warranty, country_origin, sale_percent, views
-                FROM products
-                WHERE category_id not in (SELECT category_id FROM favorite_cats)
-                ORDER BY rating DESC, views DESC
-                LIMIT 30
-                ),
-                popular_in_fav_cats AS (
-                SELECT product_id, title, category_id, specification, price, rating, description, months_warranty, country_origin, sale_percent, views
-                FROM products
-                WHERE category_id in (SELECT category_id FROM favorite_cats)
-                ORDER BY rating DESC, views DESC
-                LIMIT 60
-                )
-                SELECT * FROM popular_not_in_fav_cats
-                UNION SELECT * FROM popular_in_fav_cats
-                ORDER BY rating DESC """
-            )
-            results = (await self.session.execute(query, params=params)).mappings().all()
-            logger.info(
-                "Recommendations retrieved",
-                extra={"user_id": user_id, "count": len(results)},
+            query = select(
+                select(FavoriteProduct.favorite_product_id)
+                .where(FavoriteProduct.user_id == user_id)
+                .exists()
             )
-            return results
+            return await self.session.scalar(query)
         except SQLAlchemyError as e:
-            msg = create_msg_db_error("Failed to get recommendations")
+            msg = create_msg_db_error(e, "Failed to check user favorites")
             logger.error(msg, extra={"user_id": user_id}, exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Ошибка при получении рекомендаций",
             ) from e
-        except Exception as e:
-            logger.error(
-                "Unexpected error getting recommendations",
-                extra={"user_id": user_id},
-                exc_info=True,
+
+    async def get_favorited_user_ids(self, product_id: int) -> list[int]:
+        """id пользователей, у которых товар в избранном"""
+        try:
+            query = select(FavoriteProduct.user_id).where(
+                FavoriteProduct.product_id == product_id
             )
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Непредвиденная ошибка при получении рекомендаций",
-            ) from e
+            return (await self.session.execute(query)).scalars().all()
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to get users with favorite product")
+            logger.error(msg, extra={"product_id": product_id}, exc_info=True)
+            raise
 
     async def get_recomentation_for_new_user(self) -> list[Product]:
-        """Рекомендации для пользователей без статистики"""
+        """Рекомендации для пользователей без статистики (30 самых популярных товаров)"""
         try:
             query = text(
                 """
-                SELECT product_id, title, category_id, specification, price, rating, description, months_warranty, country_origin, sale_percent, views
-                FROM products
-                ORDER BY rating DESC, views DESC
-                LIMIT 30
+                SELECT products.product_id, title, category_id, specification, price, rating,
+                       description, months_warranty, country_origin, sale_percent, views
+                FROM (
+                    SELECT product_id FROM category_top_products
+                    WHERE position <= 30
+                    ORDER BY rating DESC NULLS LAST, views DESC NULLS LAST
+                    LIMIT 30
+                ) top
+                JOIN products USING (product_id)
+                ORDER BY rating DESC NULLS LAST, views DESC NULLS LAST
                 """
             )
             results = (await self.session.execute(query)).mappings().all()
@@ -352,28 +733,21 @@ class ProductDao(BaseDao):
     async def get_user_emails_for_send_emails_about_new_product(
         self, product: ProductSchema
     ) -> list[str]:
-        """Получение пользователей, которым нужно отправить email о появлении товара в их любимой категории"""
+        """
+        Получение пользователей, которым нужно отправить email о появлении товара в их любимой категории
+
+        Любимая категория (position = 1) берется из user_favorite_categories, поэтому это
+        поиск по индексу. Таблицу точечно пересчитывает celery при изменении избранного
+        и переносе избранного товара в другую категорию из админки, полностью - раз в час
+        """
         try:
             params = {"category_id": product.category_id}
             query = text(
                 """
-                WITH count_favs AS (
-                SELECT user_id, category_id, COUNT(category_id) AS count_products
-                FROM favorite_products JOIN products USING (product_id)
-                GROUP BY (user_id, category_id)
-                ),
-                rank_categories AS (
-                    SELECT user_id, category_id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY count_products DESC) AS rn
-                    FROM count_favs
-                ),
-                fav_categories AS (
-                    SELECT user_id, category_id FROM rank_categories
-                    WHERE rn = 1
-                )
                 SELECT email
-                FROM fav_categories
+                FROM user_favorite_categories
                 JOIN users USING (user_id)
-                WHERE category_id = :category_id"""
+                WHERE category_id = :category_id AND position = 1"""
             )
             results = (await self.session.execute(query, params)).scalars().all()
             logger.info(
@@ -402,79 +776,296 @@ class ProductDao(BaseDao):
                 detail="Непредвиденная ошибка при получении пользователей для уведомлений",
             ) from e
 
-    async def favorite_products(self, user_id: int) -> list[int]:
-        """Получение ID любимых продуктов пользователя"""
+
+# Синхронный вариант для celery
+class ProductSyncDao(BaseSyncDao):
+    model = Product
+
+    def update_avg_reviews(self, since: datetime | None = None) -> list[int]:
+        """
+        Сверка рейтингов товаров с отзывами одним UPDATE
+
+        Обычно rating_sum, rating_count и rating обновляются вместе с отзывом, здесь
+        исправляются расхождения (например, после правки отзывов через админку).
+        Проверяются только товары, отзывы которых изменились после since
+        (None - все товары с отзывами или с ненулевым рейтингом). Возвращает id товаров, у которых оценка изменилась
+        """
         try:
             query = text(
                 """
-                SELECT product_id
-                FROM favorite_products
-                WHERE user_id = :user_id
+                WITH changed AS (
+                    SELECT product_id FROM reviews
+                    WHERE CAST(:since AS timestamp) IS NULL OR date_updated > :since
+                    UNION
+                    -- При полной сверке и товары, чьи отзывы удалены мимо сервиса отзывов
+                    SELECT product_id FROM products
+                    WHERE CAST(:since AS timestamp) IS NULL
+                      AND (rating_count > 0 OR rating IS NOT NULL)
+                ),
+                averages AS (
+                    SELECT product_id,
+                           ROUND(AVG(reviews.rating), 1)::float AS avg_review,
+                           COALESCE(SUM(reviews.rating), 0) AS rating_sum,
+                           COUNT(reviews.rating) AS rating_count
+                    FROM changed LEFT JOIN reviews USING (product_id)
+                    GROUP BY product_id
+                )
+                UPDATE products
+                SET rating = averages.avg_review,
+                    rating_sum = averages.rating_sum,
+                    rating_count = averages.rating_count
+                FROM averages
+                WHERE products.product_id = averages.product_id
+                  AND (products.rating IS DISTINCT FROM averages.avg_review
+                       OR products.rating_sum <> averages.rating_sum
+                       OR products.rating_count <> averages.rating_count)
+                RETURNING products.product_id
                 """
             )
-            results = (await self.session.execute(query, params={"user_id": user_id})).scalars().all()
-            logger.debug(
-                "Favorite products retrieved",
-                extra={"user_id": user_id, "count": len(results)},
+            changed_product_ids = self.session.execute(query, {"since": since}).scalars().all()
+            logger.info(
+                "Average reviews updated (sync)",
+                extra={"since": since, "changed_count": len(changed_product_ids)},
             )
-            return results
+            return changed_product_ids
         except SQLAlchemyError as e:
-            msg = create_msg_db_error("Failed to get favorite products")
-            logger.error(msg, extra={"user_id": user_id}, exc_info=True)
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Ошибка при получении любимых продуктов",
-            ) from e
-        except Exception as e:
-            logger.error(
-                "Unexpected error getting favorite products",
-                extra={"user_id": user_id},
-                exc_info=True,
+            msg = create_msg_db_error(e, "Failed to update average reviews (sync)")
+            logger.error(msg, extra={"since": since}, exc_info=True)
+            raise
+
+    def categories_of(self, product_ids: list[int]) -> list:
+        """Получение категорий товаров (category_id, title)"""
+        try:
+            query = text(
+                """
+                SELECT DISTINCT categories.category_id, categories.title
+                FROM products JOIN categories USING (category_id)
+                WHERE product_id = ANY(:product_ids)
+                """
             )
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Непредвиденная ошибка при получении любимых продуктов",
-            ) from e
+            return self.session.execute(query, {"product_ids": list(product_ids)}).all()
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to get product categories (sync)")
+            logger.error(msg, extra={"count": len(product_ids)}, exc_info=True)
+            raise
 
+    def get_by_ids(self, product_ids: list[int]) -> list[Product]:
+        """Получение товаров по id (удаленных товаров в ответе нет)"""
+        try:
+            query = select(Product).where(Product.product_id.in_(product_ids))
+            return self.session.execute(query).scalars().all()
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to get products by ids (sync)")
+            logger.error(msg, extra={"count": len(product_ids)}, exc_info=True)
+            raise
 
-# Синхронный вариант для celery
-class ProductSyncDao(BaseSyncDao):
-    model = Product
+    def refresh_category_top_products(self, category_ids: list[int] | None = None) -> None:
+        """
+        Пересчет популярных товаров категорий для рекомендаций
+
+        category_ids - категории для пересчета, None - все категории
+        """
+        params = {
+            "category_ids": None if category_ids is None else list(category_ids),
+            "top_size": RECOMMENDATION_TOP_SIZE,
+        }
+        try:
+            # Пересчеты (ежечасный полный, по измененным рейтингам, из админки) могут пересекаться:
+            # без блокировки DELETE второго не видит строк, вставленных первым, и INSERT
+            # падает на первичном ключе. Блокировка держится до конца транзакции
+            self.session.execute(
+                select(func.pg_advisory_xact_lock(RECOMMENDATION_CANDIDATES_LOCK_KEY))
+            )
+            self.session.execute(
+                text(
+                    """
+                    DELETE FROM category_top_products
+                    WHERE CAST(:category_ids AS integer[]) IS NULL
+                       OR category_id = ANY(CAST(:category_ids AS integer[]))
+                    """
+                ),
+                params,
+            )
+            self.session.execute(
+                text(
+                    """
+                    INSERT INTO category_top_products (category_id, position, product_id, rating, views)
+                    SELECT category_id, position, product_id, rating, views
+                    FROM (
+                        SELECT category_id, product_id, rating, views,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY category_id
+                                   ORDER BY rating DESC NULLS LAST, views DESC NULLS LAST, product_id
+                               ) AS position
+                        FROM products
+                        WHERE category_id IS NOT NULL
+                          AND (CAST(:category_ids AS integer[]) IS NULL
+                               OR category_id = ANY(CAST(:category_ids AS integer[])))
+                    ) ranked
+                    WHERE position <= :top_size
+                    """
+                ),
+                params,
+            )
+            logger.debug(
+                "Category top products refreshed (sync)",
+                extra={"category_ids": category_ids},
+            )
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to refresh category top products (sync)")
+            logger.error(msg, extra={"category_ids": category_ids}, exc_info=True)
+            raise
+
+    def refresh_user_favorite_categories(self, user_ids: list[int] | None = None) -> None:
+        """
+        Пересчет рейтинга категорий пользователей по числу избранных товаров
 
-    def update_avg_reviews(self, products_avg_reviews: list[tuple[int, float]]):
-        """Обновление средних оценок товаров"""
+        user_ids - пользователи для пересчета, None - все пользователи
+        """
+        params = {"user_ids": None if user_ids is None else list(user_ids)}
+        try:
+            # Как в refresh_category_top_products: пересекающиеся пересчеты идут по очереди
+            self.session.execute(
+                select(func.pg_advisory_xact_lock(RECOMMENDATION_CANDIDATES_LOCK_KEY))
+            )
+            self.session.execute(
+                text(
+                    """
+                    DELETE FROM user_favorite_categories
+                    WHERE CAST(:user_ids AS integer[]) IS NULL
+                       OR user_id = ANY(CAST(:user_ids AS integer[]))
+                    """
+                ),
+                params,
+            )
+            self.session.execute(
+                text(
+                    """
+                    INSERT INTO user_favorite_categories (user_id, category_id, favorites_count, position)
+                    SELECT user_id, category_id, favorites_count,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY user_id ORDER BY favorites_count DESC, category_id
+                           )
+                    FROM (
+                        SELECT user_id, category_id, COUNT(*) AS favorites_count
+                        FROM favorite_products JOIN products USING (product_id)
+                        WHERE category_id IS NOT NULL
+                          AND (CAST(:user_ids AS integer[]) IS NULL
+                               OR user_id = ANY(CAST(:user_ids AS integer[])))
+                        GROUP BY user_id, category_id
+                    ) counts
+                    """
+                ),
+                params,
+            )
+            logger.debug(
+                "User favorite categories refreshed (sync)", extra={"user_ids": user_ids}
+            )
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to refresh user favorite categories (sync)")
+            logger.error(msg, extra={"user_ids": user_ids}, exc_info=True)
+            raise
+
+    def add_views(self, views_deltas: dict[int, int]):
+        """Добавление накопленных просмотров товарам одним запросом"""
         try:
             query = text(
                 """
                 UPDATE products
-                SET rating = :avg_review
-                WHERE product_id = :product_id
+                SET views = COALESCE(products.views, 0) + deltas.delta
+                FROM unnest(CAST(:product_ids AS integer[]), CAST(:deltas AS integer[]))
+                    AS deltas (product_id, delta)
+                WHERE products.product_id = deltas.product_id
                 """
             )
-            for product_id, avg_review in products_avg_reviews:
-                params = {
-                    "avg_review": float(avg_review),
-                    "product_id": int(product_id),
-                }
-                self.session.execute(query, params)
+            params = {
+                "product_ids": list(views_deltas.keys()),
+                "deltas": list(views_deltas.values()),
+            }
+            self.session.execute(query, params)
             logger.info(
-                "Average reviews updated (sync)",
-                extra={"count": len(products_avg_reviews)},
+                "Product views flushed (sync)", extra={"count": len(views_deltas)}
             )
         except SQLAlchemyError as e:
-            msg = create_msg_db_error("Failed to update average reviews (sync)")
-            logger.error(msg, extra={"count": len(products_avg_reviews)}, exc_info=True)
-            raise
-        except Exception as e:
-            logger.error(
-                "Unexpected error updating average reviews (sync)",
-                extra={"count": len(products_avg_reviews)},
-                exc_info=True,
-            )
+            msg = create_msg_db_error(e, "Failed to flush product views (sync)")
+            logger.error(msg, extra={"count": len(views_deltas)}, exc_info=True)
             raise
 
 
 class ReviewDao(BaseDao):
+    model = Review
+
+    async def add_review(self, product_id: int, user_id: int, **data) -> Review:
+        """Добавление отзыва, возвращает добавленную строку"""
+        try:
+            query = (
+                insert(Review)
+                .values(product_id=product_id, user_id=user_id, **data)
+                .returning(Review)
+            )
+            review = (await self.session.execute(query)).scalar_one()
+            logger.debug(
+                "Review added", extra={"review_id": review.review_id, "product_id": product_id}
+            )
+            return review
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to add review")
+            logger.error(msg, extra={"product_id": product_id, "user_id": user_id}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при добавлении отзыва",
+            )
+
+    async def get_for_update(self, review_id: int, user_id: int) -> Review | None:
+        """Получение отзыва пользователя с блокировкой строки до конца транзакции"""
+        try:
+            query = (
+                select(Review)
+                .where(Review.review_id == review_id, Review.user_id == user_id)
+                .with_for_update()
+            )
+            return (await self.session.execute(query)).scalar_one_or_none()
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to get review for update")
+            logger.error(msg, extra={"review_id": review_id}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при получении отзыва",
+            )
+
+    async def update_review(self, review_id: int, **data) -> Review:
+        """Изменение отзыва, возвращает измененную строку"""
+        try:
+            query = (
+                update(Review)
+                .where(Review.review_id == review_id)
+                .values(is_edited=True, **data)
+                .returning(Review)
+                # Отзыв уже загружен в сессию через get_for_update, без populate_existing
+                # вернулся бы тот же объект со старыми значениями
+                .execution_options(synchronize_session=False, populate_existing=True)
+            )
+            return (await self.session.execute(query)).scalar_one()
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to update review")
+            logger.error(msg, extra={"review_id": review_id}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при изменении отзыва",
+            )
+
+    async def delete_review(self, review_id: int) -> None:
+        """Удаление отзыва"""
+        try:
+            await self.session.execute(delete(Review).where(Review.review_id == review_id))
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to delete review")
+            logger.error(msg, extra={"review_id": review_id}, exc_info=True)
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при удалении отзыва",
+            )
+
     async def rating_of_products(self):
         """Получение product_id с их средней оценкой"""
         try:
@@ -502,28 +1093,132 @@ class ReviewDao(BaseDao):
             )
 
 
-class ReviewSyncDao(BaseDao):
-    def rating_of_products(self):
-        """Получение product_id с их средней оценкой (sync)"""
+# Синхронный вариант для celery
+class WatermarkSyncDao(BaseSyncDao):
+    model = SyncWatermark
+
+    def get(self, name: str) -> datetime | None:
+        """Получение отметки времени фоновой задачи"""
+        watermark = self.session.get(SyncWatermark, name)
+        return watermark.value if watermark is not None else None
+
+    def set(self, name: str, value: datetime) -> None:
+        """Сохранение отметки времени фоновой задачи (без коммита)"""
+        query = (
+            pg_insert(SyncWatermark)
+            .values(name=name, value=value)
+            .on_conflict_do_update(index_elements=["name"], set_={"value": value})
+        )
+        self.session.execute(query)
+
+
+# Синхронный вариант для celery
+class ProductViewsFlushSyncDao(BaseSyncDao):
+    model = ProductViewsFlush
+
+    def lock(self) -> None:
+        """Блокировка переноса просмотров до конца транзакции, переносы идут по одному"""
         try:
-            query = text(
-                """SELECT product_id, ROUND(AVG(rating), 1) AS rating
-                            FROM reviews
-                            GROUP BY product_id"""
+            self.session.execute(select(func.pg_advisory_xact_lock(PRODUCT_VIEWS_FLUSH_LOCK_KEY)))
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to lock product views flush (sync)")
+            logger.error(msg, exc_info=True)
+            raise
+
+    def add(self, flush_id: str) -> bool:
+        """
+        Отметка переноса просмотров записанным (без коммита)
+
+        Возвращает False, если перенос с этим id уже был записан
+        """
+        try:
+            query = (
+                pg_insert(ProductViewsFlush)
+                .values(flush_id=flush_id)
+                .on_conflict_do_nothing(index_elements=["flush_id"])
+                .returning(ProductViewsFlush.flush_id)
             )
-            ratings = self.session.execute(query).fetchall()
-            logger.debug(
-                "Product ratings calculated (sync)", extra={"count": len(ratings)}
+            return self.session.scalar(query) is not None
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to add product views flush (sync)")
+            logger.error(msg, extra={"flush_id": flush_id}, exc_info=True)
+            raise
+
+    def delete_older_than(self, created_before: datetime) -> None:
+        """Удаление старых отметок переносов (без коммита)"""
+        try:
+            self.session.execute(
+                delete(ProductViewsFlush).where(ProductViewsFlush.created_at < created_before)
             )
-            return ratings
         except SQLAlchemyError as e:
-            msg = create_msg_db_error("Failed to get product ratings (sync)")
+            msg = create_msg_db_error(e, "Failed to delete product views flushes (sync)")
             logger.error(msg, exc_info=True)
             raise
-        except Exception as e:
-            logger.error(
-                "Unexpected error getting product ratings (sync)", exc_info=True
+
+
+# Синхронный вариант для celery
+class ProductIndexOutboxSyncDao(BaseSyncDao):
+    model = ProductIndexOutbox
+
+    def get_changes(self, limit: int) -> tuple[list[int], list[int]]:
+        """
+        Получение первых limit изменений товаров из очереди
+
+        Возвращает id взятых записей очереди и id измененных товаров без повторов
+        """
+        try:
+            query = (
+                select(ProductIndexOutbox.outbox_id, ProductIndexOutbox.product_id)
+                .order_by(ProductIndexOutbox.outbox_id)
+                .limit(limit)
+            )
+            rows = self.session.execute(query).all()
+            product_ids = list(dict.fromkeys(row.product_id for row in rows))
+            return [row.outbox_id for row in rows], product_ids
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to get product index changes (sync)")
+            logger.error(msg, extra={"limit": limit}, exc_info=True)
+            raise
+
+    def lock(self, wait: bool = True) -> bool:
+        """
+        Блокировка синхронизации индекса товаров до конца транзакции
+
+        Полная перестройка и инкрементальная синхронизация не должны идти одновременно,
+        иначе изменения, записанные в старый индекс во время перестройки, потеряются
+        при переключении алиаса. wait=False - не ждать, вернуть False, если блокировка занята
+        """
+        try:
+            if wait:
+                self.session.execute(
+                    select(func.pg_advisory_xact_lock(PRODUCT_INDEX_LOCK_KEY))
+                )
+                return True
+            return self.session.scalar(
+                select(func.pg_try_advisory_xact_lock(PRODUCT_INDEX_LOCK_KEY))
             )
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to lock product index sync (sync)")
+            logger.error(msg, exc_info=True)
+            raise
+
+    def get_ids(self) -> list[int]:
+        """id всех записей очереди, видимых на момент запроса"""
+        try:
+            return self.session.execute(select(ProductIndexOutbox.outbox_id)).scalars().all()
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to get product index changes ids (sync)")
+            logger.error(msg, exc_info=True)
+            raise
+
+    def delete(self, outbox_ids: list[int]) -> None:
+        """Удаление обработанных записей очереди (без коммита)"""
+        try:
+            query = delete(ProductIndexOutbox).where(ProductIndexOutbox.outbox_id.in_(outbox_ids))
+            self.session.execute(query)
+        except SQLAlchemyError as e:
+            msg = create_msg_db_error(e, "Failed to delete product index changes (sync)")
+            logger.error(msg, extra={"count": len(outbox_ids)}, exc_info=True)
             raise
 
 
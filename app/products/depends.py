@@ -3,10 +3,15 @@ from typing import Annotated
 from fastapi import Depends
 
 from app.database import SessionDep
-from app.elasticsearch.depends import ElasticsearchServiceDep
-from app.products.dao import CategoryDao, HistoryQueryTextDao, ProductDao
+from app.redis.depends import RedisClientDep
+from app.redis.services import ProductViewsService
+from app.products.cache import ProductCacheService
+from app.products.dao import (CategoryDao, HistoryQueryTextDao, ProductDao,
+                              ReviewDao)
 from app.products.services import (CategoryService, HistoryQueryTextService,
-                                   ProductService, SearchHistoryService)
+                                   ProductExportService, ProductService,
+                                   ReviewService, SearchHistoryService)
+from app.search.depends import SearchBackendDep
 
 
 def get_product_dao(session: SessionDep) -> ProductDao:
@@ -23,15 +28,59 @@ def get_category_dao(session: SessionDep) -> CategoryDao:
 CategoryDaoDep = Annotated[CategoryDao, Depends(get_category_dao)]
 
 
+def get_product_views_service(redis_client: RedisClientDep) -> ProductViewsService:
+    return ProductViewsService(redis_client)
+
+
+ProductViewsServiceDep = Annotated[
+    ProductViewsService, Depends(get_product_views_service)
+]
+
+
+def get_product_cache_service(redis_client: RedisClientDep) -> ProductCacheService:
+    return ProductCacheService(redis_client)
+
+
+ProductCacheServiceDep = Annotated[
+    ProductCacheService, Depends(get_product_cache_service)
+]
+
+
 def get_product_service(
-    session: SessionDep, product_dao: ProductDaoDep, category_dao: CategoryDaoDep
+    session: SessionDep,
+    product_dao: ProductDaoDep,
+    category_dao: CategoryDaoDep,
+    views_service: ProductViewsServiceDep,
+    cache_service: ProductCacheServiceDep,
 ) -> ProductService:
-    return ProductService(session, product_dao, category_dao)
+    return ProductService(
+        session, product_dao, category_dao, views_service, cache_service
+    )
 
 
 ProductServiceDep = Annotated[ProductService, Depends(get_product_service)]
 
 
+def get_review_service(
+    session: SessionDep,
+    product_dao: ProductDaoDep,
+    cache_service: ProductCacheServiceDep,
+) -> ReviewService:
+    return ReviewService(session, ReviewDao(session), product_dao, cache_service)
+
+
+ReviewServiceDep = Annotated[ReviewService, Depends(get_review_service)]
+
+
+def get_product_export_service() -> ProductExportService:
+    return ProductExportService()
+
+
+ProductExportServiceDep = Annotated[
+    ProductExportService, Depends(get_product_export_service)
+]
+
+
 def get_hqt_service(session: SessionDep):
     return HistoryQueryTextService(HistoryQueryTextDao(session))
 
@@ -43,10 +92,10 @@ HistoryQueryTextServiceDep = Annotated[
 
 def get_search_history_service(
     session: SessionDep,
-    el_service: ElasticsearchServiceDep,
+    search_backend: SearchBackendDep,
     hqt_service: HistoryQueryTextServiceDep,
 ) -> SearchHistoryService:
-    return SearchHistoryService(session, el_service, hqt_service)
+    return SearchHistoryService(session, search_backend, hqt_service)
 
 
 SearchHistoryServiceDep = Annotated[
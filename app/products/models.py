@@ -1,7 +1,8 @@
 from datetime import datetime
 from app.database import Base
 from sqlalchemy.orm import Mapped, mapped_column
-from sqlalchemy import String, ForeignKey, Float, Numeric, CheckConstraint, Index
+from sqlalchemy import (DDL, BigInteger, String, ForeignKey, Float, Numeric, CheckConstraint, Index,
+                        event, func, text)
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 
@@ -33,6 +34,9 @@ class Product(Base):
     rating: Mapped[float | None] = mapped_column(
         Float, CheckConstraint("rating > 0 and rating <= 5"), index=True, nullable=True
     )
+    # Сумма и количество оценок отзывов, обновляются вместе с отзывами (rating = sum / count)
+    rating_sum: Mapped[int] = mapped_column(default=0, server_default="0", nullable=False)
+    rating_count: Mapped[int] = mapped_column(default=0, server_default="0", nullable=False)
     description: Mapped[str] = mapped_column(String(1024), nullable=False)
     months_warranty: Mapped[int] = mapped_column(nullable=False)
     country_origin: Mapped[str] = mapped_column(String(128), nullable=False)
@@ -50,6 +54,38 @@ class Product(Base):
 
     __table_args__ = (
         Index("idx_specification_gin", "specification", postgresql_using="gin"),
+        # Составные индексы под курсорную пагинацию каталога: фильтр по категории + сортировка
+        Index("idx_products_category_product", "category_id", "product_id"),
+        Index("idx_products_category_price", "category_id", "price", "product_id"),
+        Index(
+            "idx_products_category_rating",
+            "category_id",
+            text("rating DESC NULLS LAST"),
+            text("product_id DESC"),
+        ),
+        Index(
+            "idx_products_category_views",
+            "category_id",
+            text("views DESC NULLS LAST"),
+            text("product_id DESC"),
+        ),
+        # Для order=asc: NULL по-прежнему в конце (ASC NULLS LAST), а обратный проход
+        # DESC-индекса дал бы NULLS FIRST, поэтому нужны отдельные индексы
+        Index("idx_products_category_rating_asc", "category_id", "rating", "product_id"),
+        Index("idx_products_category_views_asc", "category_id", "views", "product_id"),
+        # Триграммные индексы под ILIKE '%слово%' резервного поиска в postgres (pg_trgm)
+        Index(
+            "idx_products_title_trgm",
+            "title",
+            postgresql_using="gin",
+            postgresql_ops={"title": "gin_trgm_ops"},
+        ),
+        Index(
+            "idx_products_description_trgm",
+            "description",
+            postgresql_using="gin",
+            postgresql_ops={"description": "gin_trgm_ops"},
+        ),
     )
 
 
@@ -73,7 +109,7 @@ class Review(Base):
         default=datetime.now, nullable=True
     )
     date_updated: Mapped[datetime | None] = mapped_column(
-        default=datetime.now, onupdate=datetime.now, nullable=True
+        default=datetime.now, onupdate=datetime.now, index=True, nullable=True
     )
     is_edited: Mapped[bool] = mapped_column(default=False, nullable=False)
     rating: Mapped[int | None] = mapped_column(nullable=True)
@@ -102,6 +138,47 @@ class FavoriteProduct(Base):
         return f"<FavoriteProduct {self.user_id=} {self.product_id=}>"
 
 
+class CategoryTopProduct(Base):
+    """Самые популярные товары категории, кандидаты в рекомендации (пересчитываются в celery)"""
+
+    __tablename__ = "category_top_products"
+
+    category_id: Mapped[int] = mapped_column(
+        ForeignKey("categories.category_id", ondelete="CASCADE"), primary_key=True
+    )
+    position: Mapped[int] = mapped_column(primary_key=True)
+    product_id: Mapped[int] = mapped_column(
+        ForeignKey("products.product_id", ondelete="CASCADE"), nullable=False
+    )
+    rating: Mapped[float | None] = mapped_column(Float, nullable=True)
+    views: Mapped[int | None] = mapped_column(nullable=True)
+
+
+class UserFavoriteCategory(Base):
+    """Категории пользователя по числу избранных товаров в них (пересчитываются в celery)"""
+
+    __tablename__ = "user_favorite_categories"
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True
+    )
+    category_id: Mapped[int] = mapped_column(
+        ForeignKey("categories.category_id", ondelete="CASCADE"), primary_key=True
+    )
+    favorites_count: Mapped[int] = mapped_column(nullable=False)
+    position: Mapped[int] = mapped_column(nullable=False)
+
+    __table_args__ = (
+        Index("idx_user_favorite_categories_position", "user_id", "position"),
+        # Пользователи, у которых категория любимая (position = 1), для уведомлений о новых товарах
+        Index(
+            "idx_user_favorite_categories_top",
+            "category_id",
+            postgresql_where=text("position = 1"),
+        ),
+    )
+
+
 class HistoryQueryUser(Base):
     __tablename__ = "history_text_user"
 
@@ -112,3 +189,94 @@ class HistoryQueryUser(Base):
     query_text: Mapped[str] = mapped_column(String(32), index=True, nullable=False)
 
     # relationship_user = relationship('User', viewonly=True, lazy='joined')
+
+
+class SyncWatermark(Base):
+    """Отметки времени, до которых фоновые задачи уже обработали изменения"""
+
+    __tablename__ = "sync_watermarks"
+
+    name: Mapped[str] = mapped_column(String(64), primary_key=True)
+    value: Mapped[datetime] = mapped_column(nullable=False)
+
+
+class ProductViewsFlush(Base):
+    """
+    Переносы просмотров товаров из redis, уже записанные в products.views
+
+    Запись добавляется в одной транзакции с просмотрами, поэтому повторный перенос
+    того же hash (если его не удалось удалить из redis после коммита) пропускается
+    """
+
+    __tablename__ = "product_views_flushes"
+
+    flush_id: Mapped[str] = mapped_column(String(32), primary_key=True)
+    created_at: Mapped[datetime] = mapped_column(
+        server_default=func.now(), index=True, nullable=False
+    )
+
+
+class ProductIndexOutbox(Base):
+    """
+    Очередь изменений товаров для индекса elasticsearch
+
+    Заполняется триггером на products при любом изменении строки (в том числе из админки
+    и celery), разбирается задачей инкрементальной синхронизации индекса
+    """
+
+    __tablename__ = "product_index_outbox"
+
+    outbox_id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+    # Без внешнего ключа: запись об удалении товара должна пережить сам товар
+    product_id: Mapped[int] = mapped_column(nullable=False)
+    created_at: Mapped[datetime] = mapped_column(server_default=func.now(), nullable=False)
+
+
+PRODUCT_INDEX_OUTBOX_FUNCTION = DDL(
+    """
+    CREATE OR REPLACE FUNCTION products_index_outbox() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            INSERT INTO product_index_outbox (product_id) VALUES (OLD.product_id);
+            RETURN OLD;
+        END IF;
+        INSERT INTO product_index_outbox (product_id) VALUES (NEW.product_id);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql
+    """
+)
+
+PRODUCT_INDEX_OUTBOX_TRIGGERS = (
+    DDL(
+        """
+        CREATE TRIGGER products_index_outbox_insert_delete
+        AFTER INSERT OR DELETE ON products
+        FOR EACH ROW EXECUTE FUNCTION products_index_outbox()
+        """
+    ),
+    # В очередь попадают только изменения полей, которые ищутся или меняют выдачу. Частые
+    # служебные записи (views каждую минуту, rating_sum/rating_count на каждый отзыв) индекс
+    # не трогают, views в документах индекса обновляются только при других изменениях товара
+    DDL(
+        """
+        CREATE TRIGGER products_index_outbox_update
+        AFTER UPDATE ON products
+        FOR EACH ROW WHEN (
+            (OLD.title, OLD.description, OLD.category_id, OLD.specification, OLD.price,
+             OLD.rating, OLD.months_warranty, OLD.country_origin, OLD.sale_percent)
+            IS DISTINCT FROM
+            (NEW.title, NEW.description, NEW.category_id, NEW.specification, NEW.price,
+             NEW.rating, NEW.months_warranty, NEW.country_origin, NEW.sale_percent)
+        )
+        EXECUTE FUNCTION products_index_outbox()
+        """
+    ),
+)
+
+# Расширение для триграммных индексов products должно существовать до создания таблицы
+event.listen(Product.__table__, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+# Триггеры создаются вместе с таблицей (create_all в тестах), в бд - миграцией
+event.listen(Product.__table__, "after_create", PRODUCT_INDEX_OUTBOX_FUNCTION)
+for trigger in PRODUCT_INDEX_OUTBOX_TRIGGERS:
+    event.listen(Product.__table__, "after_create", trigger)
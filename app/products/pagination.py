@@ -0,0 +1,66 @@
+"""
+Курсорная (keyset) пагинация каталога и поиска товаров.
+
+Курсор - это base64 от пары (значение ключа сортировки, product_id) последнего товара
+на странице. Следующая страница начинается строго после этой пары, поэтому запрос
+идет по индексу и не зависит от глубины страницы (в отличие от OFFSET).
+В поиске курсор - движок поиска и значения sort последнего найденного документа
+для search_after: оценки разных движков несравнимы, поэтому курсор другого движка
+(например, после переключения elasticsearch на postgres) отклоняется, а не дает
+пропущенные или повторные страницы.
+"""
+
+import base64
+import json
+from decimal import Decimal
+
+CATALOG_PAGE_SIZE = 20
+CATALOG_MAX_PAGE_SIZE = 100
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Ключи сортировки и приведение значения из курсора к типу колонки
+SORT_FIELDS = {
+    "price": Decimal,
+    "rating": float,
+    "views": int,
+    "product_id": int,
+}
+
+
+def encode_cursor(value, product_id: int) -> str:
+    """Кодирует позицию последнего товара страницы в курсор"""
+    if isinstance(value, Decimal):
+        value = str(value)
+    raw = json.dumps([value, product_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort_by: str) -> tuple:
+    """Декодирует курсор в пару (значение ключа сортировки, product_id)"""
+    try:
+        value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if value is not None:
+            value = SORT_FIELDS[sort_by](value)
+        return value, int(product_id)
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Некорректный курсор пагинации") from e
+
+
+def encode_search_cursor(engine: str, sort_values: list) -> str:
+    """Кодирует движок поиска и значения sort последнего документа страницы в курсор"""
+    raw = json.dumps([engine, *sort_values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_search_cursor(cursor: str, engine: str) -> list:
+    """Декодирует курсор страницы поиска движка engine в значения для search_after"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError as e:
+        raise ValueError("Некорректный курсор пагинации") from e
+    if not isinstance(values, list) or len(values) < 2:
+        raise ValueError("Некорректный курсор пагинации")
+    if values[0] != engine:
+        raise ValueError("Курсор выдан другим поисковым движком, начните поиск с первой страницы")
+    return values[1:]
@@ -0,0 +1,98 @@
+"""
+Популярные товары для новых пользователей в памяти процесса.
+
+Список одинаков для всех, поэтому каждый воркер загружает его при старте и держит в памяти,
+ручка отдает его без обращения к бд. Список перезагружается раз в
+POPULAR_PRODUCTS_REFRESH_SEC и сразу после сообщения в канал POPULAR_PRODUCTS_CHANNEL,
+которое публикует celery после пересчета рейтингов и кандидатов в рекомендации.
+"""
+
+import asyncio
+import time
+
+from redis import Redis as SyncRedis
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.database import session_maker
+from app.logger import logger
+from app.products.dao import ProductDao
+from app.products.schema import ProductResponseSchema
+
+POPULAR_PRODUCTS_CHANNEL = "popular_products_refresh"
+POPULAR_PRODUCTS_REFRESH_SEC = 300
+# Через сколько повторять загрузку пустого списка (пустой каталог или ошибка бд)
+POPULAR_PRODUCTS_RETRY_SEC = 30
+
+
+class PopularProducts:
+    def __init__(self, session_factory=session_maker):
+        self.session_factory = session_factory
+        self.products: list[dict] = []
+        # Время последней попытки загрузки (time.monotonic), None - загрузки еще не было
+        self.loaded_at: float | None = None
+
+    async def load(self) -> None:
+        """Загрузка списка из бд, при ошибке остается предыдущий список"""
+        self.loaded_at = time.monotonic()
+        try:
+            async with self.session_factory() as session:
+                rows = await ProductDao(session).get_recomentation_for_new_user()
+            self.products = [
+                ProductResponseSchema.model_validate(dict(row)).model_dump(mode="json")
+                for row in rows
+            ]
+            logger.debug("Popular products loaded", extra={"count": len(self.products)})
+        except Exception:
+            logger.error("Failed to load popular products", exc_info=True)
+
+    async def get(self) -> list[dict]:
+        """
+        Список из памяти
+
+        В бд идет, только если список пуст: еще не загружался или с прошлой попытки
+        прошло POPULAR_PRODUCTS_RETRY_SEC (иначе пустой каталог или упавшая бд
+        давали бы запрос на каждый вызов)
+        """
+        if not self.products and (
+            self.loaded_at is None
+            or time.monotonic() - self.loaded_at >= POPULAR_PRODUCTS_RETRY_SEC
+        ):
+            await self.load()
+        return self.products
+
+
+popular_products = PopularProducts()
+
+
+async def keep_popular_products_fresh(
+    redis_client: Redis, popular: PopularProducts = popular_products
+):
+    """
+    Фоновая задача воркера: перезагрузка списка по сообщению в канале или по таймауту
+
+    Запускается в lifespan после первой загрузки
+    """
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(POPULAR_PRODUCTS_CHANNEL)
+                logger.debug("Subscribed to popular products refresh")
+                while True:
+                    await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=POPULAR_PRODUCTS_REFRESH_SEC
+                    )
+                    await popular.load()
+        except RedisError:
+            logger.warning("Popular products subscription lost", exc_info=True)
+            await popular.load()
+            await asyncio.sleep(1)
+
+
+# Синхронный вариант для celery
+def notify_popular_products_sync(redis_client: SyncRedis) -> None:
+    """Просит все воркеры перезагрузить список популярных товаров"""
+    try:
+        redis_client.publish(POPULAR_PRODUCTS_CHANNEL, 1)
+    except RedisError:
+        logger.error("Failed to publish popular products refresh", exc_info=True)
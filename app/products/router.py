@@ -1,17 +1,29 @@
 import functools
-from typing import Annotated
+from typing import Annotated, Literal
 
 from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi_cache.decorator import cache
 
 from app.database import SessionDep, get_session
-from app.elasticsearch.depends import ElasticsearchServiceDep
 from app.products.depends import (CategoryServiceDep,
                                   HistoryQueryTextServiceDep, ProductDaoDep,
-                                  ProductServiceDep, SearchHistoryServiceDep)
-from app.products.schema import (HistoryQueryUserSchema, ProductResponseSchema,
-                                 ProductSchema)
+                                  ProductExportServiceDep, ProductServiceDep,
+                                  ReviewServiceDep, SearchHistoryServiceDep)
+from app.products.pagination import (CATALOG_MAX_PAGE_SIZE, CATALOG_PAGE_SIZE,
+                                     SEARCH_MAX_PAGE_SIZE, SEARCH_PAGE_SIZE)
+from app.products.popular import popular_products
+from app.products.schema import (CatalogFacetsSchema, HistoryQueryUserSchema,
+                                 ProductPageSchema, ProductResponseSchema,
+                                 ProductSchema, ReviewResponseSchema,
+                                 ProductSuggestSchema, ReviewSchema,
+                                 ReviewUpdateSchema, SearchPageSchema)
 from app.products.services import ProductService
+from app.redis.cache import (RECOMMENDATION_TAG, SEARCH_TAG, category_tag,
+                             coalesced_cache, normalize_price_range,
+                             normalize_search_text, tagged_key_builder,
+                             user_tag)
+from app.search.depends import SearchBackendDep
 from app.users.depends import CurrentUserDep
 from app.users.services import UserService
 
@@ -21,22 +33,57 @@ router = APIRouter(prefix="/products", tags=["Работа с товарами"]
 @router.get(
     "/search_products/{query_text}", summary="Поиск товаров по текстовому запросу"
 )
-@cache(expire=180)
+@coalesced_cache(
+    expire=900,
+    key_builder=tagged_key_builder(
+        lambda kwargs: SEARCH_TAG, normalizers={"query_text": normalize_search_text}
+    ),
+)
 async def search_products(
-    query_text: str, el_service: ElasticsearchServiceDep
-) -> list[ProductResponseSchema]:
+    query_text: str,
+    search_backend: SearchBackendDep,
+    cursor: str = Query(None),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    with_total: bool = Query(False),
+) -> SearchPageSchema:
     """
     Поиск товаров по текстовому запросу
 
-    Осуществляет поиск товаров в системе по переданному текстовому запросу
+    Осуществляет поиск товаров в системе по переданному текстовому запросу.
+    Пагинация курсорная: для следующей страницы нужно передать next_cursor из ответа
 
     Args:
         query_text: текст для поиска товаров
+        cursor: курсор страницы из next_cursor предыдущего ответа
+        limit: размер страницы
+        with_total: посчитать общее количество найденных товаров (дороже)
+
+    Returns:
+        Страница найденных товаров и курсор следующей страницы
+    """
+    return await search_backend.search_products(
+        query_text, limit=limit, cursor=cursor, with_total=with_total
+    )
+
+
+@router.get("/suggest", summary="Подсказки товаров при наборе запроса")
+async def suggest_products(
+    search_backend: SearchBackendDep,
+    q: str = Query(min_length=1, max_length=64),
+) -> list[ProductSuggestSchema]:
+    """
+    Подсказки товаров при наборе поискового запроса
+
+    Ищет по началу слов названия и отдает только id и названия товаров,
+    частые префиксы отдаются из памяти процесса
+
+    Args:
+        q: набранная часть запроса
 
     Returns:
-        Список найденных товаров
+        Список id и названий подходящих товаров
     """
-    return await el_service.search_products(query_text)
+    return await search_backend.suggest_products(q)
 
 
 @router.post(
@@ -48,18 +95,30 @@ async def search_products_with_history(
     query_text: str,
     search_history_service: SearchHistoryServiceDep,
     user: CurrentUserDep,
-) -> list[ProductResponseSchema]:
+    cursor: str = Query(None),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    with_total: bool = Query(False),
+) -> SearchPageSchema:
     """
     Поиск товаров по текстовому запросу с добавлением запроса в историю
 
+    В историю запрос добавляется только при получении первой страницы
+
     Args:
         query_text: текст для поиска товаров
+        cursor: курсор страницы из next_cursor предыдущего ответа
+        limit: размер страницы
+        with_total: посчитать общее количество найденных товаров (дороже)
 
     Returns:
-        Список найденных товаров
+        Страница найденных товаров и курсор следующей страницы
     """
     return await search_history_service.search_product(
-        user_id=user.user_id, query=query_text
+        user_id=user.user_id,
+        query=query_text,
+        limit=limit,
+        cursor=cursor,
+        with_total=with_total,
     )
 
 
@@ -70,10 +129,42 @@ async def get_history_queries(
     return await hqt_service.get_history(user.user_id)
 
 
+@router.get(
+    "/catalog/{category}/facets",
+    summary="Количество товаров категории по значениям фильтров",
+)
+@coalesced_cache(
+    expire=3600,
+    key_builder=tagged_key_builder(lambda kwargs: category_tag(kwargs["category"])),
+)
+async def get_catalog_facets(
+    product_dao: ProductDaoDep, category: str
+) -> CatalogFacetsSchema:
+    """
+    Получение счетчиков для панели фильтров каталога
+
+    Возвращает количество товаров категории по стране производства, гарантии,
+    рейтингу (в значениях фильтра rating), диапазонам цены и значениям характеристик
+
+    Args:
+        category: категория товаров
+
+    Returns:
+        Счетчики товаров по значениям фильтров
+    """
+    return CatalogFacetsSchema.model_validate(await product_dao.get_facets(category))
+
+
 @router.get(
     "/catalog/{category}/", summary="Получение товаров по категории с фильтрами"
 )
-@cache(expire=180)
+@coalesced_cache(
+    expire=3600,
+    key_builder=tagged_key_builder(
+        lambda kwargs: category_tag(kwargs["category"]),
+        normalizers={"price": normalize_price_range},
+    ),
+)
 async def get_products(
     request: Request,
     product_dao: ProductDaoDep,
@@ -82,12 +173,17 @@ async def get_products(
     rating: float = Query(None),
     months_warranty: int = Query(None),
     country_origin: str = Query(None),
-) -> list[ProductResponseSchema]:
+    sort_by: Literal["price", "rating", "views", "product_id"] = Query("product_id"),
+    order: Literal["asc", "desc"] = Query("asc"),
+    cursor: str = Query(None),
+    limit: int = Query(CATALOG_PAGE_SIZE, ge=1, le=CATALOG_MAX_PAGE_SIZE),
+) -> ProductPageSchema:
     """
-    Получение товаров по категории с применением фильтров
+    Получение страницы товаров по категории с применением фильтров
 
-    Возвращает список товаров указанной категории с возможностью фильтрации
-    по цене, рейтингу, гарантии, стране производства и дополнительным характеристикам
+    Возвращает страницу товаров указанной категории с возможностью фильтрации
+    по цене, рейтингу, гарантии, стране производства и дополнительным характеристикам.
+    Пагинация курсорная: для следующей страницы нужно передать next_cursor из ответа
 
     Args:
         category: категория товаров
@@ -95,22 +191,44 @@ async def get_products(
         rating: фильтр по рейтингу
         months_warranty: фильтр по сроку гарантии
         country_origin: фильтр по стране производства
-        **specification_filters: фильтр по характеристиками товара (могут быть любыми, не заданы жестко)
+        sort_by: ключ сортировки (price, rating, views, product_id)
+        order: направление сортировки (asc, desc)
+        cursor: курсор страницы из next_cursor предыдущего ответа
+        limit: размер страницы
+        **specification_filters: фильтр по характеристиками товара (могут быть любыми, не заданы жестко),
+            для числовых ключей из range_filters схемы категории - диапазон start-end, start- или -end
 
     Returns:
-        Список товаров соответствующих фильтрам
+        Страница товаров соответствующих фильтрам и курсор следующей страницы
     """
-    def_par = {"category", "price", "rating", "months_warranty", "country_origin"}
+    def_par = {
+        "category",
+        "price",
+        "rating",
+        "months_warranty",
+        "country_origin",
+        "sort_by",
+        "order",
+        "cursor",
+        "limit",
+    }
     specification_filters = {
         k: el for k, el in request.query_params.items() if k not in def_par
     }
-    return await product_dao.get_with_filters(
+    products, next_cursor = await product_dao.get_with_filters(
         category=category,
         price=price,
         rating=rating,
         months_warranty=months_warranty,
         country_origin=country_origin,
         specification_filters=specification_filters,
+        sort_by=sort_by,
+        order=order,
+        cursor=cursor,
+        limit=limit,
+    )
+    return ProductPageSchema.model_validate(
+        {"items": products, "next_cursor": next_cursor}, from_attributes=True
     )
 
 
@@ -134,11 +252,71 @@ async def add_product(
         200: Товар успешно добавлен
     """
     await product_service.add_product(product, user, flag_notification=True)
-    await session.commit()
+
+
+@router.post("/{product_id}/reviews", summary="Добавление отзыва о товаре")
+async def add_review(
+    product_id: int,
+    review: ReviewSchema,
+    user: CurrentUserDep,
+    review_service: ReviewServiceDep,
+) -> ReviewResponseSchema:
+    """
+    Добавление отзыва о товаре
+
+    Рейтинг товара пересчитывается сразу вместе с добавлением отзыва
+
+    Args:
+        product_id: id товара
+        review: данные отзыва
+
+    Returns:
+        Добавленный отзыв
+    """
+    return await review_service.add_review(product_id, user.user_id, review)
+
+
+@router.patch("/reviews/{review_id}", summary="Изменение своего отзыва")
+async def update_review(
+    review_id: int,
+    review: ReviewUpdateSchema,
+    user: CurrentUserDep,
+    review_service: ReviewServiceDep,
+) -> ReviewResponseSchema:
+    """
+    Изменение своего отзыва
+
+    Args:
+        review_id: id отзыва
+        review: изменяемые поля отзыва
+
+    Returns:
+        Измененный отзыв
+    """
+    return await review_service.update_review(review_id, user.user_id, review)
+
+
+@router.delete("/reviews/{review_id}", summary="Удаление своего отзыва")
+async def delete_review(
+    review_id: int, user: CurrentUserDep, review_service: ReviewServiceDep
+):
+    """
+    Удаление своего отзыва
+
+    Args:
+        review_id: id отзыва
+    """
+    await review_service.delete_review(review_id, user.user_id)
 
 
 @router.get("/recomendation", summary="Получение рекомендаций")
-@cache(expire=30)
+@coalesced_cache(
+    expire=600,
+    key_builder=tagged_key_builder(
+        lambda kwargs: user_tag(kwargs["user"].user_id),
+        lambda kwargs: RECOMMENDATION_TAG,
+    ),
+)
 async def recomendation(
     user: CurrentUserDep, product_service: ProductServiceDep
 ) -> list[ProductResponseSchema]:
@@ -157,16 +335,42 @@ async def recomendation(
     return await product_service.recomendation(user.user_id)
 
 
+@router.get("/popular", summary="Популярные товары для новых пользователей")
+async def popular() -> list[ProductResponseSchema]:
+    """
+    Получение популярных товаров для новых и неавторизованных пользователей
+
+    Список одинаков для всех и отдается из памяти процесса без обращения к бд
+
+    Returns:
+        Список популярных товаров
+    """
+    return await popular_products.get()
+
+
 @router.get("/all", summary="Получение всех товаров")
-async def all(product_dao: ProductDaoDep) -> list[ProductResponseSchema]:
+async def all(
+    product_dao: ProductDaoDep,
+    export_service: ProductExportServiceDep,
+    stream: bool = Query(False),
+) -> list[ProductResponseSchema]:
     """
     Получение полного списка всех товаров
 
-    Возвращает все товары, доступные в системе
+    Возвращает все товары, доступные в системе.
+    При stream=true товары отдаются потоком в формате NDJSON (application/x-ndjson),
+    по одному товару в строке, без загрузки всей таблицы в память
+
+    Args:
+        stream: потоковая выгрузка в NDJSON
 
     Returns:
         Список всех товаров
     """
+    if stream:
+        return StreamingResponse(
+            export_service.stream_ndjson(), media_type="application/x-ndjson"
+        )
     return await product_dao.all()
 
 
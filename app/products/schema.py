@@ -1,7 +1,8 @@
+from datetime import datetime
 from json import dumps
 from typing import Optional
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from sqlalchemy.dialects.postgresql import JSONB
 
 
@@ -32,6 +33,30 @@ class ProductResponseSchema(BaseModel):
     views: Optional[int] = None
 
 
+class ProductPageSchema(BaseModel):
+    items: list[ProductResponseSchema]
+    next_cursor: Optional[str] = None
+
+
+class SearchPageSchema(BaseModel):
+    items: list[ProductResponseSchema]
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+
+class ProductSuggestSchema(BaseModel):
+    product_id: int
+    title: str
+
+
+class CatalogFacetsSchema(BaseModel):
+    country_origin: dict[str, int]
+    months_warranty: dict[int, int]
+    rating: dict[int, int]
+    price: dict[str, int]
+    specification: dict[str, dict[str, int]]
+
+
 class ProductReturnSchema(BaseModel):
     product_id: int
     title: str
@@ -46,6 +71,44 @@ class ProductReturnSchema(BaseModel):
     views: Optional[int] = None
 
 
+class ReviewSchema(BaseModel):
+    months_used: int = Field(ge=0)
+    positive: str = Field(max_length=512)
+    negative: str = Field(max_length=512)
+    comment: str = Field(max_length=1024)
+    rating: Optional[int] = Field(None, ge=1, le=5)
+
+
+class ReviewUpdateSchema(BaseModel):
+    months_used: Optional[int] = Field(None, ge=0)
+    positive: Optional[str] = Field(None, max_length=512)
+    negative: Optional[str] = Field(None, max_length=512)
+    comment: Optional[str] = Field(None, max_length=1024)
+    rating: Optional[int] = Field(None, ge=1, le=5)
+
+    @field_validator("months_used", "positive", "negative", "comment")
+    @classmethod
+    def validate_not_null(cls, value):
+        # Поле можно не передавать, но null для обязательных колонок отзыва недопустим
+        if value is None:
+            raise ValueError("Поле не может быть null")
+        return value
+
+
+class ReviewResponseSchema(BaseModel):
+    review_id: int
+    product_id: int
+    user_id: int
+    months_used: int
+    positive: str
+    negative: str
+    comment: str
+    date_posted: Optional[datetime] = None
+    date_updated: Optional[datetime] = None
+    is_edited: bool
+    rating: Optional[int] = None
+
+
 class HistoryQueryUserSchema(BaseModel):
     history_text_user_id: int
     user_id: int
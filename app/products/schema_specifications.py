@@ -2,11 +2,15 @@
 Файл с моделями pydantic, валидация которых используется при добавлении товара.
 через specification_schemas_dict возвращается нужная схема, по которой проходит валидация
 поля specification продукта
+
+Числовые ключи из Settings.range_filters можно фильтровать диапазоном (screen_size=50-65),
+для каждого такого ключа на products заводится индекс по выражению (category_id, specification -> key)
 """
 
 from typing import Literal
 
 from pydantic import BaseModel, Field
+from sqlalchemy import Index
 
 from app.products.models import Product
 
@@ -32,8 +36,30 @@ class TvSchema(BaseModel):
             "has_hdr": "0 or 1",
             "year": "int >= 1950",
         }
+        range_filters = ("screen_size", "hdmi_ports", "refresh_rate", "year")
 
 
 specification_schemas_dict = {
     TvSchema.__name__: TvSchema,
 }
+
+
+def _range_filter_keys() -> set[str]:
+    """Ключи характеристик с фильтрами по диапазону, ключи должны быть числовыми"""
+    keys = set()
+    for schema in specification_schemas_dict.values():
+        for key in getattr(schema.Settings, "range_filters", ()):
+            annotation = schema.model_fields[key].annotation
+            if annotation not in (int, float):
+                raise TypeError(f"Фильтр по диапазону для нечислового ключа {schema.__name__}.{key}")
+            keys.add(key)
+    return keys
+
+
+SPECIFICATION_RANGE_KEYS = _range_filter_keys()
+
+# jsonb сравнивает числа как числа, поэтому приведение к numeric не нужно. Значения других
+# типов не попадают только в закрытый диапазон: открытый (start- или -end) по порядку типов jsonb
+# захватывает строки или bool/массивы/объекты, поэтому фильтр дополнительно проверяет jsonb_typeof
+for _key in sorted(SPECIFICATION_RANGE_KEYS):
+    Index(f"idx_products_spec_{_key}", Product.category_id, Product.specification[_key])
@@ -1,53 +1,151 @@
+from datetime import datetime, timedelta
+
 from fastapi import HTTPException, status
 from pydantic import ValidationError
-from sqlalchemy import update
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.elasticsearch.services import ElasticsearchService
+from app.database import session_maker
 from app.logger import logger
+from app.products.cache import ProductCacheService
 from app.products.dao import (CategoryDao, HistoryQueryTextDao, ProductDao,
-                              ProductSyncDao, ReviewSyncDao)
-from app.products.models import Category, Product
-from app.products.schema import ProductSchema
+                              ProductSyncDao, ProductViewsFlushSyncDao,
+                              ReviewDao, WatermarkSyncDao)
+from app.products.models import Category, Product, Review
+from app.products.pagination import SEARCH_PAGE_SIZE
+from app.products.popular import popular_products
+from app.products.schema import (ProductResponseSchema, ProductSchema,
+                                 ReviewSchema, ReviewUpdateSchema)
 from app.products.schema_specifications import specification_schemas_dict
-from app.tasks.email_tasks import send_email_about_new_product
+from app.redis.cache import category_tag, invalidate_cache_tags
+from app.redis.services import ProductViewsService, ProductViewsSyncService
+from app.search.backend import SearchBackend
+from app.tasks.email_tasks import send_emails_about_new_product
 from app.users.schema import UserSchema
 
+AVG_REVIEWS_WATERMARK = "update_avg_reviews"
+AVG_REVIEWS_WATERMARK_LAG = timedelta(minutes=5)
+# Сколько хранятся отметки записанных переносов просмотров из redis
+PRODUCT_VIEWS_FLUSHES_KEEP = timedelta(days=1)
+
+# Сколько писем о новом товаре отправляет одна задача celery через одно SMTP соединение
+NEW_PRODUCT_EMAILS_CHUNK_SIZE = 100
+
 
 class ProductServiceSync:
     def __init__(
-        self, product_sync_dao: ProductSyncDao, review_sync_dao: ReviewSyncDao
+        self, product_sync_dao: ProductSyncDao, watermark_sync_dao: WatermarkSyncDao
     ):
         self.product_sync_dao = product_sync_dao
-        self.review_sync_dao = review_sync_dao
+        self.watermark_sync_dao = watermark_sync_dao
 
-    def update_reviews(self):
+    def update_reviews(self, full: bool = False):
         """
-        Обновление средних оценок у товаров
+        Сверка средних оценок у товаров с отзывами
 
-        Высчитываются средние оценки товаров из отзывов на товары и сохраняются в поле оценок у товаров.
+        Рейтинг обновляется при записи отзыва (ReviewService), здесь исправляются
+        расхождения от изменений в обход сервиса. Проверяются только товары, отзывы которых изменились с прошлого запуска
+        (с запасом AVG_REVIEWS_WATERMARK_LAG на отзывы, закоммиченные позже своего времени),
+        full=True - все товары. Возвращает id товаров, у которых оценка изменилась.
         Функция написана синхронно, так как она должна запускаться фоном в celery
         """
         try:
-            logger.info("Starting reviews update (sync)")
-            avg_reviews = self.review_sync_dao.rating_of_products()
-            self.product_sync_dao.update_avg_reviews(avg_reviews)
+            logger.info("Starting reviews update (sync)", extra={"full": full})
+            started_at = datetime.now()
+            watermark = None if full else self.watermark_sync_dao.get(AVG_REVIEWS_WATERMARK)
+            since = watermark - AVG_REVIEWS_WATERMARK_LAG if watermark else None
+            changed_product_ids = self.product_sync_dao.update_avg_reviews(since)
+            self.watermark_sync_dao.set(AVG_REVIEWS_WATERMARK, started_at)
             logger.info(
-                "Reviews updated successfully (sync)", extra={"count": len(avg_reviews)}
+                "Reviews updated successfully (sync)",
+                extra={"since": since, "changed_count": len(changed_product_ids)},
             )
+            return changed_product_ids
         except Exception as e:
             logger.error("Failed to update reviews (sync)", exc_info=True)
             raise
 
 
+class ProductViewsServiceSync:
+    def __init__(
+        self,
+        product_sync_dao: ProductSyncDao,
+        flush_sync_dao: ProductViewsFlushSyncDao,
+        views_sync_service: ProductViewsSyncService,
+    ):
+        self.product_sync_dao = product_sync_dao
+        self.flush_sync_dao = flush_sync_dao
+        self.views_sync_service = views_sync_service
+
+    def flush_views(self):
+        """
+        Перенос накопленных в redis просмотров товаров в бд
+
+        Переносы идут по одному под advisory-блокировкой. Все приросты записываются
+        одним UPDATE в одной транзакции с отметкой id переноса, после коммита они
+        удаляются из redis. Если удаление не прошло, следующий перенос по отметке видит,
+        что приросты уже записаны, и не учитывает их дважды.
+        Функция написана синхронно, так как она должна запускаться фоном в celery
+        """
+        self.flush_sync_dao.lock()
+        flush_id, deltas = self.views_sync_service.take_deltas()
+        if not deltas:
+            return 0
+        if not self.flush_sync_dao.add(flush_id):
+            logger.warning("Product views already flushed, acking", extra={"flush_id": flush_id})
+            self.views_sync_service.ack_deltas()
+            return 0
+        self.product_sync_dao.add_views(deltas)
+        self.flush_sync_dao.delete_older_than(datetime.now() - PRODUCT_VIEWS_FLUSHES_KEEP)
+        self.product_sync_dao.session.commit()
+        self.views_sync_service.ack_deltas()
+        return len(deltas)
+
+
+# Синхронный вариант для celery
+class RecommendationCandidatesServiceSync:
+    def __init__(self, product_sync_dao: ProductSyncDao):
+        self.product_sync_dao = product_sync_dao
+
+    def refresh(
+        self, category_ids: list[int] | None = None, user_ids: list[int] | None = None
+    ) -> None:
+        """
+        Пересчет таблиц кандидатов в рекомендации
+
+        Пересчитываются только переданные категории и пользователи. Если не передано
+        ни то, ни другое, таблицы пересчитываются полностью
+        """
+        rebuild = category_ids is None and user_ids is None
+        if rebuild or category_ids:
+            self.product_sync_dao.refresh_category_top_products(
+                None if rebuild else category_ids
+            )
+        if rebuild or user_ids:
+            self.product_sync_dao.refresh_user_favorite_categories(
+                None if rebuild else user_ids
+            )
+        self.product_sync_dao.session.commit()
+        logger.info(
+            "Recommendation candidates refreshed",
+            extra={"rebuild": rebuild, "category_ids": category_ids, "user_ids": user_ids},
+        )
+
+
 class ProductService:
     def __init__(
-        self, session: AsyncSession, product_dao: ProductDao, category_dao: CategoryDao
+        self,
+        session: AsyncSession,
+        product_dao: ProductDao,
+        category_dao: CategoryDao,
+        views_service: ProductViewsService,
+        cache_service: ProductCacheService,
     ):
         self.product_dao = product_dao
         self.category_dao = category_dao
         self.session = session
+        self.views_service = views_service
+        self.cache_service = cache_service
 
     @staticmethod
     def _validate_seller(user: UserSchema):
@@ -62,8 +160,8 @@ class ProductService:
                 detail="Нет прав для доступа к этому ресурсу",
             )
 
-    async def _get_class_name(self, product: ProductSchema):
-        """Получает название класса для валидации категории"""
+    async def _get_category(self, product: ProductSchema) -> Category:
+        """Получает категорию товара (название класса для валидации и название для тегов кэша)"""
         try:
             category_row: Category = await self.category_dao.find_by_filter_one(
                 category_id=product.category_id
@@ -82,7 +180,7 @@ class ProductService:
                     "class_name": category_row.class_name,
                 },
             )
-            return category_row.class_name
+            return category_row
         except HTTPException:
             raise
         except Exception as e:
@@ -136,15 +234,16 @@ class ProductService:
                 detail="Ошибка при валидации характеристик",
             )
 
-    async def _add(self, product: ProductSchema):
-        """Переводит в dict для возможности добавить товар"""
+    async def _add(self, product: ProductSchema) -> int:
+        """Переводит в dict для возможности добавить товар, возвращает id товара"""
         try:
             product_dict = product.model_dump()
-            await self.product_dao.add(**product_dict)
+            product_id = await self.product_dao.add_and_return_id(**product_dict)
             logger.info(
                 "Product added to database",
                 extra={"title": product.title, "price": product.price},
             )
+            return product_id
         except Exception as e:
             logger.error(
                 "Failed to add product to database",
@@ -180,9 +279,12 @@ class ProductService:
             )
 
             self._validate_seller(user)
-            class_name_for_validate = await self._get_class_name(product)
-            self._validate_specification(product, class_name_for_validate)
-            await self._add(product)
+            category = await self._get_category(product)
+            self._validate_specification(product, category.class_name)
+            product_id = await self._add(product)
+            await self.session.commit()
+
+            await invalidate_cache_tags(category_tag(category.title))
 
             if flag_notification:
                 logger.info(
@@ -191,9 +293,11 @@ class ProductService:
                 user_emails = await self.product_dao.get_user_emails_for_send_emails_about_new_product(
                     product
                 )
-                for email in user_emails:
-                    send_email_about_new_product.delay(
-                        email, title=product.title, price=product.price
+                for i in range(0, len(user_emails), NEW_PRODUCT_EMAILS_CHUNK_SIZE):
+                    send_emails_about_new_product.delay(
+                        user_emails[i : i + NEW_PRODUCT_EMAILS_CHUNK_SIZE],
+                        title=product.title,
+                        price=product.price,
                     )
                 logger.info(
                     "Email notifications scheduled",
@@ -208,6 +312,7 @@ class ProductService:
                 extra={"title": product.title, "user_id": user.user_id},
                 exc_info=True,
             )
+            await self.session.rollback()
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Ошибка при добавлении продукта",
@@ -219,32 +324,14 @@ class ProductService:
 
         Получение рекомендаций с фильтрацией по средней цене купленных товаров пользователем,
         если есть покупки. Если не было, то без фильтрации по средней цене.
-        Если пользователь без статистики, то выводятся просто популярные товары
+        У пользователя без избранного рекомендации - просто популярные товары,
+        они отдаются из памяти процесса (popular_products) без запроса рекомендаций в бд
         """
         try:
             logger.debug("Getting recommendations", extra={"user_id": user_id})
-
-            favorite_products = await self.product_dao.favorite_products(user_id)
-            if not favorite_products:
-                logger.info(
-                    "User has no favorites, using popular products",
-                    extra={"user_id": user_id},
-                )
-                return await self.product_dao.get_recomentation_for_new_user()
-
-            avg_price = await self.product_dao.avg_price(user_id)
-            if avg_price:
-                logger.info(
-                    "Using recommendations with avg price",
-                    extra={"user_id": user_id, "avg_price": avg_price},
-                )
-                return await self.product_dao.get_recomentation_with_avg_price(
-                    user_id, avg_price
-                )
-            else:
-                logger.info("Using general recommendations", extra={"user_id": user_id})
-                return await self.product_dao.get_recomentation(user_id)
-
+            if not await self.product_dao.has_favorites(user_id):
+                return await popular_products.get()
+            return await self.product_dao.get_recommendations(user_id)
         except HTTPException:
             raise
         except Exception as e:
@@ -259,30 +346,36 @@ class ProductService:
             )
 
     async def get_product_by_id(self, product_id):
-        """Получение продукта по id с повышением числа просмотров"""
+        """
+        Получение продукта по id с повышением числа просмотров
+
+        Товар читается через кэш (память процесса -> redis -> бд).
+        Просмотр только засчитывается в счетчик redis, в бд просмотры переносятся
+        фоновой задачей, поэтому само чтение товара не пишет в бд
+        """
         try:
             logger.debug("Getting product by id", extra={"product_id": product_id})
 
-            product = await self.product_dao.find_by_id(product_id)
-            if not product:
-                logger.warning("Product not found", extra={"product_id": product_id})
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Продукта с таким id не существует",
-                )
+            product = await self.cache_service.get(product_id)
+            if product is None:
+                cache_version = await self.cache_service.get_version(product_id)
+                product_row = await self.product_dao.find_by_id(product_id)
+                if not product_row:
+                    logger.warning("Product not found", extra={"product_id": product_id})
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND,
+                        detail="Продукта с таким id не существует",
+                    )
+                product = ProductResponseSchema.model_validate(
+                    product_row, from_attributes=True
+                ).model_dump(mode="json")
+                await self.cache_service.set(product_id, product, cache_version)
 
-            product.views += 1
-            query_update = (
-                update(Product)
-                .where(Product.product_id == product_id)
-                .values(views=product.views)
-            )
-            await self.session.execute(query_update)
-            await self.session.commit()
+            await self.views_service.incr(product_id)
 
             logger.info(
-                "Product retrieved and views incremented",
-                extra={"product_id": product_id, "views": product.views},
+                "Product retrieved and view counted",
+                extra={"product_id": product_id},
             )
             return product
 
@@ -294,13 +387,170 @@ class ProductService:
                 extra={"product_id": product_id},
                 exc_info=True,
             )
-            await self.session.rollback()
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Ошибка при получении продукта",
             )
 
 
+class ReviewService:
+    def __init__(
+        self,
+        session: AsyncSession,
+        review_dao: ReviewDao,
+        product_dao: ProductDao,
+        cache_service: ProductCacheService,
+    ):
+        self.session = session
+        self.review_dao = review_dao
+        self.product_dao = product_dao
+        self.cache_service = cache_service
+
+    async def add_review(self, product_id: int, user_id: int, review: ReviewSchema) -> Review:
+        """
+        Добавление отзыва
+
+        Сумма и количество оценок товара меняются в той же транзакции, что и отзыв,
+        поэтому рейтинг товара сразу точный
+        """
+        try:
+            product = await self._apply_rating_delta(product_id, review.rating, None)
+            review_row = await self.review_dao.add_review(
+                product_id, user_id, **review.model_dump()
+            )
+            await self.session.commit()
+            logger.info(
+                "Review added",
+                extra={"review_id": review_row.review_id, "product_id": product_id},
+            )
+        except HTTPException:
+            await self.session.rollback()
+            raise
+        except Exception:
+            logger.error(
+                "Failed to add review",
+                extra={"product_id": product_id, "user_id": user_id},
+                exc_info=True,
+            )
+            await self.session.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при добавлении отзыва",
+            )
+        await self._invalidate(product)
+        return review_row
+
+    async def update_review(
+        self, review_id: int, user_id: int, review: ReviewUpdateSchema
+    ) -> Review:
+        """Изменение своего отзыва с пересчетом рейтинга товара в той же транзакции"""
+        try:
+            review_row = await self._get_user_review(review_id, user_id)
+            data = review.model_dump(exclude_unset=True)
+            product = await self._apply_rating_delta(
+                review_row.product_id, data.get("rating", review_row.rating), review_row.rating
+            )
+            review_row = await self.review_dao.update_review(review_id, **data)
+            await self.session.commit()
+            logger.info("Review updated", extra={"review_id": review_id})
+        except HTTPException:
+            await self.session.rollback()
+            raise
+        except Exception:
+            logger.error("Failed to update review", extra={"review_id": review_id}, exc_info=True)
+            await self.session.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при изменении отзыва",
+            )
+        await self._invalidate(product)
+        return review_row
+
+    async def delete_review(self, review_id: int, user_id: int) -> None:
+        """Удаление своего отзыва с пересчетом рейтинга товара в той же транзакции"""
+        try:
+            review_row = await self._get_user_review(review_id, user_id)
+            product = await self._apply_rating_delta(
+                review_row.product_id, None, review_row.rating
+            )
+            await self.review_dao.delete_review(review_id)
+            await self.session.commit()
+            logger.info("Review deleted", extra={"review_id": review_id})
+        except HTTPException:
+            await self.session.rollback()
+            raise
+        except Exception:
+            logger.error("Failed to delete review", extra={"review_id": review_id}, exc_info=True)
+            await self.session.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Ошибка при удалении отзыва",
+            )
+        await self._invalidate(product)
+
+    async def _get_user_review(self, review_id: int, user_id: int) -> Review:
+        review_row = await self.review_dao.get_for_update(review_id, user_id)
+        if review_row is None:
+            logger.warning(
+                "Review not found", extra={"review_id": review_id, "user_id": user_id}
+            )
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Отзыва с таким id у пользователя нет",
+            )
+        return review_row
+
+    async def _apply_rating_delta(
+        self, product_id: int, new_rating: int | None, old_rating: int | None
+    ):
+        """Переход оценки отзыва old_rating -> new_rating (None - отзыв без оценки или его нет)"""
+        product = await self.product_dao.apply_rating_delta(
+            product_id,
+            sum_delta=(new_rating or 0) - (old_rating or 0),
+            count_delta=(new_rating is not None) - (old_rating is not None),
+        )
+        if product is None:
+            logger.warning("Product not found for review", extra={"product_id": product_id})
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Продукта с таким id не существует",
+            )
+        return product
+
+    async def _invalidate(self, product) -> None:
+        """Сброс кэша карточки товара и страниц каталога его категории"""
+        await self.cache_service.invalidate(product.product_id)
+        if product.category_title is not None:
+            await invalidate_cache_tags(category_tag(product.category_title))
+
+
+class ProductExportService:
+    def __init__(self, session_factory=session_maker):
+        self.session_factory = session_factory
+
+    async def stream_ndjson(self, batch_size: int = 1000):
+        """
+        Выгрузка всех товаров в формате NDJSON (один товар - одна строка json)
+
+        Товары читаются серверным курсором пачками по batch_size, каждая пачка отдается
+        одним куском, поэтому память не зависит от размера каталога.
+        Сессия открывается своя, тк ответ стримится уже после выхода из зависимостей запроса
+        """
+        async with self.session_factory() as session:
+            product_dao = ProductDao(session)
+            count = 0
+            async for products in product_dao.stream_all(batch_size):
+                count += len(products)
+                yield "".join(
+                    ProductResponseSchema.model_validate(
+                        product, from_attributes=True
+                    ).model_dump_json()
+                    + "\n"
+                    for product in products
+                )
+            logger.info("Products exported as NDJSON", extra={"count": count})
+
+
 class HistoryQueryTextService:
     def __init__(self, hqt_dao: HistoryQueryTextDao):
         self.hqt_dao = hqt_dao
@@ -347,20 +597,31 @@ class SearchHistoryService:
     def __init__(
         self,
         session: AsyncSession,
-        el_service: ElasticsearchService,
+        search_backend: SearchBackend,
         hqt_service: HistoryQueryTextService,
     ):
         self.session = session
-        self.el_service = el_service
+        self.search_backend = search_backend
         self.hqt_service = hqt_service
 
-    async def search_product(self, user_id, query: str) -> list[ProductSchema]:
+    async def search_product(
+        self,
+        user_id,
+        query: str,
+        limit: int = SEARCH_PAGE_SIZE,
+        cursor: str | None = None,
+        with_total: bool = False,
+    ) -> dict:
+        """Поиск товаров с добавлением запроса в историю (только для первой страницы)"""
         try:
-            await self.hqt_service.add_history_query(user_id, query)
-            products = await self.el_service.search_products(query)
+            if cursor is None:
+                await self.hqt_service.add_history_query(user_id, query)
+            page = await self.search_backend.search_products(
+                query, limit=limit, cursor=cursor, with_total=with_total
+            )
             logger.debug("Find products with add to history")
             await self.session.commit()
-            return products
+            return page
         except HTTPException as e:
             logger.warning(
                 "Failed search products with add to history",
@@ -0,0 +1,434 @@
+"""
+Кэширование ответов ручек поверх бэкенда fastapi-cache.
+
+У каждого тега есть версия в redis (fastapi-cache-tag:<tag>), которая входит в ключ кэша.
+Инвалидация тега - это INCR его версии: все записи с этим тегом становятся недостижимыми
+и сами удаляются по TTL, поэтому искать и удалять ключи не нужно.
+
+coalesced_cache защищает от cache stampede: при промахе значение вычисляет один запрос
+на ключ, а перед истечением TTL значение вероятностно обновляется заранее.
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import math
+import re
+import random
+import time
+import uuid
+from decimal import Decimal
+from functools import wraps
+from inspect import Parameter, Signature
+
+from fastapi import Request, Response
+from fastapi.dependencies.utils import (get_typed_return_annotation,
+                                        get_typed_signature)
+from fastapi_cache import FastAPICache
+from redis import Redis as SyncRedis
+from redis.exceptions import RedisError
+
+from app.logger import logger
+from app.metrics import CACHE_REQUESTS
+
+CACHE_TAG_KEY = "fastapi-cache-tag:{tag}"
+
+# Граница диапазона цены: целое число или число с 1-2 знаками после точки
+PRICE_NUMBER_RE = re.compile(r"\d+(\.\d{1,2})?")
+
+SEARCH_TAG = "search"
+RECOMMENDATION_TAG = "recommendation"
+
+
+def category_tag(category: str) -> str:
+    """Тег страниц каталога категории (по названию категории, как в пути каталога)"""
+    return f"category:{category}"
+
+
+def user_tag(user_id: int) -> str:
+    """Тег персональных ответов пользователя"""
+    return f"user:{user_id}"
+
+
+def normalize_price_range(value: str) -> str:
+    """Приводит диапазон цены к виду start-end без пробелов, ведущих и конечных нулей"""
+    start, sep, end = value.replace(" ", "").partition("-")
+    if sep and PRICE_NUMBER_RE.fullmatch(start) and PRICE_NUMBER_RE.fullmatch(end):
+        return f"{Decimal(start).normalize():f}-{Decimal(end).normalize():f}"
+    return value
+
+
+def normalize_search_text(value: str) -> str:
+    """Поиск не зависит от регистра и количества пробелов"""
+    return " ".join(value.lower().split())
+
+
+def canonical_params(request, kwargs: dict, normalizers: dict | None = None) -> str:
+    """
+    Каноничная строка параметров запроса для ключа кэша
+
+    Берутся простые значения параметров ручки (уже приведенные к типам и с дефолтами)
+    и query-параметры, которых нет в сигнатуре (фильтры по характеристикам).
+    Пустые значения отбрасываются, параметры сортируются по имени, поэтому
+    ?a=1&b=2 и ?b=2&a=1 дают один ключ
+    """
+    normalizers = normalizers or {}
+    params = {
+        name: value
+        for name, value in kwargs.items()
+        if value is None or isinstance(value, (str, int, float))
+    }
+    if request is not None:
+        for name, value in request.query_params.items():
+            if name not in kwargs:
+                params[name.strip()] = value
+
+    items = []
+    for name, value in params.items():
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == "":
+            continue
+        if name in normalizers:
+            value = normalizers[name](value)
+        items.append(f"{name}={value}")
+    return "&".join(sorted(items))
+
+
+def tagged_key_builder(*tag_builders, normalizers: dict | None = None):
+    """
+    Key builder для кэша ручек, который строит ключ из каноничных параметров и версий тегов
+
+    tag_builders - функции, которые по kwargs ручки возвращают тег записи,
+    normalizers - функции приведения значений отдельных параметров к каноничному виду.
+    Если версии тегов не прочитать (redis недоступен), ключ - None и ответ не кэшируется
+    """
+
+    async def key_builder(func, namespace: str = "", *, request=None, response=None, args, kwargs):
+        tags = [tag_builder(kwargs) for tag_builder in tag_builders]
+        try:
+            versions = await _get_versions(tags)
+        except RedisError:
+            logger.warning("Failed to get cache tag versions", extra={"tags": tags}, exc_info=True)
+            return None
+        raw_key = ":".join(
+            [
+                func.__module__,
+                func.__name__,
+                canonical_params(request, kwargs, normalizers),
+                *(f"{tag}={version}" for tag, version in zip(tags, versions)),
+            ]
+        )
+        return f"{namespace}:{hashlib.md5(raw_key.encode()).hexdigest()}"
+
+    return key_builder
+
+
+async def _get_versions(tags: list[str]) -> list:
+    if not tags:
+        return []
+    redis_client = FastAPICache.get_backend().redis
+    return await redis_client.mget([CACHE_TAG_KEY.format(tag=tag) for tag in tags])
+
+
+async def invalidate_cache_tags(*tags: str) -> None:
+    """Инвалидация всех записей кэша с переданными тегами"""
+    if not tags:
+        return
+    try:
+        redis_client = FastAPICache.get_backend().redis
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.incr(CACHE_TAG_KEY.format(tag=tag))
+            await pipe.execute()
+        logger.debug("Cache tags invalidated", extra={"tags": tags})
+    except RedisError:
+        logger.error("Failed to invalidate cache tags", extra={"tags": tags}, exc_info=True)
+
+
+# Синхронный вариант для celery
+def invalidate_cache_tags_sync(redis_client: SyncRedis, *tags: str) -> None:
+    """Инвалидация всех записей кэша с переданными тегами (sync)"""
+    if not tags:
+        return
+    try:
+        with redis_client.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.incr(CACHE_TAG_KEY.format(tag=tag))
+            pipe.execute()
+        logger.debug("Cache tags invalidated (sync)", extra={"tags": tags})
+    except RedisError:
+        logger.error(
+            "Failed to invalidate cache tags (sync)", extra={"tags": tags}, exc_info=True
+        )
+
+
+CACHE_LOCK_TTL_MS = 10_000
+CACHE_LOCK_WAIT_SEC = 0.05
+CACHE_EARLY_REFRESH_BETA = 1.0
+
+# Снимает блокировку, только если она все еще принадлежит этому воркеру
+_RELEASE_LOCK_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Вычисления значений кэша, которые уже идут в этом процессе: ключ -> future с результатом
+_inflight: dict[str, asyncio.Future] = {}
+
+# Ограничение TTL записи, которое ручка выставила во время вычисления ответа (см. limit_response_cache)
+_response_cache_ttl: contextvars.ContextVar[int | None] = contextvars.ContextVar(
+    "response_cache_ttl", default=None
+)
+
+
+def limit_response_cache(ttl: int) -> None:
+    """
+    Ограничение TTL кэша текущего ответа ручки с coalesced_cache
+
+    Вызывается во время вычисления ответа, например, когда ответ собран в деградированном
+    режиме и не должен жить в кэше весь обычный срок
+    """
+    current = _response_cache_ttl.get()
+    _response_cache_ttl.set(ttl if current is None else min(current, ttl))
+
+
+# Вспомогательные функции декоратора повторяют приватные _augment_signature, _locate_param
+# и _uncacheable из fastapi_cache.decorator: приватные имена могут измениться в любом
+# патч-релизе библиотеки и сломать импорт всех ручек с кэшем
+def _augment_signature(signature: Signature, *extra: Parameter) -> Signature:
+    """Добавляет к сигнатуре ручки параметры перед **kwargs"""
+    if not extra:
+        return signature
+    parameters = list(signature.parameters.values())
+    variadic_keyword_params = []
+    while parameters and parameters[-1].kind is Parameter.VAR_KEYWORD:
+        variadic_keyword_params.append(parameters.pop())
+    return signature.replace(parameters=[*parameters, *extra, *variadic_keyword_params])
+
+
+def _locate_param(signature: Signature, dep: Parameter, to_inject: list[Parameter]) -> Parameter:
+    """Параметр ручки с тем же типом, что у dep, или dep, который добавляется в to_inject"""
+    param = next(
+        (p for p in signature.parameters.values() if p.annotation is dep.annotation), None
+    )
+    if param is None:
+        to_inject.append(dep)
+        param = dep
+    return param
+
+
+def _uncacheable(request: Request | None) -> bool:
+    """Запрос не кэшируется: кэш выключен, метод не GET или Cache-Control: no-store"""
+    if not FastAPICache.get_enable():
+        return True
+    if request is None:
+        return False
+    if request.method != "GET":
+        return True
+    return request.headers.get("Cache-Control") == "no-store"
+
+
+def _pack(payload: bytes, delta: float) -> bytes:
+    """Добавляет к закодированному ответу время его вычисления"""
+    return f"{delta:.6f}|".encode() + payload
+
+
+def _unpack(cached: bytes) -> tuple[float, bytes] | None:
+    """Разбирает значение кэша, значения в старом формате (без времени вычисления) считаются промахом"""
+    try:
+        delta, payload = cached.split(b"|", 1)
+        return float(delta), payload
+    except ValueError:
+        return None
+
+
+def _should_refresh_early(delta: float, ttl: int) -> bool:
+    """
+    Вероятностное досрочное обновление (XFetch)
+
+    Чем ближе конец TTL и чем дольше считается значение, тем выше шанс, что запрос
+    обновит кэш заранее. Так записи обновляются по одной, а не все разом в момент истечения
+    """
+    if ttl is None or ttl < 0:
+        return False
+    return delta * CACHE_EARLY_REFRESH_BETA * -math.log(1.0 - random.random()) >= ttl
+
+
+def coalesced_cache(expire: int, key_builder, namespace: str = ""):
+    """
+    Кэширование ответа ручки в бэкенде fastapi-cache с защитой от cache stampede
+
+    Работает как @cache из fastapi-cache, но при промахе значение вычисляет только
+    один запрос на ключ: внутри процесса остальные ждут его future, между воркерами -
+    короткую блокировку в redis. Незадолго до истечения TTL значение обновляется
+    досрочно одним запросом, остальные в это время получают текущее значение.
+    Если key_builder вернул None, ответ вычисляется без кэша, TTL отдельного ответа
+    можно уменьшить через limit_response_cache
+    """
+    injected_request = Parameter(
+        name="__fastapi_cache_request", annotation=Request, kind=Parameter.KEYWORD_ONLY
+    )
+    injected_response = Parameter(
+        name="__fastapi_cache_response", annotation=Response, kind=Parameter.KEYWORD_ONLY
+    )
+
+    def wrapper(func):
+        wrapped_signature = get_typed_signature(func)
+        to_inject: list[Parameter] = []
+        request_param = _locate_param(wrapped_signature, injected_request, to_inject)
+        response_param = _locate_param(wrapped_signature, injected_response, to_inject)
+        return_type = get_typed_return_annotation(func)
+
+        @wraps(func)
+        async def inner(*args, **kwargs):
+            copy_kwargs = kwargs.copy()
+            request = copy_kwargs.pop(request_param.name, None)
+            response = copy_kwargs.pop(response_param.name, None)
+            kwargs.pop(injected_request.name, None)
+            kwargs.pop(injected_response.name, None)
+
+            if _uncacheable(request):
+                return await func(*args, **kwargs)
+
+            coder = FastAPICache.get_coder()
+            backend = FastAPICache.get_backend()
+            cache_key = await key_builder(
+                func,
+                f"{FastAPICache.get_prefix()}:{namespace}",
+                request=request,
+                response=response,
+                args=args,
+                kwargs=copy_kwargs,
+            )
+            route = getattr(request.scope.get("route"), "path", func.__name__)
+            if cache_key is None:
+                CACHE_REQUESTS.labels(route=route, result="bypass").inc()
+                return await func(*args, **kwargs)
+
+            try:
+                ttl, cached = await backend.get_with_ttl(cache_key)
+            except RedisError:
+                logger.warning("Failed to get cache value", extra={"key": cache_key}, exc_info=True)
+                ttl, cached = 0, None
+
+            stale_payload = None
+            entry = _unpack(cached) if cached is not None else None
+            if entry is not None:
+                delta, payload = entry
+                if not _should_refresh_early(delta, ttl):
+                    CACHE_REQUESTS.labels(route=route, result="hit").inc()
+                    _set_headers(response, ttl, "HIT")
+                    return coder.decode_as_type(payload, type_=return_type)
+                stale_payload = payload
+
+            computed = False
+            entry_expire = expire
+
+            async def compute() -> bytes:
+                nonlocal computed, entry_expire
+                computed = True
+                started = time.monotonic()
+                token = _response_cache_ttl.set(None)
+                try:
+                    result = await func(*args, **kwargs)
+                    limited_ttl = _response_cache_ttl.get()
+                finally:
+                    _response_cache_ttl.reset(token)
+                if limited_ttl is not None:
+                    entry_expire = min(expire, limited_ttl)
+                payload = coder.encode(result)
+                try:
+                    await backend.set(cache_key, _pack(payload, time.monotonic() - started), entry_expire)
+                except RedisError:
+                    logger.warning("Failed to set cache value", extra={"key": cache_key}, exc_info=True)
+                return payload
+
+            payload = await _single_flight(cache_key, compute, stale_payload, backend)
+            if computed:
+                result = "miss"
+            elif stale_payload is not None and payload is stale_payload:
+                result = "stale"
+            else:
+                result = "coalesced"
+            CACHE_REQUESTS.labels(route=route, result=result).inc()
+            _set_headers(response, entry_expire, "MISS")
+            return coder.decode_as_type(payload, type_=return_type)
+
+        inner.__signature__ = _augment_signature(wrapped_signature, *to_inject)
+        return inner
+
+    return wrapper
+
+
+def _set_headers(response: Response | None, max_age: int, status: str) -> None:
+    if response is not None:
+        response.headers.update(
+            {
+                "Cache-Control": f"max-age={max_age}",
+                FastAPICache.get_cache_status_header(): status,
+            }
+        )
+
+
+async def _single_flight(cache_key: str, compute, stale_payload: bytes | None, backend) -> bytes:
+    """Одно вычисление значения на ключ внутри процесса"""
+    future = _inflight.get(cache_key)
+    if future is not None:
+        return stale_payload if stale_payload is not None else await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[cache_key] = future
+    try:
+        payload = await _compute_with_lock(cache_key, compute, stale_payload, backend)
+        future.set_result(payload)
+        return payload
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Исключение получают ожидающие запросы, у future без ожидающих его не нужно логировать
+        future.exception()
+        raise
+    finally:
+        _inflight.pop(cache_key, None)
+
+
+async def _compute_with_lock(cache_key: str, compute, stale_payload: bytes | None, backend) -> bytes:
+    """Одно вычисление значения на ключ между воркерами через блокировку в redis"""
+    redis_client = backend.redis
+    lock_key = f"{cache_key}:lock"
+    token = uuid.uuid4().hex
+    try:
+        locked = await redis_client.set(lock_key, token, nx=True, px=CACHE_LOCK_TTL_MS)
+    except RedisError:
+        logger.warning("Failed to take cache lock", extra={"key": cache_key}, exc_info=True)
+        return await compute()
+
+    if locked:
+        try:
+            return await compute()
+        finally:
+            try:
+                await redis_client.eval(_RELEASE_LOCK_LUA, 1, lock_key, token)
+            except RedisError:
+                logger.warning("Failed to release cache lock", extra={"key": cache_key}, exc_info=True)
+
+    # Значение уже считает другой воркер
+    if stale_payload is not None:
+        return stale_payload
+    deadline = time.monotonic() + CACHE_LOCK_TTL_MS / 1000
+    while time.monotonic() < deadline:
+        await asyncio.sleep(CACHE_LOCK_WAIT_SEC)
+        try:
+            cached = await backend.get(cache_key)
+        except RedisError:
+            break
+        entry = _unpack(cached) if cached is not None else None
+        if entry is not None:
+            return entry[1]
+    logger.warning("Cache lock wait timed out", extra={"key": cache_key})
+    return await compute()
@@ -1,3 +1,4 @@
+from redis import Redis as SyncRedis
 from redis.asyncio import Redis
 
 from app.config import settings
@@ -10,3 +11,10 @@ redis_client = Redis(
 )
 
 REDIS_URL = settings.REDIS_URL
+
+# Синхронный клиент для celery, смотрит в тот же redis, что и app.state.redis_client
+redis_sync_client = SyncRedis.from_url(REDIS_URL, decode_responses=True)
+
+# Асинхронный клиент вне запросов приложения (админка), смотрит в тот же redis с кэшем,
+# что и app.state.redis_client
+redis_async_client = Redis.from_url(REDIS_URL, decode_responses=True)
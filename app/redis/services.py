@@ -1,8 +1,10 @@
 import json
+import uuid
 
 from fastapi import HTTPException, status
+from redis import Redis as SyncRedis
 from redis.asyncio import Redis
-from redis.exceptions import RedisError
+from redis.exceptions import RedisError, ResponseError
 
 from app.config import settings
 from app.logger import logger
@@ -256,3 +258,60 @@ class RedisService:
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Ошибка при валидации данных",
             )
+
+
+PRODUCT_VIEWS_KEY = "product_views"
+PRODUCT_VIEWS_FLUSHING_KEY = "product_views:flushing"
+PRODUCT_VIEWS_FLUSH_ID_KEY = "product_views:flush_id"
+
+
+class ProductViewsService:
+    def __init__(self, redis_client: Redis):
+        self.redis_client = redis_client
+
+    async def incr(self, product_id: int, amount: int = 1) -> None:
+        """
+        Увеличение счетчика просмотров товара в redis
+
+        Просмотры копятся в hash product_views (product_id -> прирост) и периодически
+        переносятся в бд задачей flush_product_views. Ошибка redis не должна ломать
+        просмотр товара, поэтому она только логируется
+        """
+        try:
+            await self.redis_client.hincrby(PRODUCT_VIEWS_KEY, product_id, amount)
+        except RedisError:
+            logger.warning(
+                "Failed to increment product views",
+                extra={"product_id": product_id},
+                exc_info=True,
+            )
+
+
+# Синхронный вариант для celery
+class ProductViewsSyncService:
+    def __init__(self, redis_client: SyncRedis):
+        self.redis_client = redis_client
+
+    def take_deltas(self) -> tuple[str | None, dict[int, int]]:
+        """
+        Забирает накопленные приросты просмотров вместе с id переноса
+
+        Hash атомарно переименовывается, поэтому новые просмотры во время переноса
+        копятся уже в новом hash и не теряются. Если прошлый перенос упал,
+        сначала дообрабатывается его hash с тем же id переноса: по нему в бд видно,
+        были ли эти приросты уже записаны
+        """
+        if not self.redis_client.exists(PRODUCT_VIEWS_FLUSHING_KEY):
+            try:
+                self.redis_client.rename(PRODUCT_VIEWS_KEY, PRODUCT_VIEWS_FLUSHING_KEY)
+            except ResponseError:
+                logger.debug("No product views to flush")
+                return None, {}
+        self.redis_client.set(PRODUCT_VIEWS_FLUSH_ID_KEY, uuid.uuid4().hex, nx=True)
+        flush_id = self.redis_client.get(PRODUCT_VIEWS_FLUSH_ID_KEY)
+        deltas = self.redis_client.hgetall(PRODUCT_VIEWS_FLUSHING_KEY)
+        return flush_id, {int(product_id): int(delta) for product_id, delta in deltas.items()}
+
+    def ack_deltas(self) -> None:
+        """Удаляет перенесенные в бд приросты и id их переноса"""
+        self.redis_client.delete(PRODUCT_VIEWS_FLUSHING_KEY, PRODUCT_VIEWS_FLUSH_ID_KEY)
@@ -0,0 +1,71 @@
+"""
+Интерфейс поискового движка товаров.
+
+Ручки поиска работают с SearchBackend, а не с elasticsearch напрямую. Реализации:
+ElasticsearchService (основная) и TrigramSearchBackend (индекс в памяти процесса
+для тестов и небольших установок без elasticsearch), выбирается настройкой SEARCH_BACKEND.
+При недоступности elasticsearch поиск переключается на PostgresSearchBackend (см. app.search.fallback).
+"""
+
+import re
+from abc import ABC, abstractmethod
+
+from fastapi import HTTPException, status
+
+from app.logger import logger
+from app.products.pagination import SEARCH_PAGE_SIZE, decode_search_cursor
+
+# Границы длины слова запроса как у ngram_tokenizer индекса elasticsearch
+MIN_WORD_LENGTH = 3
+MAX_WORD_LENGTH = 15
+
+_WORD_RE = re.compile(r"[^\W_]+")
+
+
+def split_words(text: str) -> list[str]:
+    """Слова текста в нижнем регистре (буквы и цифры, как token_chars индекса)"""
+    return _WORD_RE.findall(text.lower())
+
+
+def query_words(query_text: str) -> list[str]:
+    """Различные слова запроса, по которым ищет индекс (от MIN_WORD_LENGTH до MAX_WORD_LENGTH символов)"""
+    return [
+        word
+        for word in dict.fromkeys(split_words(query_text))
+        if MIN_WORD_LENGTH <= len(word) <= MAX_WORD_LENGTH
+    ]
+
+
+def search_after(query_text: str, cursor: str | None, engine: str) -> tuple[float, int] | None:
+    """
+    Позиция (оценка, product_id), после которой начинается страница
+
+    Некорректный курсор или курсор другого движка (engine) - 422
+    """
+    if cursor is None:
+        return None
+    try:
+        after = tuple(decode_search_cursor(cursor, engine))
+        if len(after) != 2:
+            raise ValueError("Некорректный курсор пагинации")
+        return after
+    except (ValueError, TypeError) as e:
+        logger.warning("Invalid search cursor", extra={"query": query_text}, exc_info=True)
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+
+
+class SearchBackend(ABC):
+    @abstractmethod
+    async def search_products(
+        self, query_text: str, limit: int = SEARCH_PAGE_SIZE, cursor: str | None = None, with_total: bool = False
+    ) -> dict:
+        """
+        Поиск товаров по тексту (title^2, description), страница по limit товаров
+
+        Возвращает словарь items, next_cursor (None на последней странице)
+        и total (только при with_total=True)
+        """
+
+    @abstractmethod
+    async def suggest_products(self, prefix: str) -> list[dict]:
+        """Подсказки товаров по началу запроса (product_id и title)"""
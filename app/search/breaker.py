@@ -0,0 +1,75 @@
+"""
+Автоматический выключатель (circuit breaker) для обращений к внешнему сервису.
+
+closed - запросы идут в сервис, подряд failure_threshold ошибок размыкают автомат.
+open - запросы в сервис не отправляются reset_timeout секунд.
+half_open - пропускается один пробный запрос: успех замыкает автомат, ошибка снова размыкает.
+
+Состояние хранится в памяти процесса, каждый воркер решает сам.
+"""
+
+import time
+
+from app.logger import logger
+from app.metrics import SEARCH_BREAKER_STATE
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    _STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        # Время начала пробного запроса в half_open, None - пробного запроса нет
+        self.probe_started_at: float | None = None
+        self._state = self.CLOSED
+        SEARCH_BREAKER_STATE.labels(breaker=name).set(0)
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self._set_state(self.HALF_OPEN)
+        return self._state
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос в сервис"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.OPEN:
+            return False
+        # Пробный запрос, который не вернулся за reset_timeout (например, отменен), не блокирует следующий
+        now = time.monotonic()
+        if self.probe_started_at is not None and now - self.probe_started_at < self.reset_timeout:
+            return False
+        self.probe_started_at = now
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.probe_started_at = None
+        if self._state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.probe_started_at = None
+        if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            if self._state != self.OPEN:
+                self._set_state(self.OPEN)
+
+    def _set_state(self, state: str) -> None:
+        logger.warning(
+            "Circuit breaker state changed",
+            extra={"breaker": self.name, "from": self._state, "to": state, "failures": self.failures},
+        )
+        self._state = state
+        SEARCH_BREAKER_STATE.labels(breaker=self.name).set(self._STATE_VALUES[state])
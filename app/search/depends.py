@@ -0,0 +1,27 @@
+from typing import Annotated
+
+from fastapi import Depends, Request
+
+from app.config import settings
+from app.database import SessionDep
+from app.elasticsearch.depends import ElasticsearchServiceDep
+from app.products.dao import ProductDao
+from app.search.backend import SearchBackend
+from app.search.fallback import FallbackSearchBackend
+from app.search.postgres import PostgresSearchBackend
+
+
+def get_search_backend(
+    request: Request, el_service: ElasticsearchServiceDep, session: SessionDep
+) -> SearchBackend:
+    """
+    Поисковый движок по настройке SEARCH_BACKEND (trigram загружается в lifespan)
+
+    elasticsearch работает через автомат с переключением на поиск в postgres
+    """
+    if settings.SEARCH_BACKEND == "trigram":
+        return request.app.state.search_backend
+    return FallbackSearchBackend(el_service, PostgresSearchBackend(ProductDao(session)))
+
+
+SearchBackendDep = Annotated[SearchBackend, Depends(get_search_backend)]
@@ -0,0 +1,93 @@
+"""
+Поиск через elasticsearch с переключением на postgres при его недоступности.
+
+Запросы к elasticsearch идут с явными таймаутами (см. SEARCH_REQUEST_TIMEOUT в
+app.elasticsearch.services) через автоматы CircuitBreaker. Ошибка или таймаут
+основного движка обслуживается резервным, а после ELASTICSEARCH_FAILURE_THRESHOLD ошибок
+подряд запросы сразу идут в postgres, пока автомат разомкнут. У поиска и подсказок свои
+автоматы: короткий таймаут подсказок не должен отключать поиск. Ошибки запроса (4xx, например
+некорректный курсор) не считаются отказом elasticsearch и отдаются как есть. Курсор помечен
+движком, который его выдал, поэтому при переключении движков листание страниц получает 422
+и начинается заново, а не пропускает или повторяет товары.
+
+Ответы резервного движка (другая оценка и шкала курсора) кэшируются только на
+FALLBACK_CACHE_TTL, чтобы после восстановления elasticsearch выдача быстро вернулась к обычной.
+"""
+
+from fastapi import HTTPException, status
+
+from app.logger import logger
+from app.metrics import SEARCH_FALLBACKS, SEARCH_REQUESTS
+from app.products.pagination import SEARCH_PAGE_SIZE
+from app.redis.cache import limit_response_cache
+from app.search.backend import SearchBackend
+from app.search.breaker import CircuitBreaker
+
+ELASTICSEARCH_FAILURE_THRESHOLD = 5
+ELASTICSEARCH_RESET_TIMEOUT = 30.0
+FALLBACK_CACHE_TTL = 30
+
+elasticsearch_search_breaker = CircuitBreaker(
+    "elasticsearch_search",
+    failure_threshold=ELASTICSEARCH_FAILURE_THRESHOLD,
+    reset_timeout=ELASTICSEARCH_RESET_TIMEOUT,
+)
+elasticsearch_suggest_breaker = CircuitBreaker(
+    "elasticsearch_suggest",
+    failure_threshold=ELASTICSEARCH_FAILURE_THRESHOLD,
+    reset_timeout=ELASTICSEARCH_RESET_TIMEOUT,
+)
+
+
+class FallbackSearchBackend(SearchBackend):
+    def __init__(
+        self,
+        primary: SearchBackend,
+        fallback: SearchBackend,
+        search_breaker: CircuitBreaker = elasticsearch_search_breaker,
+        suggest_breaker: CircuitBreaker = elasticsearch_suggest_breaker,
+        primary_name: str = "elasticsearch",
+        fallback_name: str = "postgres",
+    ):
+        self.primary = primary
+        self.fallback = fallback
+        self.breakers = {"search": search_breaker, "suggest": suggest_breaker}
+        self.primary_name = primary_name
+        self.fallback_name = fallback_name
+
+    async def search_products(
+        self, query_text: str, limit: int = SEARCH_PAGE_SIZE, cursor: str | None = None, with_total: bool = False
+    ) -> dict:
+        return await self._call(
+            "search", lambda backend: backend.search_products(query_text, limit, cursor, with_total)
+        )
+
+    async def suggest_products(self, prefix: str) -> list[dict]:
+        return await self._call("suggest", lambda backend: backend.suggest_products(prefix))
+
+    async def _call(self, operation: str, request):
+        breaker = self.breakers[operation]
+        if not breaker.allow():
+            SEARCH_FALLBACKS.labels(operation=operation, reason="open").inc()
+            return await self._call_fallback(operation, request)
+        try:
+            result = await request(self.primary)
+        except HTTPException as e:
+            if e.status_code < status.HTTP_500_INTERNAL_SERVER_ERROR:
+                raise
+            breaker.record_failure()
+            SEARCH_FALLBACKS.labels(operation=operation, reason="error").inc()
+            logger.warning(
+                "Primary search backend failed, using fallback",
+                extra={"operation": operation, "status_code": e.status_code, "breaker": breaker.state},
+            )
+            return await self._call_fallback(operation, request)
+        breaker.record_success()
+        SEARCH_REQUESTS.labels(operation=operation, backend=self.primary_name).inc()
+        return result
+
+    async def _call_fallback(self, operation: str, request):
+        result = await request(self.fallback)
+        limit_response_cache(FALLBACK_CACHE_TTL)
+        SEARCH_REQUESTS.labels(operation=operation, backend=self.fallback_name).inc()
+        return result
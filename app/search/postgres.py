@@ -0,0 +1,52 @@
+"""
+Поиск товаров запросами к postgres по триграммным индексам title и description (pg_trgm).
+
+Резервный движок на время недоступности elasticsearch: находит те же товары (слово запроса
+из 3+ символов входит в поле), но оценивает их без idf. Порядок как у elasticsearch:
+(оценка по убыванию, product_id), но оценки несравнимы, поэтому курсор помечен движком
+и курсор elasticsearch здесь отклоняется (422), а не дает пропущенные или повторные страницы.
+"""
+
+from app.products.dao import ProductDao
+from app.products.pagination import SEARCH_PAGE_SIZE, encode_search_cursor
+from app.products.schema import ProductResponseSchema
+from app.search.backend import (MIN_WORD_LENGTH, SearchBackend, query_words,
+                                search_after, split_words)
+
+SUGGEST_SIZE = 8
+SEARCH_CURSOR_ENGINE = "pg"
+
+
+class PostgresSearchBackend(SearchBackend):
+    def __init__(self, product_dao: ProductDao):
+        self.product_dao = product_dao
+
+    async def search_products(
+        self, query_text: str, limit: int = SEARCH_PAGE_SIZE, cursor: str | None = None, with_total: bool = False
+    ) -> dict:
+        after = search_after(query_text, cursor, SEARCH_CURSOR_ENGINE)
+        words = query_words(query_text)
+        if not words:
+            return {"items": [], "next_cursor": None, "total": 0 if with_total else None}
+
+        rows, total = await self.product_dao.search_by_words(words, limit, after, with_total)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            product, score = rows[-1]
+            next_cursor = encode_search_cursor(SEARCH_CURSOR_ENGINE, [score, product.product_id])
+        return {
+            "items": [
+                ProductResponseSchema.model_validate(product, from_attributes=True).model_dump(mode="json")
+                for product, _ in rows
+            ],
+            "next_cursor": next_cursor,
+            "total": total,
+        }
+
+    async def suggest_products(self, prefix: str) -> list[dict]:
+        words = split_words(prefix)
+        # Начало слова короче триграммы не ищется по индексу: без него был бы перебор всей таблицы
+        if not words or len(words[-1]) < MIN_WORD_LENGTH:
+            return []
+        return await self.product_dao.suggest_by_words(words, SUGGEST_SIZE)
@@ -0,0 +1,228 @@
+"""
+Поиск товаров по триграммному инвертированному индексу в памяти процесса.
+
+Повторяет поиск elasticsearch по индексу с ngram(3..15): слово запроса из 3+ символов
+находит товар, если оно входит в какое-либо слово поля. Кандидаты берутся пересечением
+списков товаров по триграммам слова и проверяются на вхождение. Оценка поля - сумма idf
+найденных слов, оценка товара - max(2 * title, description), как multi_match best_fields
+с title^2. Порядок и курсор те же, что у elasticsearch: (оценка по убыванию, product_id).
+
+Индекс строится из таблицы products при старте воркера и обновляется по сообщениям
+в канале PRODUCT_INVALIDATION_CHANNEL, полностью перестраивается раз в TRIGRAM_INDEX_RELOAD_SEC.
+"""
+
+import asyncio
+import math
+from collections import defaultdict
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+from app.database import session_maker
+from app.logger import logger
+from app.products.cache import PRODUCT_INVALIDATION_CHANNEL
+from app.products.dao import ProductDao
+from app.products.pagination import SEARCH_PAGE_SIZE, encode_search_cursor
+from app.products.schema import ProductResponseSchema
+from app.search.backend import (SearchBackend, query_words, search_after,
+                                split_words)
+
+TRIGRAM_INDEX_RELOAD_SEC = 600
+TRIGRAM_INDEX_DB_BATCH_SIZE = 1000
+SUGGEST_SIZE = 8
+SEARCH_CURSOR_ENGINE = "trigram"
+
+# Поле документа и его вес (как title^2, description в multi_match)
+FIELD_WEIGHTS = {"title": 2.0, "description": 1.0}
+
+def word_trigrams(word: str) -> set[str]:
+    return {word[i : i + 3] for i in range(len(word) - 2)}
+
+
+class TrigramIndex:
+    def __init__(self):
+        self.documents: dict[int, dict] = {}
+        # поле -> слова поля каждого товара
+        self.words: dict[str, dict[int, list[str]]] = {field: {} for field in FIELD_WEIGHTS}
+        # поле -> триграмма -> товары, в словах поля которых она есть
+        self.postings: dict[str, dict[str, set[int]]] = {
+            field: defaultdict(set) for field in FIELD_WEIGHTS
+        }
+
+    def __len__(self):
+        return len(self.documents)
+
+    def upsert(self, document: dict) -> None:
+        product_id = document["product_id"]
+        self.remove(product_id)
+        self.documents[product_id] = document
+        for field in FIELD_WEIGHTS:
+            words = split_words(document.get(field) or "")
+            self.words[field][product_id] = words
+            for word in set(words):
+                for trigram in word_trigrams(word):
+                    self.postings[field][trigram].add(product_id)
+
+    def remove(self, product_id: int) -> None:
+        if self.documents.pop(product_id, None) is None:
+            return
+        for field in FIELD_WEIGHTS:
+            for word in set(self.words[field].pop(product_id, [])):
+                for trigram in word_trigrams(word):
+                    postings = self.postings[field].get(trigram)
+                    if postings is None:
+                        continue
+                    postings.discard(product_id)
+                    if not postings:
+                        del self.postings[field][trigram]
+
+    def search(self, query_text: str) -> list[tuple[float, int]]:
+        """Найденные товары как пары (оценка, product_id) в порядке выдачи"""
+        words = query_words(query_text)
+        scores: dict[int, float] = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            field_scores: dict[int, float] = defaultdict(float)
+            for word in words:
+                matched = self._match(field, word, lambda field_word: word in field_word)
+                if matched:
+                    idf = math.log(1 + len(self.documents) / len(matched))
+                    for product_id in matched:
+                        field_scores[product_id] += idf
+            for product_id, score in field_scores.items():
+                scores[product_id] = max(scores[product_id], weight * score)
+        return sorted(((score, product_id) for product_id, score in scores.items()), key=_order)
+
+    def suggest(self, prefix: str, size: int = SUGGEST_SIZE) -> list[dict]:
+        """Товары, в названии которых есть все слова prefix, последнее - как начало слова"""
+        *words, last = split_words(prefix) or [""]
+        if not last:
+            return []
+        candidates = self._match("title", last, lambda title_word: title_word.startswith(last))
+        for word in words:
+            candidates &= self._match("title", word, lambda title_word: title_word == word)
+        ranked = sorted(
+            candidates,
+            key=lambda product_id: (len(self.words["title"][product_id]), product_id),
+        )
+        return [
+            {
+                "product_id": product_id,
+                "title": self.documents[product_id]["title"],
+            }
+            for product_id in ranked[:size]
+        ]
+
+    def _match(self, field: str, word: str, predicate) -> set[int]:
+        """Товары, в поле которых есть слово, удовлетворяющее predicate"""
+        trigrams = word_trigrams(word)
+        if trigrams:
+            postings = sorted(
+                (self.postings[field].get(trigram, set()) for trigram in trigrams), key=len
+            )
+            candidates = set.intersection(*postings)
+        else:
+            # Слово короче триграммы (только для подсказок) - перебор всех товаров
+            candidates = self.words[field].keys()
+        return {
+            product_id
+            for product_id in candidates
+            if any(predicate(field_word) for field_word in self.words[field][product_id])
+        }
+
+
+def _order(item: tuple[float, int]) -> tuple[float, int]:
+    score, product_id = item
+    return -score, product_id
+
+
+class TrigramSearchBackend(SearchBackend):
+    def __init__(self, session_factory=session_maker):
+        self.session_factory = session_factory
+        self.index = TrigramIndex()
+
+    async def load(self) -> None:
+        """Построение индекса из бд, при ошибке остается предыдущий индекс"""
+        try:
+            index = TrigramIndex()
+            async with self.session_factory() as session:
+                async for products in ProductDao(session).stream_all(TRIGRAM_INDEX_DB_BATCH_SIZE):
+                    for product in products:
+                        index.upsert(self._document(product))
+            self.index = index
+            logger.info("Trigram search index loaded", extra={"count": len(index)})
+        except Exception:
+            logger.error("Failed to load trigram search index", exc_info=True)
+
+    async def refresh(self, product_ids: list[int]) -> None:
+        """Обновление товаров в индексе, удаленные из бд товары удаляются из индекса"""
+        try:
+            async with self.session_factory() as session:
+                products = await ProductDao(session).get_by_ids(product_ids)
+        except Exception:
+            logger.error(
+                "Failed to refresh trigram search index", extra={"count": len(product_ids)}, exc_info=True
+            )
+            return
+        for product in products:
+            self.index.upsert(self._document(product))
+        for product_id in set(product_ids) - {product.product_id for product in products}:
+            self.index.remove(product_id)
+        logger.debug("Trigram search index refreshed", extra={"count": len(product_ids)})
+
+    async def search_products(
+        self, query_text: str, limit: int = SEARCH_PAGE_SIZE, cursor: str | None = None, with_total: bool = False
+    ) -> dict:
+        after = search_after(query_text, cursor, SEARCH_CURSOR_ENGINE)
+        found = self.index.search(query_text)
+        page = found
+        if after is not None:
+            page = [item for item in found if _order(item) > _order(after)]
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_search_cursor(SEARCH_CURSOR_ENGINE, list(page[-1]))
+        logger.debug("Trigram products search completed", extra={"query": query_text, "hits": len(page)})
+        return {
+            "items": [self.index.documents[product_id] for _, product_id in page],
+            "next_cursor": next_cursor,
+            "total": len(found) if with_total else None,
+        }
+
+    async def suggest_products(self, prefix: str) -> list[dict]:
+        return self.index.suggest(prefix)
+
+    @staticmethod
+    def _document(product) -> dict:
+        return ProductResponseSchema.model_validate(product, from_attributes=True).model_dump(
+            mode="json"
+        )
+
+
+async def keep_trigram_index_fresh(redis_client: Redis, backend: TrigramSearchBackend):
+    """
+    Фоновая задача воркера: обновление измененных товаров по сообщениям об их инвалидации
+    и полная перестройка индекса по таймауту
+
+    Запускается в lifespan после первой загрузки
+    """
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(PRODUCT_INVALIDATION_CHANNEL)
+                logger.debug("Subscribed to product invalidations for trigram search")
+                while True:
+                    message = await pubsub.get_message(
+                        ignore_subscribe_messages=True, timeout=TRIGRAM_INDEX_RELOAD_SEC
+                    )
+                    if message is None:
+                        await backend.load()
+                        continue
+                    product_ids = [int(message["data"])]
+                    # Изменения пачкой (например, пересчет рейтингов) применяются одним запросом
+                    while (message := await pubsub.get_message(ignore_subscribe_messages=True)) is not None:
+                        product_ids.append(int(message["data"]))
+                    await backend.refresh(product_ids)
+        except RedisError:
+            logger.warning("Trigram search subscription lost", exc_info=True)
+            await backend.load()
+            await asyncio.sleep(1)
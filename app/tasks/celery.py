@@ -4,6 +4,7 @@ from celery import Celery
 from celery.schedules import crontab
 
 from app.config import settings
+from app.tasks import metrics  # noqa: F401 - сервер метрик воркера
 
 # Директория на уровень выше app
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
@@ -26,9 +27,24 @@ app.conf.beat_schedule = {
         "schedule": crontab(),
         "args": (),
     },
+    "rebuild_avg_reviews": {
+        "task": "app.tasks.tasks.update_avg_reviews",
+        "schedule": crontab(minute=30, hour=3),
+        "args": (True,),
+    },
     "update_product_index": {
         "task": "app.tasks.tasks.update_product_index",
         "schedule": crontab(),
         "args": (),
     },
+    "flush_product_views": {
+        "task": "app.tasks.tasks.flush_product_views",
+        "schedule": crontab(),
+        "args": (),
+    },
+    "refresh_recommendation_candidates": {
+        "task": "app.tasks.tasks.refresh_recommendation_candidates",
+        "schedule": crontab(minute=0),
+        "args": (),
+    },
 }
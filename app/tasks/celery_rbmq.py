@@ -2,6 +2,7 @@ from celery import Celery
 from kombu import Exchange, Queue
 
 from app.config import settings
+from app.tasks import metrics  # noqa: F401 - сервер метрик воркера
 
 if settings.MODE == "DEV":
     RABBITMQ_URL = f"amqp://{settings.RABBITMQ_DEFAULT_USER}:{settings.RABBITMQ_DEFAULT_PASS}@{settings.RABBITMQ_HOST}:{settings.RABBITMQ_PORT}//"
@@ -1,5 +1,5 @@
 from app.email.email_template import new_product_email, register_code
-from app.email.services import send_email
+from app.email.services import send_email, send_emails
 from app.logger import logger
 from app.tasks.celery import app
 
@@ -12,6 +12,14 @@ def send_email_about_new_product(email, title, price):
     send_email(email_msg)
 
 
+@app.task
+def send_emails_about_new_product(emails, title, price):
+    """Отправка писем о появлении нового продукта пачке получателей через одно SMTP соединение"""
+    emails_msg = (new_product_email(email, title, price) for email in emails)
+    sent = send_emails(emails_msg)
+    logger.debug("Send new product emails", extra={"recipients_count": len(emails), "sent": sent})
+
+
 @app.task
 def send_email_code(email, code):
     """Отправка письма с кодом подверждения"""
@@ -0,0 +1,48 @@
+"""
+Отдача метрик prometheus из воркеров celery.
+
+Метрики задач (например, пула SMTP соединений) считаются в процессе воркера, поэтому
+воркер поднимает свой http сервер метрик на CELERY_METRICS_PORT. С пулом solo или threads
+задачи выполняются в основном процессе и хватает реестра по умолчанию. С prefork пулом
+нужна переменная окружения PROMETHEUS_MULTIPROC_DIR: дочерние процессы пишут метрики
+в файлы директории, а сервер основного процесса собирает их MultiProcessCollector.
+"""
+
+import os
+
+from celery.signals import worker_init, worker_process_shutdown
+from prometheus_client import CollectorRegistry, start_http_server
+from prometheus_client import multiprocess
+
+from app.config import settings
+from app.logger import logger
+
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    if settings.CELERY_METRICS_PORT is None:
+        return
+    registry = None
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    try:
+        if registry is None:
+            start_http_server(settings.CELERY_METRICS_PORT)
+        else:
+            start_http_server(settings.CELERY_METRICS_PORT, registry=registry)
+        logger.info(
+            "Celery metrics server started",
+            extra={"port": settings.CELERY_METRICS_PORT, "multiprocess": registry is not None},
+        )
+    except OSError:
+        logger.error(
+            "Failed to start celery metrics server", extra={"port": settings.CELERY_METRICS_PORT}, exc_info=True
+        )
+
+
+@worker_process_shutdown.connect
+def mark_metrics_process_dead(pid=None, **kwargs):
+    """Файлы метрик завершившегося дочернего процесса больше не учитываются в gauge"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid or os.getpid())
@@ -5,21 +5,31 @@ from app.database import session_maker_sync
 from app.elasticsearch.config import ELASTICSEARCH_URL
 from app.elasticsearch.services import ElasticsearchSyncService
 from app.logger import logger
-from app.products.dao import ProductSyncDao, ReviewSyncDao
-from app.products.services import ProductServiceSync
+from app.products.cache import ProductCacheSyncService
+from app.products.dao import (ProductSyncDao, ProductViewsFlushSyncDao,
+                              WatermarkSyncDao)
+from app.products.popular import notify_popular_products_sync
+from app.products.services import (ProductServiceSync, ProductViewsServiceSync,
+                                   RecommendationCandidatesServiceSync)
+from app.redis.cache import (RECOMMENDATION_TAG, SEARCH_TAG, category_tag,
+                             invalidate_cache_tags_sync)
+from app.redis.client import redis_sync_client
+from app.redis.services import ProductViewsSyncService
 from app.tasks.celery import app
 
 
 @app.task
 def update_product_index():
-    """Обновление индекса продуктов в elasticsearch"""
+    """Инкрементальное обновление индекса продуктов в elasticsearch по очереди изменений"""
     try:
         logger.info("Starting product index update task")
         with Elasticsearch(hosts=ELASTICSEARCH_URL) as el_cl:
             el_service = ElasticsearchSyncService(el_cl)
             with session_maker_sync() as session:
-                el_service.add_all_products(session)
-        logger.info("Product index update completed successfully")
+                synced_count = el_service.sync_changes(session)
+        if synced_count:
+            invalidate_cache_tags_sync(redis_sync_client, SEARCH_TAG)
+        logger.info("Product index update completed successfully", extra={"count": synced_count})
     except ConnectionError as e:
         logger.error("Elasticsearch error during index update", exc_info=True)
         raise
@@ -29,18 +39,96 @@ def update_product_index():
 
 
 @app.task
-def update_avg_reviews():
-    """Обновление средних оценок у продуктов"""
+def rebuild_product_index():
+    """Полная перестройка индекса продуктов в elasticsearch (запускается вручную)"""
     try:
-        logger.info("Starting average reviews update task")
+        logger.info("Starting product index rebuild task")
+        with Elasticsearch(hosts=ELASTICSEARCH_URL) as el_cl:
+            el_service = ElasticsearchSyncService(el_cl)
+            with session_maker_sync() as session:
+                el_service.add_all_products(session)
+        invalidate_cache_tags_sync(redis_sync_client, SEARCH_TAG)
+        logger.info("Product index rebuild completed successfully")
+    except ConnectionError as e:
+        logger.error("Elasticsearch error during index rebuild", exc_info=True)
+        raise
+    except Exception as e:
+        logger.error("Failed to rebuild product index", exc_info=True)
+        raise
+
+
+@app.task
+def update_avg_reviews(full: bool = False):
+    """Сверка рейтингов товаров с отзывами (full=True - сверка всех, например после удаления отзывов в админке)"""
+    try:
+        logger.info("Starting average reviews update task", extra={"full": full})
         with session_maker_sync() as session:
             logger.debug("Opened sync session for reviews update")
-            review_dao = ReviewSyncDao(session)
+            watermark_dao = WatermarkSyncDao(session)
             product_dao = ProductSyncDao(session)
-            ProductServiceSync(product_dao, review_dao).update_reviews()
+            changed_product_ids = ProductServiceSync(product_dao, watermark_dao).update_reviews(
+                full=full
+            )
 
             session.commit()
+            ProductCacheSyncService(redis_sync_client).invalidate(*changed_product_ids)
+            if changed_product_ids:
+                categories = product_dao.categories_of(changed_product_ids)
+                RecommendationCandidatesServiceSync(product_dao).refresh(
+                    category_ids=[category.category_id for category in categories]
+                )
+                invalidate_cache_tags_sync(
+                    redis_sync_client,
+                    RECOMMENDATION_TAG,
+                    *(category_tag(category.title) for category in categories),
+                )
+                notify_popular_products_sync(redis_sync_client)
             logger.info("Average reviews update completed successfully")
     except Exception as e:
         logger.error("Failed to update average reviews", exc_info=True)
         raise
+
+
+@app.task
+def flush_product_views():
+    """Перенос накопленных в redis просмотров товаров в бд"""
+    try:
+        logger.info("Starting product views flush task")
+        with session_maker_sync() as session:
+            product_dao = ProductSyncDao(session)
+            views_service = ProductViewsSyncService(redis_sync_client)
+            flush_dao = ProductViewsFlushSyncDao(session)
+            count = ProductViewsServiceSync(
+                product_dao, flush_dao, views_service
+            ).flush_views()
+        logger.info("Product views flush completed", extra={"count": count})
+    except Exception as e:
+        logger.error("Failed to flush product views", exc_info=True)
+        raise
+
+
+@app.task
+def refresh_recommendation_candidates(
+    category_ids: list[int] | None = None, user_ids: list[int] | None = None
+):
+    """
+    Пересчет таблиц кандидатов в рекомендации
+
+    По расписанию вызывается без аргументов и пересчитывает все (в том числе порядок
+    по просмотрам), точечно - с категориями и пользователями, данные которых изменились
+    """
+    try:
+        logger.info(
+            "Starting recommendation candidates refresh task",
+            extra={"category_ids": category_ids, "user_ids": user_ids},
+        )
+        with session_maker_sync() as session:
+            RecommendationCandidatesServiceSync(ProductSyncDao(session)).refresh(
+                category_ids=category_ids, user_ids=user_ids
+            )
+        invalidate_cache_tags_sync(redis_sync_client, RECOMMENDATION_TAG)
+        notify_popular_products_sync(redis_sync_client)
+        logger.info("Recommendation candidates refresh completed")
+    except Exception as e:
+        logger.error("Failed to refresh recommendation candidates", exc_info=True)
+        raise
@@ -0,0 +1,99 @@
+"""
+Бенчмарк рассылки писем о новом товаре: соединение на письмо против пула соединений.
+
+Вместо настоящего SMTP сервера поднимается локальная заглушка, которая принимает письма
+и ничего не отправляет. Стоимость TLS рукопожатия и авторизации имитируется задержкой
+при открытии соединения (--connect-delay-ms).
+
+Запуск:
+    python -m app.tests.benchmarks.bench_email_fanout --emails 2000 --chunk-size 100
+"""
+
+import argparse
+import smtplib
+import socketserver
+import threading
+import time
+from email.message import EmailMessage
+
+from app.email.pool import SMTPConnectionPool
+from app.email.services import send_emails
+
+
+class SMTPStandInHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP сервер: отвечает 250 на все команды и читает DATA до точки"""
+
+    def handle(self):
+        time.sleep(self.server.connect_delay)
+        self.wfile.write(b"220 stand-in ESMTP\r\n")
+        while line := self.rfile.readline():
+            command = line[:4].upper()
+            if command == b"EHLO":
+                self.wfile.write(b"250-stand-in\r\n250 8BITMIME\r\n")
+            elif command == b"DATA":
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                self.server.received += 1
+                self.wfile.write(b"250 OK\r\n")
+            elif command == b"QUIT":
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 OK\r\n")
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, connect_delay: float):
+        super().__init__(("127.0.0.1", 0), SMTPStandInHandler)
+        self.connect_delay = connect_delay
+        self.received = 0
+
+
+def make_messages(count: int) -> list[EmailMessage]:
+    messages = []
+    for i in range(count):
+        message = EmailMessage()
+        message["Subject"] = "Уведомление о появлении нового продукта на techzone"
+        message["From"] = "shop@techzone.local"
+        message["To"] = f"user{i}@example.com"
+        message.set_content(f"<h1>Новый товар</h1>Товар {i}", subtype="html")
+        messages.append(message)
+    return messages
+
+
+def run(name: str, messages: list[EmailMessage], chunk_size: int, pool) -> None:
+    started = time.perf_counter()
+    for i in range(0, len(messages), chunk_size):
+        send_emails(messages[i : i + chunk_size], pool=pool)
+    pool.close_all()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<24} {len(messages) / elapsed:9.1f} emails/s ({elapsed:.2f}s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--emails", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=100)
+    parser.add_argument("--connect-delay-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    server = SMTPStandIn(args.connect_delay_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+
+    def connect():
+        return smtplib.SMTP(host, port)
+
+    messages = make_messages(args.emails)
+    # max_size=0: соединение закрывается сразу после письма, как до пула
+    run("connection per email", messages, 1, SMTPConnectionPool(connect, max_size=0))
+    run(f"pool, chunks of {args.chunk_size}", messages, args.chunk_size, SMTPConnectionPool(connect))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Бенчмарк рекомендаций: три последовательных запроса против одного.
+
+Прежний конвейер ProductService.recomendation ходил в бд три раза
+(избранное -> средняя цена покупок -> рекомендации), сейчас стратегия
+выбирается в одном запросе ProductDao.get_recommendations.
+
+Запуск на заполненной бд (таблицы кандидатов должны быть пересчитаны):
+    python -m app.tests.benchmarks.bench_recommendations --user-id 3 --runs 500
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy import text
+
+from app.database import session_maker
+from app.products.dao import RECOMMENDATION_CANDIDATES_CTE, ProductDao
+
+FAVORITES_QUERY = text("SELECT product_id FROM favorite_products WHERE user_id = :user_id")
+AVG_PRICE_QUERY = text(
+    """
+    SELECT AVG(products.price) FROM purchases
+    JOIN orders USING (order_id)
+    JOIN products USING (product_id)
+    WHERE user_id = :user_id
+    """
+)
+CANDIDATES_QUERY = text(
+    RECOMMENDATION_CANDIDATES_CTE
+    + """
+    SELECT products.* FROM candidates JOIN products USING (product_id)
+    ORDER BY ABS(price - :avg_price)
+    """
+)
+
+
+async def three_round_trips(session, user_id: int):
+    """Прежний порядок запросов: каждый ждет предыдущий"""
+    favorites = (await session.execute(FAVORITES_QUERY, {"user_id": user_id})).all()
+    if not favorites:
+        return []
+    avg_price = (await session.execute(AVG_PRICE_QUERY, {"user_id": user_id})).scalar()
+    params = {"user_id": user_id, "avg_price": avg_price or 0}
+    return (await session.execute(CANDIDATES_QUERY, params)).all()
+
+
+async def one_round_trip(session, user_id: int):
+    return await ProductDao(session).get_recommendations(user_id)
+
+
+async def measure(func, user_id: int, runs: int) -> list[float]:
+    timings = []
+    async with session_maker() as session:
+        await func(session, user_id)  # прогрев соединения и плана запроса
+        for _ in range(runs):
+            started = time.perf_counter()
+            await func(session, user_id)
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(name: str, timings: list[float]) -> None:
+    quantiles = statistics.quantiles(timings, n=100)
+    print(
+        f"{name:<18} mean={statistics.mean(timings):7.2f}ms "
+        f"p50={quantiles[49]:7.2f}ms p99={quantiles[98]:7.2f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--user-id", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=500)
+    args = parser.parse_args()
+
+    report("3 round trips", await measure(three_round_trips, args.user_id, args.runs))
+    report("1 round trip", await measure(one_round_trip, args.user_id, args.runs))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+"""
+Бенчмарк поисковых движков: elasticsearch против триграммного индекса в памяти.
+
+Для каждого запроса меряется время поиска первой страницы и совпадение выдачи
+(доля общих товаров в первых --limit результатах, порядок не учитывается).
+
+Запуск на заполненной бд и построенном индексе elasticsearch:
+    python -m app.tests.benchmarks.bench_search_backends --runs 200 samsung телевизор "smart tv"
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from elasticsearch import AsyncElasticsearch
+
+from app.elasticsearch.config import ELASTICSEARCH_URL
+from app.elasticsearch.elasticsearch_dao import ElasticsearchDao
+from app.elasticsearch.services import ElasticsearchService
+from app.search.trigram import TrigramSearchBackend
+
+DEFAULT_QUERIES = ["samsung", "телевизор", "smart tv", "oled 4k", "android"]
+
+
+async def measure(backend, query_text: str, limit: int, runs: int) -> list[float]:
+    await backend.search_products(query_text, limit=limit)  # прогрев
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await backend.search_products(query_text, limit=limit)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def report(name: str, timings: list[float]) -> str:
+    quantiles = statistics.quantiles(timings, n=100)
+    return f"{name} p50={quantiles[49]:7.3f}ms p99={quantiles[98]:7.3f}ms"
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("queries", nargs="*", default=DEFAULT_QUERIES)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    trigram = TrigramSearchBackend()
+    started = time.perf_counter()
+    await trigram.load()
+    print(f"trigram index: {len(trigram.index)} products in {time.perf_counter() - started:.2f}s")
+
+    async with AsyncElasticsearch(hosts=ELASTICSEARCH_URL) as el_cl:
+        elastic = ElasticsearchService(ElasticsearchDao(el_cl))
+        for query_text in args.queries:
+            elastic_ids = {
+                product["product_id"]
+                for product in (await elastic.search_products(query_text, limit=args.limit))["items"]
+            }
+            trigram_ids = {
+                product["product_id"]
+                for product in (await trigram.search_products(query_text, limit=args.limit))["items"]
+            }
+            overlap = len(elastic_ids & trigram_ids) / max(len(elastic_ids | trigram_ids), 1)
+            print(
+                f"{query_text!r:<20} overlap={overlap:5.2f} "
+                f"{report('es', await measure(elastic, query_text, args.limit, args.runs))} | "
+                f"{report('trigram', await measure(trigram, query_text, args.limit, args.runs))}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
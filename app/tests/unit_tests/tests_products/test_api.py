@@ -0,0 +1,128 @@
+import json
+import time
+from unittest.mock import patch
+
+import pytest
+from httpx import AsyncClient
+from redis import asyncio as aioredis
+
+from app.config import settings
+from app.database import session_maker, session_maker_sync
+from app.products.cache import LocalTTLCache, ProductCacheService
+from app.products.dao import ProductDao, ProductSyncDao
+from app.products.models import Product
+from app.products.popular import popular_products
+from app.products.services import RecommendationCandidatesServiceSync
+
+
+@pytest.mark.api
+async def test_all_stream_ndjson(ac: AsyncClient):
+    """Потоковая выгрузка отдает те же товары, что и обычный ответ"""
+    response = await ac.get("/products/all")
+    response_stream = await ac.get("/products/all", params={"stream": True})
+
+    assert response_stream.status_code == 200
+    assert response_stream.headers["content-type"].startswith("application/x-ndjson")
+    products = [json.loads(line) for line in response_stream.text.splitlines()]
+    assert products == response.json()
+
+
+@pytest.mark.api
+async def test_popular_from_memory(ac: AsyncClient):
+    """Популярные товары загружаются один раз и дальше отдаются из памяти"""
+    with session_maker_sync() as sync_session:
+        RecommendationCandidatesServiceSync(ProductSyncDao(sync_session)).refresh()
+    popular_products.products = []
+    popular_products.loaded_at = None
+
+    response = await ac.get("/products/popular")
+    assert response.status_code == 200
+    assert [product["product_id"] for product in response.json()] == [2, 1, 6, 3, 4, 5]
+
+    with patch.object(popular_products, "load", side_effect=AssertionError):
+        response = await ac.get("/products/popular")
+    assert [product["product_id"] for product in response.json()] == [2, 1, 6, 3, 4, 5]
+
+
+@pytest.mark.api
+async def test_popular_empty_not_reloaded_every_call(ac: AsyncClient):
+    """Пустой список (пустой каталог, ошибка бд) не перезагружается из бд на каждый вызов"""
+    popular_products.products = []
+    popular_products.loaded_at = time.monotonic()
+    with patch.object(popular_products, "load", side_effect=AssertionError):
+        response = await ac.get("/products/popular")
+    assert response.json() == []
+    popular_products.loaded_at = None
+
+
+@pytest.mark.api
+async def test_recommendation_without_favorites_from_memory(authenticated_ac: AsyncClient):
+    """Пользователю без избранного популярные товары отдаются из памяти, без запроса рекомендаций"""
+    with session_maker_sync() as sync_session:
+        RecommendationCandidatesServiceSync(ProductSyncDao(sync_session)).refresh()
+    popular_products.products = []
+    popular_products.loaded_at = None
+
+    with patch.object(ProductDao, "get_recommendations", side_effect=AssertionError):
+        response = await authenticated_ac.get("/products/recomendation")
+    assert response.status_code == 200
+    assert [product["product_id"] for product in response.json()] == [2, 1, 6, 3, 4, 5]
+
+
+@pytest.mark.api
+async def test_product_cache_not_set_after_invalidate():
+    """Товар, прочитанный из бд до инвалидации, не записывается в кэш после нее"""
+    cache = ProductCacheService(aioredis.from_url(settings.REDIS_URL), LocalTTLCache(10, 60))
+    product = {"product_id": 1}
+
+    version = await cache.get_version(1)
+    await cache.invalidate(1)
+    await cache.set(1, product, version)
+    assert await cache.get(1) is None
+
+    await cache.set(1, product, await cache.get_version(1))
+    assert await cache.get(1) == product
+    await cache.invalidate(1)
+
+
+async def product_rating(product_id: int) -> tuple[int, int, float | None]:
+    async with session_maker() as session:
+        product = await session.get(Product, product_id)
+        return product.rating_sum, product.rating_count, product.rating
+
+
+def assert_rating(actual: tuple, rating_sum: int, rating_count: int) -> None:
+    assert actual[:2] == (rating_sum, rating_count)
+    assert actual[2] == pytest.approx(rating_sum / rating_count, abs=0.05)
+
+
+@pytest.mark.api
+async def test_review_lifecycle(authenticated_ac: AsyncClient):
+    """Добавление, изменение и удаление отзыва сразу меняют рейтинг товара, ответы - актуальный отзыв"""
+    product_id = 3
+    rating_sum, rating_count, _ = await product_rating(product_id)
+    review = {"months_used": 2, "positive": "+", "negative": "-", "comment": "ok", "rating": 4}
+
+    response = await authenticated_ac.post(f"/products/{product_id}/reviews", json=review)
+    assert response.status_code == 200
+    added = response.json()
+    assert added["rating"] == 4 and added["is_edited"] is False
+    assert_rating(await product_rating(product_id), rating_sum + 4, rating_count + 1)
+
+    response = await authenticated_ac.patch(
+        f"/products/reviews/{added['review_id']}", json={"rating": 2, "comment": "so so"}
+    )
+    assert response.status_code == 200
+    updated = response.json()
+    assert updated["rating"] == 2 and updated["comment"] == "so so" and updated["is_edited"] is True
+    assert_rating(await product_rating(product_id), rating_sum + 2, rating_count + 1)
+
+    response = await authenticated_ac.patch(
+        f"/products/reviews/{added['review_id']}", json={"comment": None}
+    )
+    assert response.status_code == 422
+
+    response = await authenticated_ac.delete(f"/products/reviews/{added['review_id']}")
+    assert response.status_code == 200
+    rating_after_delete = await product_rating(product_id)
+    assert rating_after_delete[:2] == (rating_sum, rating_count)
@@ -0,0 +1,283 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select, text
+
+from app.database import session_maker_sync
+from app.products.dao import (ProductDao, ProductIndexOutboxSyncDao,
+                              ProductSyncDao, ProductViewsFlushSyncDao)
+from app.products.models import Product
+from app.products.services import RecommendationCandidatesServiceSync
+from app.redis.cache import normalize_price_range
+from app.tests.utils import explain
+
+
+@pytest.fixture(scope="function")
+def product_dao(session):
+    return ProductDao(session)
+
+
+@pytest.mark.dao
+@pytest.mark.parametrize(
+    "sort_by, order, limit, correct_ids",
+    [
+        ("price", "asc", 2, [5, 4, 3, 1, 6, 2]),
+        ("rating", "desc", 4, [2, 1, 6, 3, 4, 5]),
+        ("product_id", "asc", 5, [1, 2, 3, 4, 5, 6]),
+    ],
+)
+async def test_get_with_filters_keyset_pages(
+    product_dao: ProductDao, sort_by, order, limit, correct_ids
+):
+    """Проход по всем страницам каталога через next_cursor"""
+    ids, cursor = [], None
+    while True:
+        products, cursor = await product_dao.get_with_filters(
+            category="Телевизоры",
+            sort_by=sort_by,
+            order=order,
+            cursor=cursor,
+            limit=limit,
+        )
+        assert len(products) <= limit
+        ids += [product.product_id for product in products]
+        if cursor is None:
+            break
+    assert ids == correct_ids
+
+
+@pytest.mark.dao
+@pytest.mark.parametrize(
+    "specification_filters, correct_ids",
+    [
+        ({"resolution": "4K", "smart_tv": "true"}, [1, 2, 6]),
+        ({"smart_tv": "true", "refresh_rate": "60", "has_hdr": "true"}, [4, 6]),
+        ({"screen_size": "32", "smart_tv": "false"}, [5]),
+        ({"screen_size": "\"32\""}, []),
+        ({"screen_size": "50-65"}, [1, 2, 3]),
+        ({"refresh_rate": "100-", "resolution": "4K"}, [1, 2]),
+        ({"screen_size": "-43", "smart_tv": "true"}, [4]),
+        # Имена и значения приводятся так же, как в ключе кэша
+        ({" resolution ": " 4K ", "brand": ""}, [1, 2, 6]),
+        # Не конечные числа json сравниваются как строки, а не падают в jsonb
+        ({"resolution": "NaN"}, []),
+        ({"screen_size": "Infinity"}, []),
+    ],
+)
+async def test_get_with_filters_specification(
+    product_dao: ProductDao, specification_filters, correct_ids
+):
+    """Фильтры по характеристикам сравниваются с учетом типа значения"""
+    products, _ = await product_dao.get_with_filters(
+        category="Телевизоры", specification_filters=specification_filters
+    )
+    assert [product.product_id for product in products] == correct_ids
+
+
+@pytest.mark.dao
+@pytest.mark.parametrize(
+    "price", ["10000-30000", " 10000 - 30000 ", "010000-30000", "10000.00-30000.0"]
+)
+async def test_get_with_filters_price_as_cache_key(product_dao: ProductDao, price):
+    """Цены, которые дают один ключ кэша (normalize_price_range), дают и одну выдачу"""
+    assert normalize_price_range(price.strip()) == "10000-30000"
+    products, _ = await product_dao.get_with_filters(category="Телевизоры", price=price)
+    assert [product.product_id for product in products] == [1, 3]
+
+
+@pytest.mark.dao
+@pytest.mark.parametrize(
+    "sort_by, order, index_name",
+    [
+        ("rating", "desc", "idx_products_category_rating"),
+        ("rating", "asc", "idx_products_category_rating_asc"),
+        ("views", "desc", "idx_products_category_views"),
+        ("views", "asc", "idx_products_category_views_asc"),
+    ],
+)
+async def test_keyset_page_uses_sort_index(
+    product_dao: ProductDao, session, sort_by, order, index_name
+):
+    """Страница каталога в обоих направлениях идет по составному индексу без сортировки"""
+    query = product_dao._keyset_page(
+        select(Product).where(Product.category_id == 1), sort_by, order, None, limit=2
+    )
+    plan = await explain(session, query)
+    assert index_name in plan.split()
+    assert "Sort" not in plan
+
+
+@pytest.mark.dao
+async def test_specification_filter_uses_gin_index(product_dao: ProductDao, session):
+    """Все фильтры по характеристикам - одно условие @>, которое идет по GIN индексу"""
+    query = product_dao._filtered_query(
+        specification_filters={"resolution": "4K", "smart_tv": "true"}
+    )
+    plan = await explain(session, query)
+    assert "idx_specification_gin" in plan
+    assert plan.count("@>") == 1
+
+
+@pytest.mark.dao
+async def test_specification_range_filter_uses_expression_index(
+    product_dao: ProductDao, session
+):
+    """Фильтр по диапазону числовой характеристики идет по индексу по выражению"""
+    query = product_dao._filtered_query(
+        category="Телевизоры", specification_filters={"screen_size": "50-65"}
+    )
+    plan = await explain(session, query)
+    assert "idx_products_spec_screen_size" in plan
+
+
+@pytest.mark.dao
+async def test_specification_open_range_only_numbers(product_dao: ProductDao, session):
+    """Открытый диапазон не находит нечисловые значения (строки меньше чисел в порядке jsonb)"""
+    await session.execute(
+        text("""UPDATE products SET specification = specification || '{"screen_size": "32"}' WHERE product_id = 5""")
+    )
+    products, _ = await product_dao.get_with_filters(
+        category="Телевизоры", specification_filters={"screen_size": "-100"}
+    )
+    assert 5 not in [product.product_id for product in products]
+    await session.rollback()
+
+
+@pytest.mark.dao
+async def test_get_facets(product_dao: ProductDao):
+    """Счетчики фильтров категории считаются одним запросом"""
+    facets = await product_dao.get_facets("Телевизоры")
+    assert facets["country_origin"] == {
+        "Южная Корея": 2,
+        "Китай": 2,
+        "Япония": 1,
+        "Польша": 1,
+    }
+    assert facets["months_warranty"] == {24: 3, 12: 2, 36: 1}
+    assert facets["rating"] == {1: 5, 2: 6, 3: 6, 4: 6}
+    assert facets["price"] == {
+        "0-9999.99": 2,
+        "10000-19999.99": 1,
+        "20000-29999.99": 1,
+        "30000-39999.99": 1,
+        "40000-49999.99": 1,
+    }
+    assert facets["specification"]["resolution"] == {"4K": 3, "Full HD": 2, "HD": 1}
+    assert facets["specification"]["smart_tv"] == {"true": 5, "false": 1}
+
+
+@pytest.mark.dao
+async def test_get_facets_price_matches_filter(product_dao: ProductDao):
+    """Счетчик диапазона цены равен количеству товаров фильтра price с этим диапазоном"""
+    # Граница диапазонов совпадает с ценой товара 4 (8999)
+    facets = await product_dao.get_facets("Телевизоры", price_step=8999)
+    assert facets["price"]["0-8998.99"] == 1
+    assert facets["price"]["8999-17997.99"] == 2
+    for price_range, count in facets["price"].items():
+        products, _ = await product_dao.get_with_filters(category="Телевизоры", price=price_range)
+        assert len(products) == count
+
+
+@pytest.mark.dao
+@pytest.mark.parametrize(
+    "user_id, correct_ids",
+    [
+        # избранное и покупки - по близости к средней цене покупок (24999.99)
+        (3, [1, 3, 6, 4, 5, 2]),
+        # избранное без покупок - по рейтингу
+        (5, [2, 1, 6, 3, 4, 5]),
+        # без избранного - популярные товары
+        (1, [2, 1, 6, 3, 4, 5]),
+    ],
+)
+async def test_get_recommendations(product_dao: ProductDao, user_id, correct_ids):
+    """Рекомендации читаются одним запросом из таблиц кандидатов после их пересчета"""
+    with session_maker_sync() as sync_session:
+        RecommendationCandidatesServiceSync(ProductSyncDao(sync_session)).refresh()
+
+    products = await product_dao.get_recommendations(user_id)
+    assert [product["product_id"] for product in products] == correct_ids
+
+
+@pytest.mark.dao
+async def test_get_user_emails_for_new_product(product_dao: ProductDao):
+    """Пользователи с любимой категорией товара берутся из user_favorite_categories"""
+    with session_maker_sync() as sync_session:
+        RecommendationCandidatesServiceSync(ProductSyncDao(sync_session)).refresh()
+    product = SimpleNamespace(category_id=1)
+
+    emails = await product_dao.get_user_emails_for_send_emails_about_new_product(product)
+    assert sorted(emails) == ["buyer@example.com", "user1@gmail.com", "user2@gmail.com"]
+    product.category_id = 2
+    assert await product_dao.get_user_emails_for_send_emails_about_new_product(product) == []
+
+
+@pytest.mark.dao
+def test_update_avg_reviews_since_watermark():
+    """Пересчитываются только товары с отзывами, измененными после watermark"""
+    with session_maker_sync() as sync_session:
+        product_sync_dao = ProductSyncDao(sync_session)
+        sync_session.execute(
+            text("UPDATE products SET rating = 1 WHERE product_id IN (1, 2, 3, 4)")
+        )
+
+        changed = product_sync_dao.update_avg_reviews(since=datetime(2024, 3, 1))
+        assert sorted(changed) == [1, 3, 4]
+        assert product_sync_dao.update_avg_reviews() == [2]
+        assert product_sync_dao.update_avg_reviews() == []
+        sync_session.rollback()
+
+
+@pytest.mark.dao
+async def test_apply_rating_delta(product_dao: ProductDao, session):
+    """Рейтинг пересчитывается из суммы и количества оценок, без оценок он пустой"""
+    await session.execute(
+        text("UPDATE products SET rating_sum = 9, rating_count = 2 WHERE product_id = 1")
+    )
+
+    row = await product_dao.apply_rating_delta(1, sum_delta=3, count_delta=1)
+    assert row.category_title == "Телевизоры"
+    rating = await session.scalar(text("SELECT rating FROM products WHERE product_id = 1"))
+    assert rating == 4.0
+
+    await product_dao.apply_rating_delta(1, sum_delta=-12, count_delta=-3)
+    rating = await session.scalar(text("SELECT rating FROM products WHERE product_id = 1"))
+    assert rating is None
+
+    assert await product_dao.apply_rating_delta(10_000, sum_delta=5, count_delta=1) is None
+    await session.rollback()
+
+
+@pytest.mark.dao
+def test_product_index_outbox_trigger():
+    """Изменения и удаления товаров попадают в очередь индекса, UPDATE без изменений и служебных полей - нет"""
+    with session_maker_sync() as sync_session:
+        outbox_dao = ProductIndexOutboxSyncDao(sync_session)
+        outbox_ids = outbox_dao.get_ids()
+        if outbox_ids:
+            outbox_dao.delete(outbox_ids)
+
+        sync_session.execute(text("UPDATE products SET views = views WHERE product_id = 1"))
+        sync_session.execute(text("UPDATE products SET views = views + 1 WHERE product_id = 3"))
+        sync_session.execute(
+            text("UPDATE products SET rating_sum = rating_sum + 1 WHERE product_id = 4")
+        )
+        sync_session.execute(text("UPDATE products SET price = price + 1 WHERE product_id = 2"))
+        sync_session.execute(text("DELETE FROM products WHERE product_id = 5"))
+        sync_session.execute(text("UPDATE products SET price = price + 1 WHERE product_id = 2"))
+
+        _, product_ids = outbox_dao.get_changes(limit=100)
+        assert product_ids == [2, 5]
+        sync_session.rollback()
+
+
+@pytest.mark.dao
+def test_product_views_flush_added_once():
+    """Повторный перенос просмотров с тем же id не отмечается и пропускается"""
+    with session_maker_sync() as sync_session:
+        flush_dao = ProductViewsFlushSyncDao(sync_session)
+        flush_dao.lock()
+        assert flush_dao.add("a" * 32) is True
+        assert flush_dao.add("a" * 32) is False
+        sync_session.rollback()
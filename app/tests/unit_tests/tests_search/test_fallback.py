@@ -0,0 +1,106 @@
+import pytest
+from fastapi import HTTPException, status
+
+from app.elasticsearch.services import \
+    SEARCH_CURSOR_ENGINE as ELASTICSEARCH_CURSOR_ENGINE
+from app.products.dao import ProductDao
+from app.products.pagination import encode_search_cursor
+from app.search.backend import SearchBackend
+from app.search.breaker import CircuitBreaker
+from app.search.fallback import FallbackSearchBackend
+from app.search.postgres import PostgresSearchBackend
+from app.search.trigram import TrigramSearchBackend
+
+
+class FailingBackend(SearchBackend):
+    """Основной движок, который отвечает ошибкой с заданным статусом"""
+
+    def __init__(self, status_code: int):
+        self.status_code = status_code
+        self.calls = 0
+
+    async def search_products(self, query_text, limit=20, cursor=None, with_total=False):
+        self.calls += 1
+        raise HTTPException(status_code=self.status_code, detail="error")
+
+    async def suggest_products(self, prefix):
+        self.calls += 1
+        raise HTTPException(status_code=self.status_code, detail="error")
+
+
+@pytest.mark.dao
+@pytest.mark.parametrize("query_text", ["samsung", "телевизор", "oled", "dolby"])
+async def test_postgres_search_same_as_trigram(session, query_text):
+    """Для запроса из одного слова (idf не влияет на порядок) выдача postgres совпадает с триграммным индексом"""
+    trigram_backend = TrigramSearchBackend()
+    await trigram_backend.load()
+    postgres_backend = PostgresSearchBackend(ProductDao(session))
+
+    expected = await trigram_backend.search_products(query_text, limit=100, with_total=True)
+    ids, cursor = [], None
+    while True:
+        page = await postgres_backend.search_products(query_text, limit=2, cursor=cursor, with_total=True)
+        ids += [product["product_id"] for product in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert ids == [product["product_id"] for product in expected["items"]]
+    assert page["total"] == expected["total"]
+
+
+@pytest.mark.dao
+async def test_postgres_search_rejects_other_engine_cursor(session):
+    """Курсор другого движка (оценки несравнимы) отклоняется, а не дает сбой порядка страниц"""
+    trigram_backend = TrigramSearchBackend()
+    await trigram_backend.load()
+    postgres_backend = PostgresSearchBackend(ProductDao(session))
+
+    page = await trigram_backend.search_products("телевизор", limit=1)
+    with pytest.raises(HTTPException) as exc_info:
+        await postgres_backend.search_products("телевизор", limit=1, cursor=page["next_cursor"])
+    assert exc_info.value.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    with pytest.raises(HTTPException) as exc_info:
+        await postgres_backend.search_products(
+            "телевизор", cursor=encode_search_cursor(ELASTICSEARCH_CURSOR_ENGINE, [1.5, 1])
+        )
+    assert exc_info.value.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.dao
+async def test_fallback_opens_breaker(session):
+    """Ошибки основного движка обслуживаются резервным, после порога основной не вызывается"""
+    primary = FailingBackend(status.HTTP_503_SERVICE_UNAVAILABLE)
+    search_breaker = CircuitBreaker("test_search", failure_threshold=2, reset_timeout=60)
+    suggest_breaker = CircuitBreaker("test_suggest", failure_threshold=2, reset_timeout=60)
+    backend = FallbackSearchBackend(
+        primary, PostgresSearchBackend(ProductDao(session)), search_breaker, suggest_breaker
+    )
+
+    for _ in range(3):
+        page = await backend.search_products("samsung")
+        assert page["items"][0]["product_id"] == 1
+    assert primary.calls == 2
+    assert search_breaker.state == CircuitBreaker.OPEN
+
+    # У подсказок свой автомат, он еще замкнут
+    await backend.suggest_products("sams")
+    assert primary.calls == 3
+    assert suggest_breaker.state == CircuitBreaker.CLOSED
+
+    search_breaker.opened_at -= 60
+    assert search_breaker.state == CircuitBreaker.HALF_OPEN
+    await backend.search_products("samsung")
+    assert primary.calls == 4
+    assert search_breaker.state == CircuitBreaker.OPEN
+
+
+@pytest.mark.dao
+async def test_fallback_client_error(session):
+    """Ошибка запроса (4xx) отдается как есть и не размыкает автомат"""
+    primary = FailingBackend(status.HTTP_422_UNPROCESSABLE_ENTITY)
+    breaker = CircuitBreaker("test_search", failure_threshold=1, reset_timeout=60)
+    backend = FallbackSearchBackend(primary, PostgresSearchBackend(ProductDao(session)), breaker)
+
+    with pytest.raises(HTTPException):
+        await backend.search_products("samsung")
+    assert breaker.state == CircuitBreaker.CLOSED
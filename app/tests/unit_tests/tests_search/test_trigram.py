@@ -0,0 +1,53 @@
+import pytest
+
+from app.search.trigram import TrigramSearchBackend
+
+
+@pytest.fixture(scope="module")
+async def trigram_backend():
+    backend = TrigramSearchBackend()
+    await backend.load()
+    return backend
+
+
+@pytest.mark.dao
+@pytest.mark.parametrize(
+    "query_text, first_id",
+    [
+        ("samsung", 1),
+        ("SAMSUNG телевизор", 1),
+        ("oled", 2),
+        ("dolby", 6),
+    ],
+)
+async def test_search_title_boost(trigram_backend: TrigramSearchBackend, query_text, first_id):
+    """Совпадение в названии важнее совпадения в описании (title^2)"""
+    page = await trigram_backend.search_products(query_text)
+    assert page["items"][0]["product_id"] == first_id
+
+
+@pytest.mark.dao
+async def test_search_pages(trigram_backend: TrigramSearchBackend):
+    """Проход по страницам поиска через next_cursor дает ту же выдачу, что и одна страница"""
+    full = await trigram_backend.search_products("телевизор", limit=100, with_total=True)
+    ids, cursor = [], None
+    while True:
+        page = await trigram_backend.search_products("телевизор", limit=2, cursor=cursor)
+        ids += [product["product_id"] for product in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert ids == [product["product_id"] for product in full["items"]]
+    assert full["total"] == len(ids)
+
+
+@pytest.mark.dao
+async def test_refresh_removes_deleted(trigram_backend: TrigramSearchBackend):
+    """Товары, которых нет в бд, удаляются из индекса при обновлении"""
+    trigram_backend.index.upsert(
+        {"product_id": 10_000, "title": "Trigram Test", "description": "test"}
+    )
+    assert (await trigram_backend.suggest_products("trigram t"))[0]["product_id"] == 10_000
+
+    await trigram_backend.refresh([10_000])
+    assert await trigram_backend.suggest_products("trigram t") == []
@@ -1,4 +1,6 @@
 from sqlalchemy import text
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
 
 from app.logger import logger
 
@@ -36,4 +38,24 @@ async def reset_sequences(conn):
                 true
             )
         """))
-    logger.debug(msg='sequence success reset')  
\ No newline at end of file
+    logger.debug(msg='sequence success reset')  
+
+class Explain(Executable, ClauseElement):
+    """EXPLAIN для запроса sqlalchemy (параметры запроса биндятся как обычно)"""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN " + compiler.process(element.statement, **kw)
+
+
+async def explain(session, statement) -> str:
+    """План запроса с выключенным seq scan (на маленьких тестовых таблицах он всегда дешевле индекса)"""
+    await session.execute(text("SET LOCAL enable_seqscan = off"))
+    result = await session.execute(Explain(statement))
+    return "\n".join(row[0] for row in result)